@@ -3,6 +3,7 @@
 #include <iomanip>
 #include <iostream>
 #include <sstream>
+#include <string>
 #include <limits>
 
 #include <backends/cxxrtl/cxxrtl_vcd.h>
@@ -96,18 +97,16 @@ public:
   Panel & operator=(Panel & other) = delete;
   Panel & operator=(Panel && other) = delete;
 
-  void brighness_tick(ShiftReg<Columns> * rows, size_t y) {
+  // Adds ``ticks`` half clocks of the latched ``rows`` to row ``y``. The
+  // harness only calls this when the latches, the row address or the frame
+  // change, with the number of unblanked half clocks since the last call.
+  void brightness_add(ShiftReg<Columns> * rows, size_t y, uint32_t ticks) {
     y = Columns - y - 1;
     for (int i = 0; i < 3; ++i) {
       for (size_t x = 0; x < Rows; ++x) {
         size_t idx = (y * 64 + x) * 3 + i;
-        if (brightness[idx] >= std::numeric_limits<Storage>::max() - 2) {
-          if (rows[i][x] != 0) {
-            brightness[idx] = std::numeric_limits<Storage>::max();
-          }
-        } else {
-          brightness[idx] += rows[i][x] * 2;
-        }
+        uint64_t value = uint64_t(brightness[idx]) + uint64_t(rows[i][x]) * 2 * ticks;
+        brightness[idx] = Storage(std::min<uint64_t>(value, std::numeric_limits<Storage>::max()));
       }
     }
   }
@@ -169,7 +168,44 @@ std::ostream & operator<<(std::ostream & o, Panel<Rows, Columns> & p) {
   return o;
 }
 
+void usage(const char * name) {
+  std::cerr << "usage: " << name << " [--frames N] [--vcd FILE] [--vcd-from STEP] [--vcd-to STEP]" << std::endl
+            << std::endl
+            << "Runs the design for N frames (default 16), writing what the panel shows to" << std::endl
+            << "imgs/. Waves are only written with --vcd, for the clock cycles in" << std::endl
+            << "[--vcd-from, --vcd-to), which default to the whole run." << std::endl;
+}
+
 int main(int argc, const char ** argv) {
+  uint32_t frames = 16;
+  const char * vcd_path = nullptr;
+  uint64_t vcd_from = 0;
+  uint64_t vcd_to = std::numeric_limits<uint64_t>::max();
+
+  for (int i = 1; i < argc; ++i) {
+    std::string arg = argv[i];
+    if (arg == "--help" || arg == "-h") {
+      usage(argv[0]);
+      return 0;
+    }
+    if (i + 1 == argc) {
+      usage(argv[0]);
+      return 1;
+    }
+    if (arg == "--frames") {
+      frames = std::stoul(argv[++i]);
+    } else if (arg == "--vcd") {
+      vcd_path = argv[++i];
+    } else if (arg == "--vcd-from") {
+      vcd_from = std::stoull(argv[++i]);
+    } else if (arg == "--vcd-to") {
+      vcd_to = std::stoull(argv[++i]);
+    } else {
+      usage(argv[0]);
+      return 1;
+    }
+  }
+
   cxxrtl_design::p_top top;
 
   cxxrtl::debug_items all_debug_items;
@@ -179,79 +215,112 @@ int main(int argc, const char ** argv) {
   cxxrtl::vcd_writer vcd;
   vcd.timescale(1, "us");
 
-  vcd.add_without_memories(all_debug_items);
-
-  std::ofstream waves("waves.vcd");
+  std::ofstream waves;
+  if (vcd_path) {
+    vcd.add_without_memories(all_debug_items);
+    waves.open(vcd_path);
+  }
 
   top.step();
 
-  vcd.sample(0);
+  if (vcd_path && vcd_from == 0) {
+    vcd.sample(0);
+  }
 
   top.p_rst.set<bool>(true);
 
   ShiftReg<64> display_chain[6];
 
-  std::array<uint16_t, 64 * 64 * 3> accumulators;
-  std::fill(accumulators.begin(), accumulators.end(), 0x0);
-
   Panel<64, 64> panel{};
 
-  int steps = 0;
+  // Brightness is only added up when the latches, the row address or the
+  // frame change. ``lit`` counts the unblanked half clocks since then, and
+  // ``lit_addr`` is the row they were spent on.
+  uint32_t lit = 0;
+  uint32_t lit_addr = 0;
+  auto flush = [&]() {
+    if (lit != 0) {
+      panel.brightness_add(&display_chain[0], lit_addr, lit);
+      panel.brightness_add(&display_chain[3], lit_addr + 32, lit);
+      lit = 0;
+    }
+  };
+  auto clear = [&]() {
+    lit = 0;
+    panel.clear();
+  };
+  // Latches the shift registers on the falling edge of ``latch``
+  bool latch_line = false;
+  auto set_latch = [&](bool latch) {
+    if (latch_line && !latch) {
+      flush();
+    }
+    for (int i = 0; i < 6; ++i) {
+      display_chain[i].set_latch(latch);
+    }
+    latch_line = latch;
+  };
+  auto set_addr = [&](uint32_t addr) {
+    if (addr != lit_addr) {
+      flush();
+      lit_addr = addr;
+    }
+  };
+
+  uint64_t steps = 0;
   uint32_t last_frame = uint32_t(-1);
-  uint32_t last_subframe = uint32_t(-1);
-  uint32_t last_addr = uint32_t(-1);
   uint32_t frame = uint32_t(-1);
-  uint32_t addr = uint32_t(-1);
-  uint32_t subframe = uint32_t(-1);
   uint32_t o_rdy_high = 0;
-  while (top.p_o__frame.get<uint32_t>() < 16) {
+  while (top.p_o__frame.get<uint32_t>() < frames) {
+    bool sample = vcd_path && steps >= vcd_from && steps < vcd_to;
+
     top.p_clk.set<bool>(true);
     top.step();
 
     // Sample the rising clock edge
-    vcd.sample(steps * 2 + 0);
-    addr = top.p_o__addr.get<uint32_t>();
-    frame = top.p_o__frame.get<uint32_t>();
-    subframe = top.p_o__subframe.get<uint32_t>();
-
-    // If we have switched LED banks, dump shift register state
-    if (addr != last_addr) {
-      uint32_t subframe = top.p_o__subframe.get<uint32_t>();
-      uint32_t frame = top.p_o__frame.get<uint32_t>();
-
-      // if ((frame == 0 || frame == 1) && last_addr == frame) {
-      //   std::cout << std::setw(3) << frame << "|" << std::setw(3) << subframe << "|" << std::setw(3) << last_addr << "|"
-      //             << display_chain[1] << std::endl;
-      // }
+    if (sample) {
+      vcd.sample(steps * 2 + 0);
     }
+    set_addr(top.p_o__addr.get<uint32_t>());
+    frame = top.p_o__frame.get<uint32_t>();
 
     if (frame != last_frame) {
       std::cout << "Process frame: " << std::setw(5) << frame << std::endl;
+      flush();
       panel.frame = frame;
       panel.on_next_frame();
     }
     last_frame = frame;
 
     if (o_rdy_high == 128) {
-      panel.clear();
+      clear();
     }
 
     // Count the number of clocks o_rdy has been high for
     if (top.p_o__rdy.get<bool>()) {
       o_rdy_high++;
     }
-    // std::cout << "NOT READY " << top.p_driver_2e_fsm__state.get<uint32_t>() << std::endl;
 
-    if (subframe != last_subframe) {
-      if (subframe == 0 && frame != panel.frame) {
-        // panel.on_next_frame();
-        // panel.frame = frame;
-      }
-      // std::cout << "STEPS[" << steps << "]" << "RUNNING[" << o_rdy_high << "]" << "SUBFRAME[" << subframe << "] " << panel << std::endl;
+    // Rising edge is bit 0 of the latch output
+    set_latch((top.p_o__latch.get<uint8_t>() & 0b01) == 0b01);
+
+    // accumulate brightness for the rising edge
+    if (!(top.p_o__blank.get<uint8_t>() & 0b10)) {
+      lit++;
+    }
+
+    top.p_clk.set<bool>(false);
+    top.step();
+
+    // Sample the falling clock edge
+    if (sample) {
+      vcd.sample(steps * 2 + 1);
     }
-    last_subframe = subframe;
+    set_addr(top.p_o__addr.get<uint32_t>());
 
-    // Shift registers clock in on rising edge
+    // sclk == 0b10 rises in the middle of the cycle, before the second half
+    // of the latch output is applied. The outputs only change on the rising
+    // clock edge, so it's fine to sample the colors here.
     if (top.p_o__sclk.get<uint8_t>() == 0b10) {
       uint8_t rgb0 = top.p_o__rgb0.get<uint8_t>();
       uint8_t rgb1 = top.p_o__rgb1.get<uint8_t>();
@@ -264,52 +333,30 @@ int main(int argc, const char ** argv) {
       display_chain[5].clock_in(rgb1 & 0b100 ? 1 : 0);
     }
 
-    // Rising edge is bit 0 of the latch output
-    bool is_latch = (top.p_o__latch.get<uint8_t>() & 0b01) == 0b01;
-    for (int i = 0; i < 6; ++i) {
-      display_chain[i].set_latch(is_latch);
-    }
-
-    // accumulate brightness for the rising edge
-    if (!(top.p_o__blank.get<uint8_t>() & 0b10)) {
-      panel.brighness_tick(&display_chain[0], addr);
-      panel.brighness_tick(&display_chain[3], addr + 32);
-    }
-
-    top.p_clk.set<bool>(false);
-    top.step();
-
-    // Sample the falling clock edge
-    vcd.sample(steps * 2 + 1);
-    addr = top.p_o__addr.get<uint32_t>();
-    frame = top.p_o__frame.get<uint32_t>();
-    subframe = top.p_o__subframe.get<uint32_t>();
-
     // Falling edge is bit 1 of the latch output
-    is_latch = (top.p_o__latch.get<uint8_t>() & 0b10) == 0b10;
-    for (int i = 0; i < 6; ++i) {
-      display_chain[i].set_latch(is_latch);
-    }
+    set_latch((top.p_o__latch.get<uint8_t>() & 0b10) == 0b10);
 
     // accumulate brightness for the falling edge
     if (!(top.p_o__blank.get<uint8_t>() & 0b01)) {
-      panel.brighness_tick(&display_chain[0], addr);
-      panel.brighness_tick(&display_chain[3], addr + 32);
+      lit++;
     }
 
-    last_addr = addr;
-
     // Deassert reset 10 steps into the simulation
     if (steps > 10) {
       top.p_rst.set<bool>(false);
       if (steps == 11) {
-        panel.clear();
+        clear();
       }
     }
 
     // Dump waves
-    waves << vcd.buffer;
-    vcd.buffer.clear();
+    if (sample) {
+      waves << vcd.buffer;
+      vcd.buffer.clear();
+    }
     steps++;
   }
+
+  // For main.py bench
+  std::cout << "cycles: " << steps << std::endl;
 }
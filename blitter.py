@@ -0,0 +1,256 @@
+from amaranth import *
+from amaranth.lib import data
+from amaranth.lib.fifo import SyncFIFO
+from enum import IntEnum
+
+class BlitOp(IntEnum):
+    """ Operation of a :class:`Blitter` command """
+
+    #: Fill the rectangle from ``(x0, y0)`` to ``(x1, y1)`` with the color in
+    #: ``arg``
+    FILL = 0
+    #: Copy into the rectangle from ``(x0, y0)`` to ``(x1, y1)`` from the
+    #: rectangle of the same size with its top left corner at ``arg``, which
+    #: holds the x coordinate in its low bits and the y coordinate above them
+    COPY = 1
+    #: Draw a line from ``(x0, y0)`` to ``(x1, y1)`` in the color in ``arg``
+    LINE = 2
+
+class Blitter(Elaboratable):
+    """
+    Draws rectangles and lines into the painters' framebuffers from a queue of
+    commands.
+
+    The framebuffers are stacked into one canvas, like
+    :class:`stream.StreamDecoder` does, so ``painters[0]`` holds rows
+    ``0`` to ``height - 1`` and so on. Rectangles and lines may cross between
+    framebuffers, and copies may read from a different framebuffer than they
+    write to.
+
+    Commands are written into a FIFO and drawn one pixel per cycle, plus one
+    cycle between commands when the FIFO runs empty. Overlapping copies work
+    like ``memmove``. :attr:`BlitOp.COPY` needs every framebuffer to be built
+    with ``aux_read``, otherwise copies are dropped.
+
+    Parameters
+    ----------
+    painters : list
+        Painters to draw with, all with framebuffers of the same size. Their
+        ``fb_w_*`` ports, and the ``aux_r_*`` ports of their framebuffers,
+        are driven by the blitter.
+    depth : int
+        Number of commands the FIFO holds
+
+    Attributes
+    ----------
+    layout : StructLayout
+        Layout of a command, see :class:`BlitOp`. Corners are inclusive, and
+        rectangles need ``x0 <= x1`` and ``y0 <= y1``. :meth:`fill`,
+        :meth:`copy` and :meth:`line` build constant commands.
+    i_command : Signal(layout), input
+        Command to queue
+    i_valid : Signal(1), input
+        Queues ``i_command`` when ``o_ready`` is high
+    o_ready : Signal(1), output
+        High when there is room in the FIFO
+    o_busy : Signal(1), output
+        High while commands are queued or being drawn. Once this is low,
+        everything queued is in the framebuffers.
+    """
+    def __init__(self, painters, depth=16):
+        framebuffer = painters[0].framebuffer
+        for painter in painters:
+            assert painter.framebuffer.width == framebuffer.width
+            assert painter.framebuffer.height == framebuffer.height
+
+        self.painters = painters
+        self.depth = depth
+        self.fb_width = framebuffer.width
+        self.fb_height = framebuffer.height
+        self.width = framebuffer.width
+        self.height = framebuffer.height * len(painters)
+
+        self.x_bits = Shape.cast(range(self.width)).width
+        self.y_bits = Shape.cast(range(self.height)).width
+        self.layout = data.StructLayout({
+            "op": 2,
+            "x0": self.x_bits,
+            "y0": self.y_bits,
+            "x1": self.x_bits,
+            "y1": self.y_bits,
+            "arg": max(24, self.x_bits + self.y_bits),
+        })
+
+        self.i_command = Signal(self.layout)
+        self.i_valid = Signal()
+        self.o_ready = Signal()
+        self.o_busy = Signal()
+
+    def fill(self, x, y, w, h, color):
+        """ Command filling ``w`` by ``h`` pixels from ``(x, y)`` with ``color`` """
+        return self.layout.const({
+            "op": BlitOp.FILL.value,
+            "x0": x, "y0": y, "x1": x + w - 1, "y1": y + h - 1,
+            "arg": color,
+        })
+
+    def copy(self, src_x, src_y, x, y, w, h):
+        """ Command copying ``w`` by ``h`` pixels from ``(src_x, src_y)`` to ``(x, y)`` """
+        return self.layout.const({
+            "op": BlitOp.COPY.value,
+            "x0": x, "y0": y, "x1": x + w - 1, "y1": y + h - 1,
+            "arg": src_x | (src_y << self.x_bits),
+        })
+
+    def line(self, x0, y0, x1, y1, color):
+        """ Command drawing a line from ``(x0, y0)`` to ``(x1, y1)`` in ``color`` """
+        return self.layout.const({
+            "op": BlitOp.LINE.value,
+            "x0": x0, "y0": y0, "x1": x1, "y1": y1,
+            "arg": color,
+        })
+
+    def elaborate(self, platform):
+        m = Module()
+
+        (width, height) = (self.fb_width, self.fb_height)
+        framebuffers = [painter.framebuffer for painter in self.painters]
+        can_copy = all(getattr(fb, 'aux_read', False) for fb in framebuffers)
+
+        m.submodules.fifo = fifo = SyncFIFO(width=self.layout.size, depth=self.depth)
+        m.d.comb += [
+            fifo.w_data.eq(self.i_command),
+            fifo.w_en.eq(self.i_valid),
+            self.o_ready.eq(fifo.w_rdy),
+        ]
+
+        next_cmd = data.View(self.layout, fifo.r_data)
+        cmd = Signal(self.layout)
+
+        def in_framebuffer(x, y, i):
+            return (y >= i * height) & (y < (i + 1) * height) & (x < width)
+
+        def fb_addr(x, y, i):
+            return (y - i * height) * width + x
+
+        # Pixel being drawn
+        x = Signal(self.x_bits)
+        y = Signal(self.y_bits)
+        px_en = Signal()
+
+        # Copies are drawn in reverse when the destination comes after the
+        # source, so the source isn't overwritten before it is read
+        reverse = Signal()
+
+        def src_corner(cmd):
+            return (cmd.arg[:self.x_bits], cmd.arg[self.x_bits:self.x_bits + self.y_bits])
+
+        (src_x0, src_y0) = src_corner(cmd)
+        src_x = (src_x0 + x - cmd.x0)[:self.x_bits]
+        src_y = (src_y0 + y - cmd.y0)[:self.y_bits]
+
+        # Bresenham error terms, dy is negative
+        err_width = max(self.x_bits, self.y_bits) + 2
+        err = Signal(signed(err_width))
+        dx = Signal(signed(err_width))
+        dy = Signal(signed(err_width))
+
+        def start():
+            """ Moves on to the next command in the FIFO, if there is one """
+            m.d.comb += fifo.r_en.eq(1)
+            with m.If(fifo.r_rdy):
+                m.d.sync += cmd.eq(next_cmd)
+                with m.Switch(next_cmd.op):
+                    with m.Case(*([BlitOp.FILL, BlitOp.COPY] if can_copy else [BlitOp.FILL])):
+                        (next_src_x, next_src_y) = src_corner(next_cmd)
+                        rev = (next_cmd.op == BlitOp.COPY) & (
+                            (next_cmd.y0 > next_src_y) |
+                            ((next_cmd.y0 == next_src_y) & (next_cmd.x0 > next_src_x)))
+                        m.d.sync += [
+                            reverse.eq(rev),
+                            x.eq(Mux(rev, next_cmd.x1, next_cmd.x0)),
+                            y.eq(Mux(rev, next_cmd.y1, next_cmd.y0)),
+                        ]
+                        m.next = "RECT"
+                    with m.Case(BlitOp.LINE):
+                        adx = Mux(next_cmd.x1 >= next_cmd.x0, next_cmd.x1 - next_cmd.x0, next_cmd.x0 - next_cmd.x1)
+                        ady = Mux(next_cmd.y1 >= next_cmd.y0, next_cmd.y1 - next_cmd.y0, next_cmd.y0 - next_cmd.y1)
+                        m.d.sync += [
+                            x.eq(next_cmd.x0),
+                            y.eq(next_cmd.y0),
+                            dx.eq(adx),
+                            dy.eq(-ady),
+                            err.eq(adx - ady),
+                        ]
+                        m.next = "LINE"
+                    with m.Default():
+                        m.next = "IDLE"
+            with m.Else():
+                m.next = "IDLE"
+
+        with m.FSM() as fsm:
+            with m.State("IDLE"):
+                start()
+            with m.State("RECT"):
+                m.d.comb += px_en.eq(1)
+                x_start = Mux(reverse, cmd.x1, cmd.x0)
+                x_end = Mux(reverse, cmd.x0, cmd.x1)
+                y_end = Mux(reverse, cmd.y0, cmd.y1)
+                with m.If(x == x_end):
+                    m.d.sync += x.eq(x_start)
+                    with m.If(y == y_end):
+                        start()
+                    with m.Else():
+                        m.d.sync += y.eq(Mux(reverse, y - 1, y + 1))
+                with m.Else():
+                    m.d.sync += x.eq(Mux(reverse, x - 1, x + 1))
+            with m.State("LINE"):
+                m.d.comb += px_en.eq(1)
+                e2 = err * 2
+                step_x = e2 >= dy
+                step_y = e2 <= dx
+                with m.If((x == cmd.x1) & (y == cmd.y1)):
+                    start()
+                with m.Else():
+                    m.d.sync += err.eq(err + Mux(step_x, dy, 0) + Mux(step_y, dx, 0))
+                    with m.If(step_x):
+                        m.d.sync += x.eq(Mux(cmd.x1 > cmd.x0, x + 1, x - 1))
+                    with m.If(step_y):
+                        m.d.sync += y.eq(Mux(cmd.y1 > cmd.y0, y + 1, y - 1))
+
+        # Copies read the source this cycle, so every pixel is written the
+        # cycle after it is drawn. That keeps the writes of one command from
+        # colliding with the next.
+        w_en = Signal()
+        w_copy = Signal()
+        w_x = Signal(self.x_bits)
+        w_y = Signal(self.y_bits)
+        w_color = Signal(24)
+        w_src = Signal(range(len(framebuffers)))
+        m.d.sync += [
+            w_en.eq(px_en),
+            w_copy.eq(cmd.op == BlitOp.COPY),
+            w_x.eq(x),
+            w_y.eq(y),
+            w_color.eq(cmd.arg[:24]),
+        ]
+
+        copied = Signal(24)
+        for (i, fb) in enumerate(framebuffers):
+            if can_copy:
+                m.d.comb += fb.aux_r_addr.eq(fb_addr(src_x, src_y, i))
+                with m.If(in_framebuffer(src_x, src_y, i)):
+                    m.d.sync += w_src.eq(i)
+                with m.If(w_src == i):
+                    m.d.comb += copied.eq(fb.aux_r_data)
+
+        for (i, painter) in enumerate(self.painters):
+            m.d.comb += [
+                painter.fb_w_addr.eq(fb_addr(w_x, w_y, i)),
+                painter.fb_w_data.eq(Mux(w_copy, copied, w_color)),
+                painter.fb_w_enable.eq(w_en & in_framebuffer(w_x, w_y, i)),
+            ]
+
+        m.d.comb += self.o_busy.eq(~fsm.ongoing("IDLE") | fifo.r_rdy | w_en)
+
+        return m
@@ -0,0 +1,251 @@
+from amaranth import *
+from amaranth.lib.fifo import SyncFIFO
+from painters.fluid_sim import PixelFormat
+from stream import StreamDecoder
+
+class SPIFlashReader(Elaboratable):
+    """
+    Streams bytes out of a SPI NOR flash with a single fast read command.
+
+    The SPI clock runs at half the module clock. The command and address are
+    always sent on IO0, and data comes back on 1, 2 or 4 lines using the
+    fast read (``0x0B``), dual output (``0x3B``) or quad output (``0x6B``)
+    commands, all with 8 dummy clocks. Quad reads need the flash's QE status
+    bit to be set. The SPI clock is paused while ``o_data`` hasn't been
+    consumed, so reads can run at whatever rate the consumer needs.
+
+    Parameters
+    ----------
+    data_width : int
+        Number of data lines to read on: 1, 2 or 4
+
+    Attributes
+    ----------
+    i_start : Signal(1), input
+        Starts reading from ``i_address``. Any read in progress is abandoned.
+    i_stop : Signal(1), input
+        Ends the read in progress
+    i_address : Signal(24), input
+        Byte address to start reading from
+    o_data : Signal(8), output
+        Byte read from the flash
+    o_valid : Signal(1), output
+        High while ``o_data`` holds a byte which hasn't been consumed
+    i_ready : Signal(1), input
+        The byte on ``o_data`` is consumed in cycles where this and
+        ``o_valid`` are high
+    o_cs : Signal(1), output
+        Chip select, active high
+    o_clk : Signal(1), output
+        SPI clock
+    o_dq : Signal(4), output
+        Output values for IO0-IO3. IO2 and IO3 are the active-low write
+        protect and hold pins, so they are driven high unless reading on
+        them.
+    o_dq_oe : Signal(4), output
+        Output enables for IO0-IO3
+    i_dq : Signal(4), input
+        Input values from IO0-IO3
+    """
+    COMMANDS = {
+        1: 0x0b,
+        2: 0x3b,
+        4: 0x6b,
+    }
+    DUMMY_CLOCKS = 8
+
+    def __init__(self, data_width=1):
+        assert data_width in self.COMMANDS
+
+        self.data_width = data_width
+
+        self.i_start = Signal()
+        self.i_stop = Signal()
+        self.i_address = Signal(24)
+        self.o_data = Signal(8)
+        self.o_valid = Signal()
+        self.i_ready = Signal()
+
+        self.o_cs = Signal()
+        self.o_clk = Signal()
+        self.o_dq = Signal(4)
+        self.o_dq_oe = Signal(4)
+        self.i_dq = Signal(4)
+
+    def elaborate(self, platform):
+        m = Module()
+
+        width = self.data_width
+
+        # Each SPI clock is two cycles: outputs change while the clock is low,
+        # and inputs are sampled while it is high
+        phase = Signal()
+        m.d.comb += self.o_clk.eq(phase)
+
+        out_shift = Signal(32)
+        in_shift = Signal(8)
+        counter = Signal(range(32))
+
+        with m.If(self.o_valid & self.i_ready):
+            m.d.sync += self.o_valid.eq(0)
+
+        # Command and address go out MSB first on IO0, and the other lines
+        # idle high
+        m.d.comb += self.o_dq.eq(Cat(out_shift[-1], 1, 1, 1))
+
+        def start_stop():
+            with m.If(self.i_stop):
+                m.next = "IDLE"
+            with m.If(self.i_start):
+                m.d.sync += [
+                    out_shift.eq(Cat(self.i_address, Const(self.COMMANDS[width], 8))),
+                    counter.eq(31),
+                    phase.eq(0),
+                    self.o_valid.eq(0),
+                ]
+                m.next = "COMMAND"
+
+        with m.FSM():
+            with m.State("IDLE"):
+                m.d.sync += phase.eq(0)
+                start_stop()
+            with m.State("COMMAND"):
+                m.d.comb += [
+                    self.o_cs.eq(1),
+                    self.o_dq_oe.eq(0b1101),
+                ]
+                m.d.sync += phase.eq(~phase)
+                with m.If(phase):
+                    m.d.sync += out_shift.eq(out_shift << 1)
+                    m.d.sync += counter.eq(counter - 1)
+                    with m.If(counter == 0):
+                        m.d.sync += counter.eq(self.DUMMY_CLOCKS - 1)
+                        m.next = "DUMMY"
+                start_stop()
+            with m.State("DUMMY"):
+                m.d.comb += [
+                    self.o_cs.eq(1),
+                    self.o_dq_oe.eq(0b1100 if width < 4 else 0b0000),
+                ]
+                m.d.sync += phase.eq(~phase)
+                with m.If(phase):
+                    m.d.sync += counter.eq(counter - 1)
+                    with m.If(counter == 0):
+                        m.d.sync += counter.eq(8 // width - 1)
+                        m.next = "DATA"
+                start_stop()
+            with m.State("DATA"):
+                m.d.comb += [
+                    self.o_cs.eq(1),
+                    self.o_dq_oe.eq(0b1100 if width < 4 else 0b0000),
+                ]
+
+                if width == 1:
+                    sample = self.i_dq[1]
+                else:
+                    sample = self.i_dq[:width]
+
+                with m.If(phase):
+                    m.d.sync += phase.eq(0)
+                    m.d.sync += in_shift.eq(Cat(sample, in_shift))
+                    m.d.sync += counter.eq(counter - 1)
+                    with m.If(counter == 0):
+                        m.d.sync += counter.eq(8 // width - 1)
+                        m.d.sync += self.o_data.eq(Cat(sample, in_shift))
+                        m.d.sync += self.o_valid.eq(1)
+                # Hold the clock low until there is somewhere to put the
+                # next byte
+                with m.Elif(~self.o_valid | self.i_ready):
+                    m.d.sync += phase.eq(1)
+                start_stop()
+
+        return m
+
+class FlashPlayer(Elaboratable):
+    """
+    Plays an animation stored in SPI flash into the painters' framebuffers.
+
+    The animation is a :class:`stream.StreamDecoder` stream, as produced by
+    :func:`tools.stream_codec.encode_animation`. After each frame the player
+    waits for ``frame_period`` frames of the panel, and at the end of the
+    stream it starts again from ``address``. Frames are only counted once
+    the framebuffers have swapped, so a swap which misses a frame boundary
+    doesn't shorten how long the frame is shown.
+
+    Parameters
+    ----------
+    address : int
+        Flash address the stream starts at
+    data_width : int
+        See :class:`SPIFlashReader`
+    pixel_format : PixelFormat
+        See :class:`stream.StreamDecoder`
+    frame_period : int
+        Number of panel frames to show each animation frame for
+
+    Attributes
+    ----------
+    i_sof : Signal(1), input
+        Start of frame strobe, see :attr:`ledpanel.FrameEvents.sof`
+    flash : SPIFlashReader
+        The flash reader. Its pins need to be bound to the flash.
+    """
+    def __init__(self, painter0, painter1, address, data_width=1,
+                 pixel_format=PixelFormat.RGB888, frame_period=1):
+        assert frame_period >= 1
+
+        self.painter0 = painter0
+        self.painter1 = painter1
+        self.address = address
+        self.frame_period = frame_period
+
+        self.i_sof = Signal()
+        self.flash = SPIFlashReader(data_width)
+        self.decoder = StreamDecoder(painter0, painter1, pixel_format)
+
+    def elaborate(self, platform):
+        m = Module()
+
+        flush = Signal()
+        m.submodules.flash = flash = self.flash
+        m.submodules.decoder = decoder = self.decoder
+        m.submodules.fifo = fifo = ResetInserter(flush)(SyncFIFO(width=8, depth=16))
+
+        m.d.comb += [
+            flash.i_address.eq(self.address),
+            fifo.w_data.eq(flash.o_data),
+            fifo.w_en.eq(flash.o_valid),
+            flash.i_ready.eq(fifo.w_rdy),
+            decoder.i_data.eq(fifo.r_data),
+        ]
+
+        # With a separate write domain, the swap request and i_sof cross over
+        # separately, so the frame may start before the last one is shown.
+        # The decoder waits for the swap itself, this only stops that frame
+        # from counting.
+        swap_pending = Signal()
+        m.d.comb += swap_pending.eq(self.painter0.fb_swap_pending | self.painter1.fb_swap_pending)
+
+        # Frames left to wait before decoding the next one
+        wait = Signal(range(self.frame_period + 1))
+        with m.If(self.i_sof & (wait != 0) & ~swap_pending):
+            m.d.sync += wait.eq(wait - 1)
+
+        with m.FSM():
+            with m.State("START"):
+                m.d.comb += flash.i_start.eq(1)
+                m.d.comb += flush.eq(1)
+                m.next = "PLAY"
+            with m.State("PLAY"):
+                with m.If(wait == 0):
+                    m.d.comb += [
+                        decoder.i_valid.eq(fifo.r_rdy),
+                        fifo.r_en.eq(decoder.o_ready),
+                    ]
+                with m.If(decoder.o_frame_done):
+                    m.d.sync += wait.eq(self.frame_period)
+                with m.If(decoder.o_end_of_stream):
+                    m.d.comb += flash.i_stop.eq(1)
+                    m.next = "START"
+
+        return m
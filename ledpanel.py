@@ -5,26 +5,46 @@ from enum import Enum
 def PanelSignal(rgb0, rgb1, addr, blank, latch, sclk):
     assert rgb0.shape().width == 3
     assert rgb1.shape().width == 3
-    assert addr.shape().width == 5
     assert blank.shape().width == 2
     assert latch.shape().width == 2
     assert sclk.shape().width == 2
 
     return Cat(rgb0, rgb1, addr, blank, latch, sclk)
 
+def panel_signal_width(addr_width):
+    """ Width of a :func:`PanelSignal` with an ``addr_width`` bit row address """
+    return 3 + 3 + addr_width + 2 + 2 + 2
+
+class Modulation(Enum):
+    """ How the scanner turns multi-bit pixel values into LED on-time
+
+    PWM
+        Every subframe shifts out a full row, and each pixel is lit for the
+        subframes where its value exceeds the (bit-reversed) subframe counter.
+        ``2 ** bpp`` shift passes per row per frame.
+    BCM
+        Binary-coded modulation (bit-angle modulation). Each bitplane is
+        shifted out once per row, and the row is unblanked for a time
+        proportional to the weight of that bit. ``bpp`` shift passes per row
+        per frame. ``o_subframe`` carries the index of the bitplane being
+        shifted.
+    """
+    PWM = 0
+    BCM = 1
+
 class PanelMux(Elaboratable):
-    PANEL_WIDTH = 3 + 3 + 5 + 2 + 2 + 2
+    # Width of the panel signal for a 1/32 scan panel
+    PANEL_WIDTH = panel_signal_width(5)
 
     def __init__(self, sel, i0, i1):
         sel = Value.cast(sel)
         assert sel.shape().width == 1
-        assert i0.shape().width == PanelMux.PANEL_WIDTH
-        assert i1.shape().width == PanelMux.PANEL_WIDTH
+        assert i0.shape().width == i1.shape().width
 
         self.sel = sel
         self.i0 = i0
         self.i1 = i1
-        self.o = Signal(PanelMux.PANEL_WIDTH)
+        self.o = Signal(i0.shape().width)
 
     def elaborate(self, platform):
         m = Module()
@@ -36,9 +56,21 @@ class PanelMux(Elaboratable):
 
 class FM6126StartupDriver(Elaboratable):
     """ Scans out the startup sequence required to program FM6126 shift registers
+
+    Parameters
+    ----------
+    o_panel : Value
+        Panel signal to drive, see :func:`PanelSignal`
+    length : int
+        Length of the shift register chain, i.e. the number of columns across
+        all daisy-chained panels.
+    addr_width : int
+        Width of the row address
     """
-    def __init__(self, o_panel):
+    def __init__(self, o_panel, length=64, addr_width=5):
         self.panel = o_panel
+        self.length = length
+        self.addr_width = addr_width
         self.done = Signal()
 
     def elaborate(self, platform):
@@ -54,7 +86,7 @@ class FM6126StartupDriver(Elaboratable):
         m.d.comb += self.panel.eq(PanelSignal(
             o_rgb,
             o_rgb,
-            Const(0, 5), # No need to talk to the row drivers
+            Const(0, self.addr_width), # No need to talk to the row drivers
             o_blank,
             o_latch,
             o_sclk,
@@ -66,8 +98,8 @@ class FM6126StartupDriver(Elaboratable):
         FM6126_INIT_2 = 0x0040
 
         init_reg = Signal(16)
-        latch_counter = Signal(range(64 + 1))
-        counter = Signal(range(64 + 1))
+        latch_counter = Signal(range(self.length + 1))
+        counter = Signal(range(self.length + 1))
 
         done = Signal()
         m.d.comb += self.done.eq(done)
@@ -85,7 +117,7 @@ class FM6126StartupDriver(Elaboratable):
                 m.d.sync += o_blank.eq(0b11)
                 m.d.sync += o_latch.eq(0b00)
                 m.d.sync += init_reg.eq(FM6126_INIT_1)
-                m.d.sync += latch_counter.eq(52)
+                m.d.sync += latch_counter.eq(self.length - 12)
                 m.d.sync += counter.eq(0)
                 m.d.sync += done.eq(0)
                 m.next = State.INIT_R1
@@ -98,13 +130,13 @@ class FM6126StartupDriver(Elaboratable):
                 m.d.sync += o_sclk.eq(0b10)
                 m.d.sync += counter.eq(counter + 1)
 
-                with m.If(counter == 63):
+                with m.If(counter == self.length - 1):
                     m.next = State.INIT_R1_E
             with m.State(State.INIT_R1_E):
                 m.d.sync += o_latch.eq(0b00)
                 m.d.sync += o_sclk.eq(0b00)
                 m.d.sync += init_reg.eq(FM6126_INIT_2)
-                m.d.sync += latch_counter.eq(51)
+                m.d.sync += latch_counter.eq(self.length - 13)
                 m.d.sync += counter.eq(0)
                 m.next = State.INIT_R2
             with m.State(State.INIT_R2):
@@ -116,7 +148,7 @@ class FM6126StartupDriver(Elaboratable):
                 m.d.sync += o_rgb.eq(ireg15)
                 m.d.sync += o_sclk.eq(0b10)
 
-                with m.If(counter == 63):
+                with m.If(counter == self.length - 1):
                     m.next = State.INIT_R2_E
             with m.State(State.INIT_R2_E):
                 m.d.sync += o_latch.eq(0b00)
@@ -129,32 +161,101 @@ class FM6126StartupDriver(Elaboratable):
         return m
 
 class PixelScanner(Elaboratable):
-    def __init__(self, bpp):
-        self.columns = 64       # TODO: make generic
+    """
+    Generates the shift/latch/blank/address sequence for scanning out a frame.
+
+    The panel control outputs lag the pixel outputs by one cycle: the column
+    in ``o_x`` is clocked in by ``o_sclk`` in the following cycle.
+    ``o_requesting`` is high in the cycles ``o_x`` holds such a column, which
+    are the cycles the painters read their pixels in.
+
+    Parameters
+    ----------
+    bpp : int
+        Bits per color channel.
+    modulation : Modulation
+        See :class:`Modulation`. PWM mode only supports ``bpp == 8``.
+    bcm_unit : int
+        Only used in BCM mode. Number of cycles the least significant bitplane
+        is displayed for; bitplane ``n`` is displayed for ``bcm_unit << n``
+        cycles.
+    columns : int
+        Number of columns in a single panel.
+    scan_rows : int
+        Number of row addresses. Every address lights two rows, one driven
+        by ``rgb0`` and one driven by ``rgb1``, so a 64 row panel with 1/32
+        scan has 32 scan rows.
+    chain : int
+        Number of daisy-chained panels. The chain is treated as one wide
+        panel, so ``o_x`` ranges over ``columns * chain`` columns.
+    overlap : bool
+        When set, the latch and row address change for one row happen while
+        the next row is being shifted in, so every cycle clocks a pixel
+        unless a BCM bitplane is still being displayed. Otherwise the
+        scanner stops shifting for a few cycles at the end of every row.
+    blank_cycles : int
+        Only used when ``overlap`` is set. Number of cycles the panel is
+        blanked for before the latch.
+    precharge_cycles : int
+        Only used when ``overlap`` is set. Number of cycles the panel stays
+        blanked after the row address changes, giving the row drivers time to
+        settle.
+    """
+    def __init__(self, bpp, modulation=Modulation.PWM, bcm_unit=1, columns=64, scan_rows=32, chain=1,
+                 overlap=False, blank_cycles=1, precharge_cycles=1):
+        self.columns = columns
+        self.scan_rows = scan_rows
+        self.chain = chain
+        self.width = columns * chain
         self.bpp = bpp
-
-        self.o_addr = Signal(5)
-        self.o_blank = Signal(2)
+        self.modulation = modulation
+        self.bcm_unit = bcm_unit
+        self.overlap = overlap
+        self.blank_cycles = blank_cycles
+        self.precharge_cycles = precharge_cycles
+
+        self.o_addr = Signal(range(self.scan_rows))
+        self.o_blank = Signal(2, reset=0b11)
         self.o_latch = Signal(2)
         self.o_sclk = Signal(2)
         self.o_rdy = Signal(1, reset=0)
 
-        self.o_x  = Signal(range(self.columns))
+        self.o_x  = Signal(range(self.width))
         self.o_y0 = Signal(self.o_addr.width + 1)
         self.o_y1 = Signal(self.o_addr.width + 1)
         self.o_frame = Signal(12)
         self.o_subframe = Signal(self.bpp)
+        self.o_requesting = Signal()
 
         self.i_start = Signal(1)
 
-        assert self.bpp == 8
+        # The row address is a field of the scan counter
+        assert self.scan_rows & (self.scan_rows - 1) == 0
+
+        assert self.blank_cycles >= 0
+        assert self.precharge_cycles >= 0
+        assert self.blank_cycles + self.precharge_cycles < self.width
+
+        if self.modulation == Modulation.PWM:
+            assert self.bpp == 8
+        else:
+            assert self.bpp >= 1
+            assert self.bcm_unit >= 1
 
     def startup_cycles(self):
         # START + R1 scanout + R2 scanout + painter spoolup
-        return 2 + 64 + 64 + self.painter_latency
+        return 2 + self.width + self.width + self.painter_latency
 
 
     def elaborate(self, platform):
+        if self.overlap:
+            if self.modulation == Modulation.BCM:
+                return self.elaborate_overlapped_bcm(platform)
+            return self.elaborate_overlapped_pwm(platform)
+
+        if self.modulation == Modulation.BCM:
+            return self.elaborate_bcm(platform)
+
         m = Module()
 
         # The FM6126 chip needs to see a magic sequence on all of the channels
@@ -167,23 +268,23 @@ class PixelScanner(Elaboratable):
         sclk = Signal(2, reset=0b00)
         latch = Signal(2, reset=0b00)
 
-        x = Signal(range(self.columns))
-        y = Signal(5)
+        x = Signal(range(self.width))
+        y = Signal(self.o_addr.width)
         subframe = Signal(self.bpp)
         frame = Signal(self.o_frame.width)
         counter_comb = Cat(x, y, subframe, frame)
 
         # Values for tracking what we're sending to the panel
         counter = Signal(counter_comb.shape().width)
-        led_addr = Signal(5)
-        led_addr_reg = Signal(5)
+        led_addr = Signal(self.o_addr.width)
+        led_addr_reg = Signal(self.o_addr.width)
 
         m.d.comb += counter_comb.eq(counter)
         m.d.comb += led_addr.eq(counter[x.width:(x.width + led_addr_reg.width)])
 
         y_reg = Signal(led_addr.width)
-        y0 = Signal(6)
-        y1 = Signal(6)
+        y0 = Signal(led_addr.width + 1)
+        y1 = Signal(led_addr.width + 1)
         m.d.comb += y0.eq(Cat(y_reg, 0))
         m.d.comb += y1.eq(Cat(y_reg, 1))
 
@@ -230,20 +331,22 @@ class PixelScanner(Elaboratable):
                 m.d.sync += counter.eq(counter + 1)
                 m.d.sync += sclk.eq(0b10)
                 m.d.sync += blank.eq(0b00)
-                with m.If(counter[0:x.width] == self.columns - 2):
+                with m.If(counter[0:x.width] == self.width - 2):
                     m.next = FSMState.SHIFTE
             with m.State(FSMState.SHIFTE):
                 m.d.sync += blank.eq(0b01)
                 m.next = FSMState.BLANK
             with m.State(FSMState.BLANK):
                 m.d.sync += led_addr_reg.eq(led_addr)
-                m.d.sync += y_reg.eq((y + 1)[0:5])
+                m.d.sync += y_reg.eq((y + 1)[0:y.width])
                 m.d.sync += blank.eq(0b11)
                 m.d.sync += latch.eq(0b11)
                 m.d.sync += sclk.eq(0b00);
                 m.next = FSMState.UNBLANK
             with m.State(FSMState.UNBLANK):
-                m.d.sync += counter.eq(counter + 1)
+                # x is at the last column, so this is ``counter + 1`` when
+                # the row width is a power of two
+                m.d.sync += counter.eq(Cat(Const(0, x.width), counter[x.width:] + 1))
                 m.d.sync += blank.eq(0b10)
                 m.d.sync += latch.eq(0b00)
                 m.next = FSMState.SHIFT0
@@ -252,33 +355,433 @@ class PixelScanner(Elaboratable):
         m.d.comb += self.o_latch.eq(latch)
         m.d.comb += self.o_sclk.eq(sclk)
         m.d.comb += self.o_addr.eq(led_addr_reg)
+        # sclk is registered, so it clocks in the columns requested in these
+        # states
+        m.d.comb += self.o_requesting.eq(pixel_fsm.ongoing(FSMState.SHIFT0) |
+                                         pixel_fsm.ongoing(FSMState.SHIFT) |
+                                         pixel_fsm.ongoing(FSMState.SHIFTE))
+
+        return m
+
+    def elaborate_bcm(self, platform):
+        m = Module()
+
+        # Local registers for output wires
+        sclk = Signal(2, reset=0b00)
+        latch = Signal(2, reset=0b00)
+        led_addr_reg = Signal(self.o_addr.width)
+
+        x = Signal(range(self.width))
+        y = Signal(self.o_addr.width)
+        plane = Signal(range(self.bpp))
+        frame = Signal(self.o_frame.width)
+
+        # Counts down the remaining on-time of the currently latched bitplane.
+        # The panel is blanked whenever this reaches zero, which is what lets
+        # us latch the next plane.
+        display = Signal(range((self.bcm_unit << (self.bpp - 1)) + 1))
+        with m.If(display != 0):
+            m.d.sync += display.eq(display - 1)
+
+        m.d.comb += self.o_x.eq(x)
+        m.d.comb += self.o_y0.eq(Cat(y, 0))
+        m.d.comb += self.o_y1.eq(Cat(y, 1))
+        m.d.comb += self.o_subframe.eq(plane)
+        m.d.comb += self.o_frame.eq(frame)
+
+        class FSMState(Enum):
+            WAIT_START = 0x0
+            START      = 0x1
+            SHIFT      = 0x2
+            WAIT       = 0x3
+            LATCH      = 0x4
+
+        with m.FSM() as pixel_fsm:
+            with m.State(FSMState.WAIT_START):
+                m.d.sync += latch.eq(0b00)
+                m.d.sync += sclk.eq(0b00)
+                m.d.sync += display.eq(0)
+                m.d.sync += Cat(x, y, plane, frame).eq(0)
+                m.d.sync += self.o_rdy.eq(0)
+                with m.If(self.i_start):
+                    m.next = FSMState.START
+            with m.State(FSMState.START):
+                m.d.sync += x.eq(0)
+                m.d.sync += sclk.eq(0b10)
+                m.d.sync += self.o_rdy.eq(1)
+                m.next = FSMState.SHIFT
+            with m.State(FSMState.SHIFT):
+                # ``x`` is always the column clocked in by ``sclk`` in the
+                # next cycle
+                with m.If(x == self.width - 1):
+                    m.d.sync += sclk.eq(0b00)
+                    m.next = FSMState.WAIT
+                with m.Else():
+                    m.d.sync += x.eq(x + 1)
+            with m.State(FSMState.WAIT):
+                # Hold the freshly shifted plane until the previous one has
+                # been displayed for its full weight
+                with m.If(display == 0):
+                    m.d.sync += latch.eq(0b11)
+                    m.d.sync += led_addr_reg.eq(y)
+                    m.next = FSMState.LATCH
+            with m.State(FSMState.LATCH):
+                m.d.sync += latch.eq(0b00)
+                m.d.sync += display.eq(Const(self.bcm_unit) << plane)
+                self.next_bcm_plane(m, plane, y, frame)
+
+                m.d.sync += x.eq(0)
+                m.d.sync += sclk.eq(0b10)
+                m.next = FSMState.SHIFT
+
+        self.register_outputs(m, sclk, latch, Repl(display == 0, 2), led_addr_reg)
+
+        return m
+
+    def register_outputs(self, m, sclk, latch, blank, addr):
+        """
+        Drives the panel control outputs from the values for the column in
+        ``o_x``, one cycle later. Like the PWM scanner, this lines them up
+        with the painters' colors, which :class:`PanelDriver` registers.
+        """
+        m.d.comb += self.o_requesting.eq(sclk != 0)
+        m.d.sync += [
+            self.o_sclk.eq(sclk),
+            self.o_latch.eq(latch),
+            self.o_blank.eq(blank),
+            self.o_addr.eq(addr),
+        ]
+
+    def next_bcm_plane(self, m, plane, y, frame):
+        """ Advance the BCM scan counters past the plane that was just latched """
+        with m.If(plane == self.bpp - 1):
+            m.d.sync += plane.eq(0)
+            with m.If(y == self.scan_rows - 1):
+                m.d.sync += y.eq(0)
+                m.d.sync += frame.eq(frame + 1)
+            with m.Else():
+                m.d.sync += y.eq(y + 1)
+        with m.Else():
+            m.d.sync += plane.eq(plane + 1)
+
+    def elaborate_overlapped_pwm(self, platform):
+        m = Module()
+
+        x = Signal(range(self.width))
+        y = Signal(self.o_addr.width)
+        subframe = Signal(self.bpp)
+        frame = Signal(self.o_frame.width)
+        counter = Cat(x, y, subframe, frame)
+
+        led_addr_reg = Signal(self.o_addr.width)
+        running = Signal()
+
+        m.d.comb += self.o_x.eq(x)
+        m.d.comb += self.o_y0.eq(Cat(y, 0))
+        m.d.comb += self.o_y1.eq(Cat(y, 1))
+        m.d.comb += self.o_subframe.eq(subframe)
+        m.d.comb += self.o_frame.eq(frame)
+
+        with m.If(~running):
+            m.d.sync += counter.eq(0)
+            m.d.sync += self.o_rdy.eq(0)
+            with m.If(self.i_start):
+                m.d.sync += running.eq(1)
+                m.d.sync += self.o_rdy.eq(1)
+        with m.Elif(x == self.width - 1):
+            # Latch this row and switch the row drivers over to it while the
+            # next row starts shifting in
+            m.d.sync += led_addr_reg.eq(y)
+            m.d.sync += counter.eq(Cat(Const(0, x.width), counter[x.width:] + 1))
+        with m.Else():
+            m.d.sync += x.eq(x + 1)
+
+        last = running & (x == self.width - 1)
+        dead = (x >= self.width - self.blank_cycles) | (x < self.precharge_cycles)
+
+        # The latch and (when there are no blank cycles) blank pulses use the
+        # second half of the cycle, after the rising edge of sclk
+        self.register_outputs(m,
+                              sclk=Mux(running, 0b10, 0b00),
+                              latch=Mux(last, 0b10, 0b00),
+                              blank=Mux(~running | dead, 0b11, Mux(last, 0b10, 0b00)),
+                              addr=led_addr_reg)
+
+        return m
+
+    def elaborate_overlapped_bcm(self, platform):
+        m = Module()
+
+        x = Signal(range(self.width))
+        y = Signal(self.o_addr.width)
+        plane = Signal(range(self.bpp))
+        frame = Signal(self.o_frame.width)
+
+        led_addr_reg = Signal(self.o_addr.width)
+
+        # The on-time of a plane is followed by ``blank_cycles`` of dead time,
+        # so the next plane may be latched once ``display`` reaches zero.
+        # ``precharge`` holds off the on-time after a row address change.
+        display = Signal(range((self.bcm_unit << (self.bpp - 1)) + self.blank_cycles + 1))
+        precharge = Signal(range(self.precharge_cycles + 1))
+        with m.If(precharge != 0):
+            m.d.sync += precharge.eq(precharge - 1)
+        with m.Elif(display != 0):
+            m.d.sync += display.eq(display - 1)
+
+        m.d.comb += self.o_x.eq(x)
+        m.d.comb += self.o_y0.eq(Cat(y, 0))
+        m.d.comb += self.o_y1.eq(Cat(y, 1))
+        m.d.comb += self.o_subframe.eq(plane)
+        m.d.comb += self.o_frame.eq(frame)
+
+        sclk = Signal(2)
+        latch = Signal(2)
+        do_latch = Signal()
+        with m.If(do_latch):
+            m.d.sync += led_addr_reg.eq(y)
+            m.d.sync += precharge.eq(self.precharge_cycles)
+            m.d.sync += display.eq((Const(self.bcm_unit) << plane) + self.blank_cycles)
+            m.d.sync += x.eq(0)
+            self.next_bcm_plane(m, plane, y, frame)
+
+        class FSMState(Enum):
+            WAIT_START = 0x0
+            SHIFT      = 0x1
+            HOLD       = 0x2
+
+        with m.FSM() as pixel_fsm:
+            with m.State(FSMState.WAIT_START):
+                m.d.sync += Cat(x, y, plane, frame).eq(0)
+                m.d.sync += Cat(display, precharge).eq(0)
+                m.d.sync += self.o_rdy.eq(0)
+                with m.If(self.i_start):
+                    m.d.sync += self.o_rdy.eq(1)
+                    m.next = FSMState.SHIFT
+            with m.State(FSMState.SHIFT):
+                m.d.comb += sclk.eq(0b10)
+                with m.If(x == self.width - 1):
+                    # Latch right behind the last rising edge of sclk if the
+                    # previous plane is done, otherwise wait for it
+                    with m.If(display == 0):
+                        m.d.comb += do_latch.eq(1)
+                        m.d.comb += latch.eq(0b10)
+                    with m.Else():
+                        m.next = FSMState.HOLD
+                with m.Else():
+                    m.d.sync += x.eq(x + 1)
+            with m.State(FSMState.HOLD):
+                with m.If(display == 0):
+                    m.d.comb += do_latch.eq(1)
+                    m.d.comb += latch.eq(0b11)
+                    m.next = FSMState.SHIFT
+
+        unblank = (precharge == 0) & (display > self.blank_cycles)
+        self.register_outputs(m, sclk, latch, Repl(~unblank, 2), led_addr_reg)
+
+        return m
+
+class FrameEvents(Elaboratable):
+    """
+    Frame timing events for producers, so they can pace themselves to the
+    display instead of needing hand-wired enables.
+
+    Parameters
+    ----------
+    frame_width : int
+        Width of the scanner's frame counter
+    subframe_width : int
+        Width of the scanner's subframe counter
+    budget_bits : int
+        Width of :attr:`budget`. Frames longer than ``2**budget_bits - 1``
+        cycles report a budget of 0.
+
+    Attributes
+    ----------
+    i_frame : Signal(frame_width), input
+        Frame counter from the scanner
+    i_subframe : Signal(subframe_width), input
+        Subframe counter from the scanner
+    i_requesting : Signal(1), input
+        High while the scanner requests pixels from the painters, see
+        :attr:`PixelScanner.o_requesting`
+    sof : Signal(1), output
+        Start of frame. High for one cycle when ``i_frame`` changes.
+    sosf : Signal(1), output
+        Start of subframe. High for one cycle when ``i_subframe`` changes.
+    write_window : Signal(1), output
+        High while no pixels are being requested from the painters, so a
+        framebuffer read port is free.
+    budget : Signal(budget_bits), output
+        Number of cycles until the next ``sof``, assuming this frame is as
+        long as the previous one. 0 until a whole frame has been seen.
+    """
+    def __init__(self, frame_width=12, subframe_width=8, budget_bits=24):
+        self.i_frame = Signal(frame_width)
+        self.i_subframe = Signal(subframe_width)
+        self.i_requesting = Signal()
+
+        self.sof = Signal()
+        self.sosf = Signal()
+        self.write_window = Signal()
+        self.budget = Signal(budget_bits)
+
+    def elaborate(self, platform):
+        m = Module()
+
+        last_frame = Signal.like(self.i_frame)
+        last_subframe = Signal.like(self.i_subframe)
+        m.d.sync += last_frame.eq(self.i_frame)
+        m.d.sync += last_subframe.eq(self.i_subframe)
+
+        m.d.comb += [
+            self.sof.eq(self.i_frame != last_frame),
+            self.sosf.eq(self.i_subframe != last_subframe),
+            self.write_window.eq(~self.i_requesting),
+        ]
+
+        # Measure the length of each frame, and count down from the length
+        # of the last one
+        elapsed = Signal.like(self.budget)
+        counter = Signal.like(self.budget)
+        last_length = Signal.like(self.budget)
+        frame_length = Signal.like(self.budget)
+        seen_sof = Signal()
+
+        m.d.comb += elapsed.eq(Mux(self.sof, 0, counter))
+        with m.If(elapsed != (1 << len(elapsed)) - 1):
+            m.d.sync += counter.eq(elapsed + 1)
+
+        # The first frame is measured from reset, which includes startup
+        m.d.comb += frame_length.eq(Mux(self.sof & seen_sof, counter, last_length))
+        m.d.sync += last_length.eq(frame_length)
+        with m.If(self.sof):
+            m.d.sync += seen_sof.eq(1)
+
+        with m.If(frame_length > elapsed):
+            m.d.comb += self.budget.eq(frame_length - elapsed)
 
         return m
 
 class PanelDriver(Elaboratable):
-    def __init__(self, painter_latency, bpp=8):
+    """
+    Drives the LED panel: runs the FM6126 startup sequence, then scans out
+    pixels produced by the painters.
+
+    The painters' colors arrive some cycles after the pixel is requested,
+    so the panel control signals are delayed by the same number of cycles.
+    Painters registered with :meth:`add_painter` declare their ``latency``,
+    and the driver delays the control signals by the longest, and the
+    colors of faster sides by the difference, when it is elaborated.
+
+    Parameters
+    ----------
+    painter_latency : int
+        Number of cycles between the painters seeing ``o_x``/``o_y0``/``o_y1``
+        and producing ``i_rgb0``/``i_rgb1``. Defaults to the latency of the
+        slowest painter added with :meth:`add_painter`. If it is given, the
+        painters may not take longer.
+    bpp : int
+        Bits per color channel. See :class:`PixelScanner`.
+    modulation : Modulation
+        See :class:`Modulation`.
+    bcm_unit : int
+        See :class:`PixelScanner`.
+    columns : int
+        See :class:`PixelScanner`.
+    scan_rows : int
+        See :class:`PixelScanner`.
+    chain : int
+        See :class:`PixelScanner`.
+    overlap : bool
+        See :class:`PixelScanner`.
+    blank_cycles : int
+        See :class:`PixelScanner`.
+    precharge_cycles : int
+        See :class:`PixelScanner`.
+
+    Attributes
+    ----------
+    events : FrameEvents
+        Frame timing for producers
+    o_frame_start : Signal(1), output
+        High for one cycle when ``o_frame`` changes. This is the cycle in
+        which the painters are asked for the first pixel of the new frame.
+        Same as ``events.sof``.
+    """
+    def __init__(self, painter_latency=None, bpp=8, modulation=Modulation.PWM, bcm_unit=1,
+                 columns=64, scan_rows=32, chain=1,
+                 overlap=False, blank_cycles=1, precharge_cycles=1):
         self.painter_latency = painter_latency
-        self.columns = 64       # TODO: make generic
-        self.bpp = 8
+        self.painters = []
+        self.columns = columns
+        self.scan_rows = scan_rows
+        self.chain = chain
+        self.width = columns * chain
+        self.bpp = bpp
+        self.modulation = modulation
+        self.bcm_unit = bcm_unit
+        self.overlap = overlap
+        self.blank_cycles = blank_cycles
+        self.precharge_cycles = precharge_cycles
 
         self.o_rgb0 = Signal(3)
         self.o_rgb1 = Signal(3)
-        self.o_addr = Signal(5)
+        self.o_addr = Signal(range(self.scan_rows))
         self.o_blank = Signal(2)
         self.o_latch = Signal(2)
         self.o_sclk = Signal(2)
         self.o_rdy = Signal(1)
 
-        self.o_x  = Signal(range(self.columns))
+        self.o_x  = Signal(range(self.width))
         self.o_y0 = Signal(self.o_addr.width + 1)
         self.o_y1 = Signal(self.o_addr.width + 1)
         self.o_frame = Signal(12)
         self.o_subframe = Signal(self.bpp)
+        self.events = FrameEvents(len(self.o_frame), len(self.o_subframe))
+        self.o_frame_start = self.events.sof
         self.o_unbuffered_blank = Signal(2)
 
         self.i_rgb0 = Signal(3)
         self.i_rgb1 = Signal(3)
 
+    def add_painter(self, painter, *sides):
+        """
+        Registers ``painter`` as producing the colors of ``sides``, 0 for
+        ``i_rgb0`` and 1 for ``i_rgb1``, ``painter.latency`` cycles after
+        the pixel is requested
+        """
+        for side in sides:
+            if side not in (0, 1):
+                raise ValueError("Driver doesn't export side {}".format(side))
+            self.painters.append((painter, side))
+
+    def side_latencies(self):
+        """
+        Returns the total painter latency, and the latency of the painter of
+        each side. Raises :class:`ValueError` if the painters don't fit.
+        """
+        sides = [None, None]
+        for (painter, side) in self.painters:
+            if sides[side] is not None and sides[side] != painter.latency:
+                raise ValueError("Painters for side {} disagree on latency: {} and {}"
+                                 .format(side, sides[side], painter.latency))
+            sides[side] = painter.latency
+
+        declared = [latency for latency in sides if latency is not None]
+        if self.painter_latency is not None:
+            total = self.painter_latency
+            for latency in declared:
+                if latency > total:
+                    raise ValueError("Painter latency {} is more than the driver's painter_latency of {}"
+                                     .format(latency, total))
+        elif declared:
+            total = max(declared)
+        else:
+            raise ValueError("PanelDriver needs a painter_latency, or painters added with add_painter")
+
+        return (total, [total if latency is None else latency for latency in sides])
+
     def panel_output_ports(self):
         return [
             self.o_frame,
@@ -296,23 +799,34 @@ class PanelDriver(Elaboratable):
     def elaborate(self, platform):
         m = Module()
 
-        o_pix = Signal(PanelMux.PANEL_WIDTH)
-        o_startup = Signal(PanelMux.PANEL_WIDTH)
+        panel_width = panel_signal_width(self.o_addr.width)
+        o_pix = Signal(panel_width)
+        o_startup = Signal(panel_width)
         o_panel = PanelSignal(self.o_rgb0, self.o_rgb1, self.o_addr, self.o_blank,
                               self.o_latch, self.o_sclk)
 
-        m.submodules.pix = pix = PixelScanner(self.bpp)
-        m.submodules.startup = startup = FM6126StartupDriver(o_startup)
+        m.submodules.pix = pix = PixelScanner(self.bpp, self.modulation, self.bcm_unit,
+                                              self.columns, self.scan_rows, self.chain,
+                                              self.overlap, self.blank_cycles,
+                                              self.precharge_cycles)
+        m.submodules.startup = startup = FM6126StartupDriver(o_startup, self.width,
+                                                             self.o_addr.width)
         m.submodules.mux = mux = PanelMux(startup.done, o_startup, o_pix)
 
         m.d.comb += pix.i_start.eq(startup.done)
         m.d.comb += o_panel.eq(mux.o)
 
-        led_rgb0 = Signal(3)
-        led_rgb1 = Signal(3)
+        (painter_latency, side_latencies) = self.side_latencies()
 
-        m.d.sync += led_rgb0.eq(self.i_rgb0)
-        m.d.sync += led_rgb1.eq(self.i_rgb1)
+        # Faster painters are delayed to line up with the slowest one
+        led_rgbs = []
+        for (i_rgb, latency) in zip([self.i_rgb0, self.i_rgb1], side_latencies):
+            for i in range(painter_latency - latency + 1):
+                i_rgb_ff = Signal.like(i_rgb)
+                m.d.sync += i_rgb_ff.eq(i_rgb)
+                i_rgb = i_rgb_ff
+            led_rgbs.append(i_rgb)
+        (led_rgb0, led_rgb1) = led_rgbs
 
         pix_panel = Cat(
             pix.o_addr,
@@ -322,7 +836,7 @@ class PanelDriver(Elaboratable):
         )
 
         pix_latency_sel = pix_panel
-        for i in range(self.painter_latency):
+        for i in range(painter_latency):
             pix_panel_ff = Signal.like(pix_panel)
             m.d.sync += pix_panel_ff.eq(pix_panel)
             pix_panel = pix_panel_ff
@@ -336,4 +850,13 @@ class PanelDriver(Elaboratable):
         m.d.comb += self.o_subframe.eq(pix.o_subframe)
         m.d.comb += self.o_unbuffered_blank.eq(pix.o_blank)
 
+        # The frame counter changes in the same cycle as the scanner moves to
+        # the first pixel of the new frame
+        m.submodules.events = self.events
+        m.d.comb += [
+            self.events.i_frame.eq(pix.o_frame),
+            self.events.i_subframe.eq(pix.o_subframe),
+            self.events.i_requesting.eq(pix.o_requesting),
+        ]
+
         return m
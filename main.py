@@ -1,15 +1,104 @@
-from ledpanel import PanelDriver
+from ledpanel import PanelDriver, Modulation
 from amaranth import *
 from amaranth.build import *
 from platform.icebreaker import ICEBreakerPlatformCustom, PLL40, SinglePortMemory
 from painters.address_test import CycleAddrTest
-from painters.fluid_sim import Painter, Framebuffer, FluidSim
+from painters.compositor import Compositor
+from painters.util import gamma_curve
+from stream import UARTRx, StreamDecoder
+from flash import FlashPlayer
+from tools.assets import compile_asset, load_init
+from amaranth.lib.fifo import SyncFIFO, AsyncFIFO
+from amaranth.lib.cdc import PulseSynchronizer
+from painters.fluid_sim import Painter, Framebuffer, PixelFormat, FluidSim, BitplanePainter, BitplaneFramebuffer
 import argparse
+import colorsys
 from typing import Optional
 
 # range 0-2, 3 means use the fancy painter
 TEST_CYCLES = 3
 
+# Modulation.PWM or Modulation.BCM, see ledpanel.Modulation
+MODULATION = Modulation.PWM
+
+# Store the framebuffers as bitplanes, only works with Modulation.BCM
+BITPLANE_FRAMEBUFFER = False
+
+# Double-buffer the framebuffers so the fluid simulation doesn't tear. The
+# RGB888 framebuffers don't fit in the UP5K block RAM twice, use a smaller
+# PIXEL_FORMAT.
+DOUBLE_BUFFER = False
+
+# Framebuffer storage format, see painters.fluid_sim.PixelFormat. Not used by
+# BITPLANE_FRAMEBUFFER. PixelFormat.INDEXED8 shows the fluid simulation in
+# full color with a third of the memory.
+PIXEL_FORMAT = PixelFormat.RGB888
+
+# Transfer curve applied by the painters, for example gamma_curve(2.2), and the
+# number of bits per channel it produces. See painters.util.GammaLUT.
+GAMMA_CURVE = None
+GAMMA_BITS = 8
+
+# Dither the GAMMA_BITS down to the displayed depth over successive frames
+DITHER = False
+
+# Show frames streamed over the UART by tools/send_frames.py instead of the
+# fluid simulation, see stream.StreamDecoder. STREAM_FORMAT is the pixel format
+# on the wire, PixelFormat.RGB888 or PixelFormat.RGB565.
+STREAM_INPUT = False
+STREAM_BAUD = 3000000
+STREAM_FORMAT = PixelFormat.RGB888
+
+# Play an animation from SPI flash instead of the fluid simulation, see
+# flash.FlashPlayer. The animation is written at FLASH_ADDRESS, past the
+# bitstream. FLASH_DATA_WIDTH of 4 needs the flash's QE bit set.
+FLASH_PLAYBACK = False
+FLASH_ADDRESS = 0x100000
+FLASH_DATA_WIDTH = 2
+FLASH_FORMAT = PixelFormat.RGB888
+FLASH_FRAME_PERIOD = 2
+
+# Images to start the framebuffers with, and to write to flash for
+# FLASH_PLAYBACK with the program action. PNG, GIF or raw RGB24, converted by
+# tools/assets.py and cached in ASSET_CACHE.
+FRAMEBUFFER_IMAGE = None
+FLASH_ANIMATION = None
+ASSET_CACHE = 'build/asset-cache'
+
+# The simulate action keeps the generated cxxrtl code here, by a hash of the
+# design's RTLIL, so blinker.cpp is only rewritten (and the testbench only
+# recompiled) when the design actually changes
+CXXRTL_CACHE = 'build/cxxrtl-cache'
+
+# Draw a tile map and sprites with painters.compositor.Compositor instead of
+# framebuffers. It starts out with the demo tiles from compositor_demo().
+# Nothing drives the sprites yet, so only the tile map shows.
+COMPOSITOR = False
+
+# Number of FluidSim kernels stepping the simulation in parallel, see
+# painters.fluid_sim.FluidSim
+SIM_LANES = 1
+
+# Overlap row changes with shifting, see ledpanel.PixelScanner
+OVERLAP = False
+
+# Frequency of the panel clock domain, see platform.icebreaker.PLL40
+PANEL_CLOCK = 30e6
+
+# Run whatever draws into the framebuffers (the fluid simulation, STREAM_INPUT
+# or FLASH_PLAYBACK) in its own "producer" clock domain, clocked by the HFOSC at
+# PRODUCER_CLOCK (48, 24, 12 or 6 MHz), instead of at the panel clock. Writes
+# cross into the panel clock domain inside the framebuffers. The STREAM_INPUT
+# UART stays on the panel clock, and its bytes cross over in a FIFO.
+PRODUCER_DOMAIN = False
+PRODUCER_CLOCK = 48e6
+
+# Panel geometry, see ledpanel.PixelScanner. 128x64 is PANEL_CHAIN = 2 with
+# 64x64 panels.
+PANEL_COLUMNS = 64
+PANEL_SCAN_ROWS = 32
+PANEL_CHAIN = 1
+
 class ResetLogic(Elaboratable):
     def __init__(self, button, led):
         self.button = button
@@ -50,6 +139,33 @@ class ResetLogic(Elaboratable):
 
         return m
 
+def compositor_demo(driver, tiles=16, color_bits=4):
+    """
+    Returns the initial contents of a :class:`Compositor`, as keyword
+    arguments: a rainbow palette, a bordered checkerboard tile in each of its
+    colors, and a tile map with diagonal stripes of them
+    """
+    colors = (1 << color_bits) - 1
+    palette = [0]
+    for i in range(colors):
+        (r, g, b) = (int(c * 255) for c in colorsys.hsv_to_rgb(i / colors, 1, 1))
+        palette.append(r | (g << 8) | (b << 16))
+
+    size = Compositor.TILE_SIZE
+    tile_patterns = []
+    for tile in range(tiles):
+        color = 1 + tile % colors
+        for y in range(size):
+            for x in range(size):
+                border = x in (0, size - 1) or y in (0, size - 1)
+                tile_patterns.append(color if border or (x + y) % 2 == 0 else 0)
+
+    (map_width, map_height) = (driver.width // size, 2 * driver.scan_rows // size)
+    tile_map = [(x + y) % tiles for y in range(map_height) for x in range(map_width)]
+
+    return dict(tiles=tiles, color_bits=color_bits, tile_map=tile_map,
+                tile_patterns=tile_patterns, palette=palette)
+
 class HighSpeedLogic(Elaboratable):
     """
     This module contians all the logic that runs in the "high speed" (pixel
@@ -62,13 +178,21 @@ class HighSpeedLogic(Elaboratable):
         self.o_rgb0 = Signal(3)
         self.o_rgb1 = Signal(3)
         self.o_sclk = Signal(2)
-        self.o_addr = Signal(5)
+        self.o_addr = Signal(range(PANEL_SCAN_ROWS))
         self.o_blank = Signal(2)
         self.o_latch = Signal(2)
         self.o_rdy = Signal(1)
 
+        self.i_uart_rx = Signal(1, reset=1)
+
+        self.o_flash_cs = Signal(1)
+        self.o_flash_clk = Signal(1)
+        self.o_flash_dq = Signal(4)
+        self.o_flash_dq_oe = Signal(4)
+        self.i_flash_dq = Signal(4)
+
     def ports(self):
-        return [
+        ports = [
             self.o_frame,
             self.o_subframe,
             self.o_rgb0,
@@ -79,25 +203,74 @@ class HighSpeedLogic(Elaboratable):
             self.o_latch,
             self.o_rdy,
         ]
+        if STREAM_INPUT:
+            ports.append(self.i_uart_rx)
+        elif FLASH_PLAYBACK:
+            ports += [
+                self.o_flash_cs,
+                self.o_flash_clk,
+                self.o_flash_dq,
+                self.o_flash_dq_oe,
+                self.i_flash_dq,
+            ]
+        return ports
 
     def elaborate(self, platform):
         m = Module()
 
+        geometry = dict(columns=PANEL_COLUMNS, scan_rows=PANEL_SCAN_ROWS, chain=PANEL_CHAIN,
+                        overlap=OVERLAP)
+
         if TEST_CYCLES <= CycleAddrTest.MAX_TEST_CYCLES:
-            driver = PanelDriver(TEST_CYCLES)
+            driver = PanelDriver(modulation=MODULATION, **geometry)
             painter0 = CycleAddrTest(TEST_CYCLES, driver, side=0)
             painter1 = CycleAddrTest(TEST_CYCLES, driver, side=1)
+        elif COMPOSITOR:
+            driver = PanelDriver(modulation=MODULATION, **geometry)
+            # Draws both sides
+            painter0 = Compositor(driver, **compositor_demo(driver))
+            painter1 = None
+        elif BITPLANE_FRAMEBUFFER:
+            driver = PanelDriver(modulation=MODULATION, **geometry)
+            m.submodules.framebuffer0 = framebuffer0 = BitplaneFramebuffer(driver.width, driver.scan_rows, driver.bpp, DOUBLE_BUFFER,
+                                                                           self.producer_domain)
+            m.submodules.framebuffer1 = framebuffer1 = BitplaneFramebuffer(driver.width, driver.scan_rows, driver.bpp, DOUBLE_BUFFER,
+                                                                           self.producer_domain)
+            painter0 = BitplanePainter(driver, side=0, framebuffer=framebuffer0)
+            painter1 = BitplanePainter(driver, side=1, framebuffer=framebuffer1)
+            self.elaborate_producer(m, driver, painter0, painter1)
         else:
-            driver = PanelDriver(Painter.LATENCY)
-            m.submodules.framebuffer0 = framebuffer0 = Framebuffer()
-            m.submodules.framebuffer1 = framebuffer1 = Framebuffer()
-            painter0 = Painter(driver, side=0, framebuffer=framebuffer0)
-            painter1 = Painter(driver, side=1, framebuffer=framebuffer1)
-            m.submodules.fluidsim = FluidSim(painter0, painter1)
+            fb_width = PANEL_COLUMNS * PANEL_CHAIN
+            if FRAMEBUFFER_IMAGE is not None:
+                (init0, init1, palette) = load_init(FRAMEBUFFER_IMAGE, fb_width, PANEL_SCAN_ROWS, PIXEL_FORMAT,
+                                                    cache_dir=ASSET_CACHE)
+            elif not (STREAM_INPUT or FLASH_PLAYBACK):
+                # The fluid simulation only draws densities
+                (init0, init1, palette) = (None, None, FluidSim.palette())
+            else:
+                (init0, init1, palette) = (None, None, None)
+            m.submodules.framebuffer0 = framebuffer0 = Framebuffer(fb_width, PANEL_SCAN_ROWS, DOUBLE_BUFFER, PIXEL_FORMAT,
+                                                                   palette, init0, write_domain=self.producer_domain)
+            m.submodules.framebuffer1 = framebuffer1 = Framebuffer(fb_width, PANEL_SCAN_ROWS, DOUBLE_BUFFER, PIXEL_FORMAT,
+                                                                   palette, init1, write_domain=self.producer_domain)
+            driver = PanelDriver(modulation=MODULATION, **geometry)
+            painter0 = Painter(driver, side=0, framebuffer=framebuffer0, curve=GAMMA_CURVE, curve_bits=GAMMA_BITS,
+                               dither=DITHER)
+            painter1 = Painter(driver, side=1, framebuffer=framebuffer1, curve=GAMMA_CURVE, curve_bits=GAMMA_BITS,
+                               dither=DITHER)
+            self.elaborate_producer(m, driver, painter0, painter1)
+
+        # The driver delays the panel control signals to match the painters
+        if painter1 is None:
+            driver.add_painter(painter0, 0, 1)
+        else:
+            driver.add_painter(painter0, 0)
+            driver.add_painter(painter1, 1)
 
         m.submodules.driver = driver
         m.submodules.painter0 = painter0
-        m.submodules.painter1 = painter1
+        if painter1 is not None:
+            m.submodules.painter1 = painter1
 
         # Bind passthrough outputs from the driver
         for (sport, oport) in zip(self.ports(), driver.panel_output_ports()):
@@ -107,6 +280,63 @@ class HighSpeedLogic(Elaboratable):
 
         return m
 
+    @property
+    def producer_domain(self):
+        """ Clock domain of whatever draws into the framebuffers """
+        return "producer" if PRODUCER_DOMAIN else "sync"
+
+    def elaborate_producer(self, m, driver, painter0, painter1):
+        """ Adds whatever draws into the painters' framebuffers """
+        if PRODUCER_DOMAIN:
+            producer = DomainRenamer(self.producer_domain)
+            m.submodules.sof_sync = sof_sync = PulseSynchronizer("sync", self.producer_domain)
+            m.d.comb += sof_sync.i.eq(driver.events.sof)
+            sof = sof_sync.o
+        else:
+            producer = lambda elaboratable: elaboratable
+            sof = driver.events.sof
+
+        if STREAM_INPUT:
+            # The HFOSC is only accurate to about 10%, too far off for the
+            # UART, so it always runs from the PLL
+            m.submodules.uart = uart = UARTRx(int(PANEL_CLOCK // STREAM_BAUD))
+            # Absorbs incoming bytes while runs of pixels are written, and
+            # carries them over to the producer domain
+            if PRODUCER_DOMAIN:
+                m.submodules.stream_fifo = fifo = AsyncFIFO(width=8, depth=16, r_domain=self.producer_domain,
+                                                            w_domain="sync")
+            else:
+                m.submodules.stream_fifo = fifo = SyncFIFO(width=8, depth=16)
+            m.submodules.stream = stream = producer(StreamDecoder(painter0, painter1, STREAM_FORMAT))
+            m.d.comb += [
+                uart.rx.eq(self.i_uart_rx),
+                fifo.w_data.eq(uart.o_data),
+                fifo.w_en.eq(uart.o_valid),
+                stream.i_data.eq(fifo.r_data),
+                stream.i_valid.eq(fifo.r_rdy),
+                fifo.r_en.eq(stream.o_ready),
+            ]
+        elif FLASH_PLAYBACK:
+            m.submodules.player = player = producer(FlashPlayer(painter0, painter1, FLASH_ADDRESS,
+                                                                FLASH_DATA_WIDTH, FLASH_FORMAT,
+                                                                FLASH_FRAME_PERIOD))
+            m.d.comb += [
+                player.i_sof.eq(sof),
+                self.o_flash_cs.eq(player.flash.o_cs),
+                self.o_flash_clk.eq(player.flash.o_clk),
+                self.o_flash_dq.eq(player.flash.o_dq),
+                self.o_flash_dq_oe.eq(player.flash.o_dq_oe),
+                player.flash.i_dq.eq(self.i_flash_dq),
+            ]
+        else:
+            m.submodules.fluidsim = fluidsim = producer(FluidSim(painter0, painter1, lanes=SIM_LANES))
+            if PRODUCER_DOMAIN:
+                # The frame may start before the swap request crosses over,
+                # wait until the framebuffers have really swapped
+                m.d.comb += fluidsim.start.eq(painter0.fb_swapped)
+            else:
+                m.d.comb += fluidsim.start.eq(driver.events.sof)
+
 class BoardMapping(Elaboratable):
     def __init__(self, for_verilator: bool):
         self.for_verilator = for_verilator
@@ -140,6 +370,23 @@ class BoardMapping(Elaboratable):
         logic = HighSpeedLogic()
         m.submodules.logic = dr(logic)
 
+        if PRODUCER_DOMAIN:
+            # Clocked by the HFOSC, and reset along with the panel logic
+            m.domains.producer = ClockDomain("producer")
+            m.d.comb += [
+                ClockSignal("producer").eq(ClockSignal("sync")),
+                ResetSignal("producer").eq(pll40.domain.rst),
+            ]
+
+        if STREAM_INPUT:
+            uart = platform.request('uart', 0)
+            m.d.comb += logic.i_uart_rx.eq(uart.rx.i)
+        elif FLASH_PLAYBACK:
+            m.d.comb += self.bind_flash(platform, logic)
+
+        # Panels with fewer scan rows leave the upper address lines low
+        assert len(logic.o_addr) <= len(panel.addr)
+
         # Add a register for the RGB outputs and addrs to synchronize with the DDR outputs
         delay_sigs = Cat(logic.o_rgb0, logic.o_rgb1, logic.o_addr)
         delayed_sigs = Cat(panel.rgb0, panel.rgb1, panel.addr)
@@ -166,40 +413,152 @@ class BoardMapping(Elaboratable):
 
         return m
 
+    def bind_flash(self, platform, logic):
+        if FLASH_DATA_WIDTH == 1:
+            flash = platform.request('spi_flash_1x', 0)
+            # WP and HOLD are active low pins
+            return [
+                flash.cs.o.eq(logic.o_flash_cs),
+                flash.clk.o.eq(logic.o_flash_clk),
+                flash.copi.o.eq(logic.o_flash_dq[0]),
+                logic.i_flash_dq[1].eq(flash.cipo.i),
+                flash.wp.o.eq(0),
+                flash.hold.o.eq(0),
+            ]
+
+        # The pins share one output enable. Only IO0's matters, the flash
+        # doesn't drive the other lines while the command is sent. In dual
+        # mode WP and HOLD are left to the board's pull-ups.
+        flash = platform.request('spi_flash_{}x'.format(FLASH_DATA_WIDTH), 0)
+        return [
+            flash.cs.o.eq(logic.o_flash_cs),
+            flash.clk.o.eq(logic.o_flash_clk),
+            flash.dq.o.eq(logic.o_flash_dq),
+            flash.dq.oe.eq(logic.o_flash_dq_oe[0]),
+            logic.i_flash_dq.eq(flash.dq.i),
+        ]
+
+def yosys_datdir():
+    """ Returns Yosys' data directory, which has the iCE40 cell models """
+    import subprocess
+    return subprocess.run(['yosys-config', '--datdir'], check=True,
+                          capture_output=True, text=True).stdout.strip()
+
+def write_cxxrtl(design, platform, ports, path='blinker.cpp', cache_dir=CXXRTL_CACHE):
+    """
+    Writes the cxxrtl model of ``design`` to ``path``, along with the
+    simulation models of the iCE40 cells it uses. The generated code is
+    cached by a hash of the RTLIL, and ``path`` is left alone if it's
+    already up to date. Returns whether it was rewritten.
+    """
+    import hashlib
+    import os
+    from amaranth.back import rtlil
+    from amaranth._toolchain.yosys import find_yosys
+
+    rtlil_text = rtlil.convert(design, platform=platform, ports=ports)
+    cells_sim_path = os.path.join(yosys_datdir(), 'ice40', 'cells_sim.v')
+    with open(cells_sim_path) as f:
+        cells_sim = f.read()
+    yosys = find_yosys(lambda ver: ver >= (0, 10))
+
+    h = hashlib.sha256()
+    for part in [str(yosys.version()), cells_sim, rtlil_text]:
+        h.update(part.encode())
+    cached = os.path.join(cache_dir, h.hexdigest() + '.cpp')
+
+    if os.path.exists(cached):
+        with open(cached) as f:
+            code = f.read()
+    else:
+        code = yosys.run(["-q", "-"], "\n".join([
+            "read_verilog -DICE40_U {}".format(cells_sim_path),
+            "read_ilang <<rtlil\n{}\nrtlil".format(rtlil_text),
+            "hierarchy -top top",
+            "write_cxxrtl",
+        ]))
+        os.makedirs(cache_dir, exist_ok=True)
+        # Write then rename, so an interrupted run doesn't leave a bad entry
+        with open(cached + '.tmp', 'w') as f:
+            f.write(code)
+        os.replace(cached + '.tmp', cached)
+
+    if os.path.exists(path):
+        with open(path) as f:
+            if f.read() == code:
+                return False
+    with open(path, 'w') as f:
+        f.write(code)
+    return True
+
 if __name__ == "__main__":
     import argparse
 
     parser = argparse.ArgumentParser()
     p_action = parser.add_subparsers(dest="action")
     p_action.add_parser("simulate")
+    p_bench = p_action.add_parser("bench")
+    p_bench.add_argument("--frames", type=int, default=16)
     p_action.add_parser("verilog")
     p_action.add_parser("program")
 
     args = parser.parse_args()
 
     p = ICEBreakerPlatformCustom()
+    if PRODUCER_DOMAIN:
+        p.hfosc_div = {48e6: 0, 24e6: 1, 12e6: 2, 6e6: 3}[PRODUCER_CLOCK]
     p.add_resources(p.break_off_pmod)
     p.add_resources(p.led_panel_pmod)
 
     if args.action == "simulate":
-        from amaranth.back import cxxrtl
-        clk_freq = 1e6
-
         m = Module()
 
-        with open('/home/bob_twinkles/Code/fpga/tools-venv/share/yosys/ice40/cells_sim.v') as cells_sim:
-            p.add_file('cells-sim.v', cells_sim)
-
         m.submodules.logic = logic = HighSpeedLogic()
+        if PRODUCER_DOMAIN:
+            # The testbench only has one clock
+            m.domains.producer = ClockDomain("producer")
+            m.d.comb += [
+                ClockSignal("producer").eq(ClockSignal()),
+                ResetSignal("producer").eq(ResetSignal()),
+            ]
 
         ports = logic.ports()
 
-        with open('blinker.cpp', 'w') as outf:
-            outf.write(cxxrtl.convert(m, platform=p, ports=ports))
+        if write_cxxrtl(m, p, ports):
+            print("blinker.cpp updated")
+        else:
+            print("blinker.cpp is up to date")
+
+    if args.action == "bench":
+        import re
+        import subprocess
+        import time
+
+        # make runs the simulate action when the sources changed, so the
+        # design is only converted once
+        subprocess.run(['make', 'blinker_tb'], check=True)
+
+        start = time.monotonic()
+        result = subprocess.run(['./blinker_tb', '--frames', str(args.frames)], check=True,
+                                capture_output=True, text=True)
+        elapsed = time.monotonic() - start
+
+        cycles = int(re.search(r'^cycles: (\d+)$', result.stdout, re.MULTILINE).group(1))
+        print("{} frames, {} cycles in {:.2f}s: {:.0f} cycles/s, {:.3f}x real time at {:.0f} MHz"
+              .format(args.frames, cycles, elapsed, cycles / elapsed,
+                      cycles / elapsed / PANEL_CLOCK, PANEL_CLOCK / 1e6))
 
     if args.action == "program":
         p.build(BoardMapping(False), do_program=True)
 
+        if FLASH_PLAYBACK and FLASH_ANIMATION is not None:
+            import subprocess
+            animation = compile_asset(FLASH_ANIMATION, 'flash', PANEL_COLUMNS * PANEL_CHAIN, 2 * PANEL_SCAN_ROWS,
+                                      FLASH_FORMAT, DOUBLE_BUFFER, ASSET_CACHE)
+            with open('build/animation.bin', 'wb') as outf:
+                outf.write(animation)
+            subprocess.run(['iceprog', '-o', hex(FLASH_ADDRESS), 'build/animation.bin'], check=True)
+
     if args.action == "verilog":
         from amaranth.back import verilog
         with open('top_icebreaker.v', 'w') as outf:
@@ -1,9 +1,15 @@
 from amaranth import *
+from ledpanel import Modulation
+from painters.util import delay
 
 class CycleAddrTest(Elaboratable):
+    # Largest latency main.TEST_CYCLES selects this painter for
     MAX_TEST_CYCLES = 2
 
     def __init__(self, cycles, driver, side):
+        self.modulation = driver.modulation
+        self.width = driver.width
+        self.scan_rows = driver.scan_rows
         self.x = driver.o_x
         self.frame = driver.o_frame
         self.subframe = driver.o_subframe
@@ -16,8 +22,9 @@ class CycleAddrTest(Elaboratable):
         else:
             raise ValueError("Driver doesn't export side {}".format(side))
 
-        assert cycles < 3
+        assert cycles >= 0
         self.cycles = cycles
+        self.latency = cycles
 
     def elaborate(self, platform):
         m = Module()
@@ -25,28 +32,21 @@ class CycleAddrTest(Elaboratable):
         x = self.x
         y = self.y
 
-        border_y = (y == 0) | (y == 63) # y == self.frame[0:6]
-        border_x = (x == 0) | (x == 63) # x == self.frame[0:6]
+        border_y = (y == 0) | (y == 2 * self.scan_rows - 1) # y == self.frame[0:6]
+        border_x = (x == 0) | (x == self.width - 1) # x == self.frame[0:6]
         border = border_x | border_y
         x_0 = x.any() & ~((x & (x - 1)).any())
         y_0 = y.any() & ~((y & (y - 1)).any())
 
-        subf_h = 0b0001 == self.subframe[-4:]
+        # Light the diagonals at 1/16th brightness
+        if self.modulation == Modulation.BCM:
+            subf_h = self.subframe == 4
+        else:
+            subf_h = 0b0001 == self.subframe[-4:]
 
         rgb = Signal(3)
-        rgb_ff_0 = Signal(3)
-        rgb_ff_1 = Signal(3)
         m.d.comb += rgb.eq(Cat(x_0 & subf_h, y_0 & subf_h, border))
-
-        m.d.sync += rgb_ff_0.eq(rgb)
-        m.d.sync += rgb_ff_1.eq(rgb_ff_0)
-
-        if self.cycles == 0:
-            m.d.comb += self.o_rgb.eq(rgb)
-        elif self.cycles == 1:
-            m.d.comb += self.o_rgb.eq(rgb_ff_0)
-        elif self.cycles == 2:
-            m.d.comb += self.o_rgb.eq(rgb_ff_1)
+        m.d.comb += self.o_rgb.eq(delay(m, rgb, self.cycles))
 
         return m
 
@@ -0,0 +1,233 @@
+from amaranth import *
+from amaranth.lib import data
+from ledpanel import PanelDriver
+from painters.util import PWM, Pipeline
+
+class Compositor(Elaboratable):
+    """
+    Painter which composes a background tile map and sprites at scanout time,
+    for both sides of the panel.
+
+    The panel is covered by a map of :attr:`TILE_SIZE` square tiles, each of
+    which shows one of the tile patterns. Sprites are :attr:`TILE_SIZE`
+    square patterns which can be placed anywhere on top. Patterns hold
+    ``color_bits`` bit indices into a palette of 24-bit colors. Index 0 is
+    transparent in sprites, and lower numbered sprites are drawn over higher
+    numbered ones. A sprite with ``behind`` set is only drawn over background
+    pixels with index 0.
+
+    Moving a sprite only needs its entry in ``sprites`` to be changed. Sprite
+    attributes are sampled at the start of every frame, so they can be
+    changed at any time without tearing.
+
+    Register it with :meth:`ledpanel.PanelDriver.add_painter` for both
+    sides, its :attr:`latency` is :attr:`LATENCY`.
+
+    Parameters
+    ----------
+    tiles : int
+        Number of tile patterns
+    sprites : int
+        Number of sprites
+    color_bits : int
+        Bits per palette index
+    tile_map : list of int
+        Initial tile map, row-major. Defaults to tile 0 everywhere.
+    tile_patterns : list of int
+        Initial tile patterns, :attr:`TILE_SIZE` squared palette indices each,
+        row-major. Defaults to index 0.
+    palette : list of int
+        Initial palette, as 24-bit RGB values. Defaults to black.
+
+    Attributes
+    ----------
+    latency : int
+        Cycles between the driver requesting a pixel and ``i_rgb0`` and
+        ``i_rgb1``
+    sprite_layout : StructLayout
+        Layout of a sprite's attributes. ``x`` and ``y`` are the position of
+        its top left corner, and wrap around past the edges of the panel so
+        sprites can be partially off screen.
+    sprites : list of Signal(sprite_layout), input
+        Attributes of each sprite
+    map_w_addr : Signal(range(map_width * map_height)), input
+        Tile map entry to write
+    map_w_data : Signal(range(tiles)), input
+        Tile to show
+    map_w_enable : Signal(1), input
+        Write enable for the tile map
+    tile_w_addr : Signal(range(tiles * TILE_SIZE ** 2)), input
+        Tile pattern pixel to write
+    tile_w_data : Signal(color_bits), input
+        Palette index to write
+    tile_w_enable : Signal(1), input
+        Write enable for the tile patterns
+    sprite_w_addr : Signal(range(sprites * TILE_SIZE ** 2)), input
+        Sprite pattern pixel to write
+    sprite_w_data : Signal(color_bits), input
+        Palette index to write
+    sprite_w_enable : Signal(1), input
+        Write enable for the sprite patterns
+    palette_w_addr : Signal(color_bits), input
+        Palette entry to write
+    palette_w_data : Signal(24), input
+        Color to write
+    palette_w_enable : Signal(1), input
+        Write enable for the palette
+    """
+    LATENCY = 3
+    TILE_SIZE = 8
+
+    def __init__(self, driver: PanelDriver, tiles=32, sprites=4, color_bits=4,
+                 tile_map=None, tile_patterns=None, palette=None):
+        self.latency = self.LATENCY
+
+        size = self.TILE_SIZE
+        height = 2 * driver.scan_rows
+        assert driver.width % size == 0
+        assert height % size == 0
+
+        self.driver = driver
+        self.tiles = tiles
+        self.n_sprites = sprites
+        self.color_bits = color_bits
+        self.map_width = driver.width // size
+        self.map_height = height // size
+
+        if tile_map is None:
+            tile_map = [0] * (self.map_width * self.map_height)
+        assert len(tile_map) == self.map_width * self.map_height
+        self.tile_map = tile_map
+
+        if tile_patterns is None:
+            tile_patterns = [0] * (tiles * size * size)
+        assert len(tile_patterns) == tiles * size * size
+        self.tile_patterns = tile_patterns
+
+        if palette is None:
+            palette = [0] * (1 << color_bits)
+        assert len(palette) == 1 << color_bits
+        self.palette = palette
+
+        self.sprite_layout = data.StructLayout({
+            "x": len(driver.o_x) + 1,
+            "y": len(driver.o_y0) + 1,
+            "enable": 1,
+            "behind": 1,
+        })
+        self.sprites = [Signal(self.sprite_layout, name="sprite{}".format(i)) for i in range(sprites)]
+
+        self.map_w_addr = Signal(range(self.map_width * self.map_height))
+        self.map_w_data = Signal(range(tiles))
+        self.map_w_enable = Signal()
+        self.tile_w_addr = Signal(range(tiles * size * size))
+        self.tile_w_data = Signal(color_bits)
+        self.tile_w_enable = Signal()
+        self.sprite_w_addr = Signal(range(sprites * size * size))
+        self.sprite_w_data = Signal(color_bits)
+        self.sprite_w_enable = Signal()
+        self.palette_w_addr = Signal(color_bits)
+        self.palette_w_data = Signal(24)
+        self.palette_w_enable = Signal()
+
+    def elaborate(self, platform):
+        m = Module()
+
+        size = self.TILE_SIZE
+        shift = (size - 1).bit_length()
+        driver = self.driver
+
+        tile_map = Memory(width=len(self.map_w_data), depth=self.map_width * self.map_height,
+                          name='tile_map', init=self.tile_map)
+        tile_patterns = Memory(width=self.color_bits, depth=self.tiles * size * size,
+                               name='tile_patterns', init=self.tile_patterns)
+        sprite_patterns = [Memory(width=self.color_bits, depth=size * size, name='sprite{}_pattern'.format(i))
+                           for i in range(self.n_sprites)]
+        palette = Memory(width=24, depth=1 << self.color_bits, name='palette', init=self.palette)
+
+        def write_port(memory, addr, data, enable):
+            port = memory.write_port()
+            m.submodules += port
+            m.d.comb += [
+                port.addr.eq(addr),
+                port.data.eq(data),
+                port.en.eq(enable),
+            ]
+
+        write_port(tile_map, self.map_w_addr, self.map_w_data, self.map_w_enable)
+        write_port(tile_patterns, self.tile_w_addr, self.tile_w_data, self.tile_w_enable)
+        for (i, pattern) in enumerate(sprite_patterns):
+            write_port(pattern, self.sprite_w_addr[:2 * shift], self.sprite_w_data,
+                       self.sprite_w_enable & (self.sprite_w_addr[2 * shift:] == i))
+        write_port(palette, self.palette_w_addr, self.palette_w_data, self.palette_w_enable)
+
+        def read_port(memory, addr):
+            port = memory.read_port(transparent=False)
+            m.submodules += port
+            m.d.comb += port.addr.eq(addr)
+            return port.data
+
+        # Sprite attributes only change between frames
+        sprites = []
+        for sprite in self.sprites:
+            latched = Signal(self.sprite_layout)
+            with m.If(driver.o_frame_start):
+                m.d.sync += latched.eq(sprite)
+            sprites.append(latched)
+
+        # Both sides line up, so they share the delayed subframe
+        subframe = None
+
+        for (y, o_rgb) in [(driver.o_y0, driver.i_rgb0), (driver.o_y1, driver.i_rgb1)]:
+            x = driver.o_x
+            pipeline = Pipeline(m)
+
+            # Cycle 0: look up the tile, and the sprite pixels
+            tile = read_port(tile_map, (y >> shift) * self.map_width + (x >> shift))
+
+            hits = []
+            sprite_colors = []
+            for (sprite, pattern) in zip(sprites, sprite_patterns):
+                dx = (x - sprite.x)[:len(sprite.x)]
+                dy = (y - sprite.y)[:len(sprite.y)]
+                hits.append(sprite.enable & (dx < size) & (dy < size))
+                sprite_colors.append(read_port(pattern, Cat(dx[:shift], dy[:shift])))
+
+            pipeline.stage(1)
+            x_in_tile = pipeline.align(x[:shift])
+            y_in_tile = pipeline.align(y[:shift])
+            hits = [pipeline.align(hit) for hit in hits]
+
+            # Cycle 1: look up the background pixel, and find the top sprite
+            # pixel
+            background = read_port(tile_patterns, Cat(x_in_tile, y_in_tile, tile))
+
+            sprite_color = Signal(self.color_bits)
+            sprite_behind = Signal()
+            m.d.sync += sprite_color.eq(0)
+            # Later assignments win, so go from the lowest priority up
+            for (hit, color, sprite) in reversed(list(zip(hits, sprite_colors, sprites))):
+                with m.If(hit & (color != 0)):
+                    m.d.sync += [
+                        sprite_color.eq(color),
+                        sprite_behind.eq(sprite.behind),
+                    ]
+
+            pipeline.stage(1)
+
+            # Cycle 2: pick the palette entry
+            show_sprite = (sprite_color != 0) & (~sprite_behind | (background == 0))
+            rgb = read_port(palette, Mux(show_sprite, sprite_color, background))
+            pipeline.stage(1)
+
+            pipeline.check(self.latency)
+            if subframe is None:
+                subframe = pipeline.align(driver.o_subframe)
+
+            # Cycle 3: modulate the top bits of each channel
+            bpp = driver.bpp
+            pwms = [PWM(rgb.word_select(c, 8)[8 - bpp:], subframe, driver.modulation) for c in range(3)]
+            m.submodules += pwms
+            m.d.comb += o_rgb.eq(Cat(*[pwm.o_bit for pwm in pwms]))
+
+        return m
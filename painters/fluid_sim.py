@@ -1,65 +1,374 @@
 from amaranth import *
-from .util import PWM, XORShiftRandomizer
+from amaranth.lib.cdc import FFSynchronizer, PulseSynchronizer
+from enum import Enum
+from .util import PWM, LeapAheadRandomizer, GammaLUT, TemporalDither, Pipeline
 from platform.icebreaker import SinglePortMemory
-from ledpanel import PanelDriver
+from ledpanel import PanelDriver, Modulation
+
+class BufferSwap(Elaboratable):
+    """
+    Bank selection for a double-buffered framebuffer.
+
+    Swap requests are held until the next frame boundary, so the displayed
+    bank only ever changes between frames.
+
+    Parameters
+    ----------
+    write_domain : str
+        Clock domain of the producer, which makes the swap requests and
+        writes to ``w_bank``. When this isn't ``sync``, ``swap`` is passed
+        through a :class:`PulseSynchronizer` and the bank through a
+        :class:`FFSynchronizer`, so ``pending``, ``swapped`` and ``w_bank``
+        follow a few ``write_domain`` cycles after ``vsync``.
+
+    Attributes
+    ----------
+    vsync : Signal(1), input
+        Frame boundary strobe, see :attr:`ledpanel.PanelDriver.o_frame_start`
+    swap : Signal(1), input
+        Request a swap at the next frame boundary. Only needs to be high for
+        one cycle. In ``write_domain``.
+    pending : Signal(1), output
+        High while a swap has been requested but has not happened yet. In
+        ``write_domain``.
+    swapped : Signal(1), output
+        High for one cycle when the banks are swapped. In ``write_domain``;
+        without a separate write domain this is the cycle in which ``vsync``
+        is high.
+    bank : Signal(1), output
+        Bank being displayed. This changes in the same cycle as ``vsync``
+        when a swap was requested, so the first pixel of the new frame is
+        already read from the new bank.
+    w_bank : Signal(1), output
+        ``bank`` in ``write_domain``. This changes in the same cycle as
+        ``swapped`` goes high.
+    """
+    def __init__(self, write_domain="sync"):
+        self.write_domain = write_domain
+
+        self.vsync = Signal()
+        self.swap = Signal()
+        self.pending = Signal()
+        self.swapped = Signal()
+        self.bank = Signal()
+        self.w_bank = Signal()
+
+    def elaborate(self, platform):
+        m = Module()
+
+        if self.write_domain == "sync":
+            swap = self.swap
+        else:
+            m.submodules.swap_sync = swap_sync = PulseSynchronizer(self.write_domain, "sync")
+            m.d.comb += swap_sync.i.eq(self.swap)
+            swap = swap_sync.o
+
+        request = Signal()
+        pending = Signal()
+        swapped = Signal()
+        pending_ff = Signal()
+        bank_ff = Signal()
+
+        m.d.comb += [
+            request.eq(swap | pending_ff),
+            swapped.eq(self.vsync & request),
+            pending.eq(request & ~self.vsync),
+            self.bank.eq(bank_ff ^ swapped),
+        ]
+        m.d.sync += [
+            pending_ff.eq(pending),
+            bank_ff.eq(self.bank),
+        ]
+
+        if self.write_domain == "sync":
+            m.d.comb += [
+                self.pending.eq(pending),
+                self.swapped.eq(swapped),
+                self.w_bank.eq(self.bank),
+            ]
+        else:
+            # The bank only changes once a frame, so it can cross as a level
+            m.submodules.bank_sync = FFSynchronizer(bank_ff, self.w_bank, o_domain=self.write_domain)
+
+            w_bank_ff = Signal()
+            waiting = Signal()
+            m.d.comb += [
+                self.swapped.eq(self.w_bank ^ w_bank_ff),
+                self.pending.eq(self.swap | (waiting & ~self.swapped)),
+            ]
+            m.d[self.write_domain] += [
+                w_bank_ff.eq(self.w_bank),
+                waiting.eq(self.pending),
+            ]
+
+        return m
+
+class PixelFormat(Enum):
+    """ How :class:`Framebuffer` stores pixels """
+
+    #: 8 bits per channel
+    RGB888 = 0
+    #: 5 bits of red, 6 of green and 5 of blue
+    RGB565 = 1
+    #: 4 bits per channel
+    RGB444 = 2
+    #: 8 bit index into a 256 entry color lookup table
+    INDEXED8 = 3
+
+    @property
+    def channel_bits(self):
+        """ Bits stored for R, G and B, or ``None`` for indexed formats """
+        return {
+            PixelFormat.RGB888: (8, 8, 8),
+            PixelFormat.RGB565: (5, 6, 5),
+            PixelFormat.RGB444: (4, 4, 4),
+            PixelFormat.INDEXED8: None,
+        }[self]
+
+    def pack(self, pixel):
+        """ Packs a 24-bit RGB pixel, or an index, the way it is stored """
+        if self.channel_bits is None:
+            return pixel & 0xff
+        stored = 0
+        offset = 0
+        for (c, bits) in enumerate(self.channel_bits):
+            stored |= ((pixel >> (8 * c + 8 - bits)) & ((1 << bits) - 1)) << offset
+            offset += bits
+        return stored
+
+    @property
+    def read_latency(self):
+        """ Cycles from :attr:`Framebuffer.r_addr` to :attr:`Framebuffer.r_data` """
+        if self == PixelFormat.INDEXED8:
+            # The index is read, then looked up in the CLUT
+            return 2
+        return 1
+
+def pack_channel(value, bits):
+    """ Keeps the top ``bits`` bits of an 8-bit channel value """
+    return value[8 - bits:]
+
+def expand_channel(value, bits):
+    """
+    Expands a ``bits`` bit channel value back to 8 bits by repeating it, so
+    that 0 and full scale are preserved.
+    """
+    repeated = Cat(*([value] * ((8 + bits - 1) // bits)))
+    return repeated[len(repeated) - 8:]
 
 class Framebuffer(Elaboratable):
     """
-    Framebuffer for half of the panel (64x32 pixels).
+    Framebuffer for half of the panel (64x32 pixels by default).
 
     This is implemented as a dual-port memory, so data may be read and written
-    to the framebuffer at the same time.
+    to the framebuffer at the same time. Pixels are stored row-major, so pixel
+    ``(x, y)`` lives at address ``y * width + x``.
+
+    Pixels are always written and read as 24-bit RGB, but may be stored in a
+    more compact :class:`PixelFormat`. Direct color formats keep the top bits
+    of each channel. :attr:`PixelFormat.INDEXED8` stores the low byte of
+    ``w_data`` and looks it up in a color lookup table on read. The table can
+    be rewritten through the ``clut_w_*`` port.
+
+    When ``double_buffered`` is set the memories hold two copies of the
+    image. The read port shows the front buffer and the write port fills the
+    back buffer, and they are swapped at a frame boundary after ``swap`` is
+    raised, so the panel never shows a partially written image. The back
+    buffer is not cleared by a swap: it holds the frame from before the
+    previous swap, so producers should redraw everything they care about.
+    Without ``double_buffered`` the swap handshake still works, but reads and
+    writes go to the same buffer.
+
+    The read port is in the ``sync`` domain with the painter. Producers may
+    run from a different clock by passing their ``write_domain``: the write
+    ports are then clocked from it, and the memory itself crosses the pixels
+    into the ``sync`` domain. The swap handshake is synchronized by
+    :class:`BufferSwap`.
+
+    Parameters
+    ----------
+    width : int
+        Number of columns, see :attr:`ledpanel.PanelDriver.width`
+    height : int
+        Number of rows, usually :attr:`ledpanel.PanelDriver.scan_rows`
+    double_buffered : bool
+        Store a front and a back buffer. Doubles the memory used.
+    pixel_format : PixelFormat
+        How pixels are stored
+    palette : list of int
+        Initial contents of the color lookup table for
+        :attr:`PixelFormat.INDEXED8`, as 24-bit RGB values. Defaults to a gray
+        ramp.
+    init : list of int
+        Initial image, as 24-bit RGB values or palette indices, row-major.
+        Both buffers start out with it. Defaults to white, see
+        ``tools/assets.py`` for converting images.
+    aux_read : bool
+        Add a second read port on the buffer being written, for producers
+        which read back what they draw, such as :class:`blitter.Blitter`.
+        This duplicates the memory on the iCE40.
+    write_domain : str
+        Clock domain of the ``w_*``, ``aux_r_*`` and ``clut_w_*`` ports, and
+        of ``swap``, ``swap_pending`` and ``swapped``
 
     Attributes
     ----------
-    r_addr : Signal(11), input
+    read_latency : int
+        Cycles between updating ``r_addr`` and ``r_data`` being valid
+    r_addr : Signal(range(width * height)), input
         Address to read from
     r_data : Signal(24), output
-        Data output from the read port. There is no latency between updating
-        ``r_addr`` and ``r_data`` being valid.
-    w_addr : Signal(11), input
+        Data output from the read port, ``read_latency`` cycles after
+        ``r_addr``.
+    w_addr : Signal(range(width * height)), input
         Address to write to
-    w_data : Signal(11), input
+    w_data : Signal(24), input
         Data to write
     w_enable : Signal(1), input
         Write enable signal. When high, the data coming in on ``w_data`` is
-        written to the address at ``w_addr``. If ``w_addr == r_addr`` then
-        ``r_data == w_data`` on the current cycle.
+        written to the address at ``w_addr``.
+    aux_r_addr : Signal(range(width * height)), input
+        Address to read from on the auxiliary read port, only with
+        ``aux_read``
+    aux_r_data : Signal(24), output
+        Data from the auxiliary read port, one cycle after ``aux_r_addr``.
+        This is in the form ``w_data`` takes, so palette indices are returned
+        as they are for :attr:`PixelFormat.INDEXED8`, and writing it back
+        doesn't change the pixel. Writes in the same cycle are seen.
+    clut_w_addr : Signal(8), input
+        Color lookup table entry to write
+    clut_w_data : Signal(24), input
+        Color to write to the lookup table
+    clut_w_enable : Signal(1), input
+        Write enable for the color lookup table
+    vsync : Signal(1), input
+        See :class:`BufferSwap`
+    swap : Signal(1), input
+        See :class:`BufferSwap`
+    swap_pending : Signal(1), output
+        See :attr:`BufferSwap.pending`
+    swapped : Signal(1), output
+        See :class:`BufferSwap`
     """
-    def __init__(self):
-        self.r_addr = Signal(range(64 * 32), reset_less=True)
+    def __init__(self, width=64, height=32, double_buffered=False,
+                 pixel_format=PixelFormat.RGB888, palette=None, init=None, aux_read=False,
+                 write_domain="sync"):
+        self.width = width
+        self.height = height
+        self.double_buffered = double_buffered
+        self.aux_read = aux_read
+        self.write_domain = write_domain
+        self.pixel_format = pixel_format
+        self.read_latency = pixel_format.read_latency
+
+        if palette is None:
+            palette = [i * 0x010101 for i in range(256)]
+        assert len(palette) == 256
+        self.palette = palette
+
+        if init is None:
+            init = [0xffffff for _ in range(width * height)]
+        assert len(init) == width * height
+        self.init = init
+
+        self.r_addr = Signal(range(width * height), reset_less=True)
         self.r_data = Signal(24, reset_less=True)
 
-        self.w_addr = Signal(range(64 * 32), reset_less=True)
+        self.w_addr = Signal(range(width * height), reset_less=True)
         self.w_data = Signal(24, reset_less=True)
         self.w_enable = Signal(1, reset_less=True)
 
-    def elaborate(self, platform):
-        import random
+        self.aux_r_addr = Signal(range(width * height), reset_less=True)
+        self.aux_r_data = Signal(24, reset_less=True)
+
+        self.clut_w_addr = Signal(8, reset_less=True)
+        self.clut_w_data = Signal(24, reset_less=True)
+        self.clut_w_enable = Signal(1, reset_less=True)
 
+        self.vsync = Signal()
+        self.swap = Signal()
+        self.swap_pending = Signal()
+        self.swapped = Signal()
+
+    def elaborate(self, platform):
         m = Module()
 
-        # RGB image planes
-        random.seed(3)
-        plane_names = ['r', 'g', 'b']
-        for i in range(3):
+        m.submodules.swap = swap = BufferSwap(self.write_domain)
+        m.d.comb += [
+            swap.vsync.eq(self.vsync),
+            swap.swap.eq(self.swap),
+            self.swap_pending.eq(swap.pending),
+            self.swapped.eq(swap.swapped),
+        ]
+
+        size = self.width * self.height
+        if self.double_buffered:
+            banks = 2
+            r_addr = Mux(swap.bank, size + self.r_addr, self.r_addr)
+            w_addr = Mux(swap.w_bank, self.w_addr, size + self.w_addr)
+            aux_r_addr = Mux(swap.w_bank, self.aux_r_addr, size + self.aux_r_addr)
+        else:
+            banks = 1
+            r_addr = self.r_addr
+            w_addr = self.w_addr
+            aux_r_addr = self.aux_r_addr
+
+        channel_bits = self.pixel_format.channel_bits
+        if channel_bits is None:
+            stored = self.w_data[0:8]
+        else:
+            stored = Cat(*[pack_channel(self.w_data[(i * 8):(i + 1) * 8], channel_bits[i])
+                           for i in range(3)])
 
-            # green plane is always on
+        def unpack(value):
+            channels = []
+            offset = 0
+            for bits in channel_bits:
+                channels.append(expand_channel(value[offset:offset + bits], bits))
+                offset += bits
+            return Cat(*channels)
 
-            mem = Memory(width=8, depth=64 * 32, name = 'plane_' + plane_names[i], init=[
-                0xff for _ in range(64 * 32)
-            ])
+        mem = Memory(width=len(stored), depth=banks * size, name='pixels', init=[
+            self.pixel_format.pack(pixel) for pixel in self.init
+        ] * banks)
 
-            read_port = mem.read_port()
-            m.submodules += read_port
-            m.d.comb += read_port.addr.eq(self.r_addr)
-            m.d.comb += self.r_data[(i * 8):(i + 1) * 8].eq(read_port.data)
+        # Reads only see writes from the same cycle when they share a clock
+        read_port = mem.read_port(transparent=self.write_domain == "sync")
+        m.submodules += read_port
+        m.d.comb += read_port.addr.eq(r_addr)
 
-            write_port = mem.write_port()
-            m.submodules += write_port
-            m.d.comb += write_port.addr.eq(self.w_addr)
-            m.d.comb += write_port.data.eq(self.w_data[(i * 8):(i + 1) * 8])
-            m.d.comb += write_port.en.eq(self.w_enable)
+        write_port = mem.write_port(domain=self.write_domain)
+        m.submodules += write_port
+        m.d.comb += write_port.addr.eq(w_addr)
+        m.d.comb += write_port.data.eq(stored)
+        m.d.comb += write_port.en.eq(self.w_enable)
+
+        if self.aux_read:
+            aux_read_port = mem.read_port(domain=self.write_domain, transparent=True)
+            m.submodules += aux_read_port
+            m.d.comb += aux_read_port.addr.eq(aux_r_addr)
+            if channel_bits is None:
+                m.d.comb += self.aux_r_data.eq(aux_read_port.data)
+            else:
+                m.d.comb += self.aux_r_data.eq(unpack(aux_read_port.data))
+
+        if channel_bits is None:
+            clut = Memory(width=24, depth=256, name='clut', init=self.palette)
+
+            clut_read_port = clut.read_port(transparent=self.write_domain == "sync")
+            m.submodules += clut_read_port
+            m.d.comb += clut_read_port.addr.eq(read_port.data)
+            m.d.comb += self.r_data.eq(clut_read_port.data)
+
+            clut_write_port = clut.write_port(domain=self.write_domain)
+            m.submodules += clut_write_port
+            m.d.comb += [
+                clut_write_port.addr.eq(self.clut_w_addr),
+                clut_write_port.data.eq(self.clut_w_data),
+                clut_write_port.en.eq(self.clut_w_enable),
+            ]
+        else:
+            m.d.comb += self.r_data.eq(unpack(read_port.data))
 
         return m
 
@@ -67,21 +376,60 @@ class Painter(Elaboratable):
     """
     Painter for the fluid simulator.
 
+    Register it with :meth:`ledpanel.PanelDriver.add_painter` for its side,
+    its :attr:`latency` is :meth:`latency_for` the framebuffer and curve.
+
+    Parameters
+    ----------
+    curve : callable
+        Optional transfer curve applied to each channel on the way out of the
+        framebuffer, see :class:`painters.util.GammaLUT`
+    curve_bits : int
+        Bits per channel after the curve. The top ``driver.bpp`` bits are
+        displayed.
+    dither : bool
+        Dither the bits below the top ``driver.bpp`` over successive frames
+        instead of dropping them, see :class:`painters.util.TemporalDither`.
+        Needs a ``curve_bits`` or framebuffer depth greater than the driver's
+        ``bpp``.
+
     Attributes
     ----------
+    latency : int
+        Cycles between the driver requesting a pixel and ``o_rgb``
     o_rgb : Signal(3), output
         Single-bit output for each of the R,G,B channels
 
-    fb_w_addr: Signal(11), input
+    fb_w_addr: Signal(range(width * height)), input
         See documentation of :class:`Framebuffer`
     fb_w_data: Signal(24), input
         See documentation of :class:`Framebuffer`
     fb_w_enable: Signal(1), input
         See documentation of :class:`Framebuffer`
+    fb_swap: Signal(1), input
+        See documentation of :class:`Framebuffer`
+    fb_swapped: Signal(1), output
+        See documentation of :class:`Framebuffer`
+    fb_swap_pending: Signal(1), output
+        See documentation of :class:`Framebuffer`
     """
-    LATENCY = 1
+    @staticmethod
+    def latency_for(framebuffer: Framebuffer, curve=None):
+        """ Latency of a painter reading from ``framebuffer`` """
+        latency = framebuffer.read_latency
+        if curve is not None:
+            latency += GammaLUT.LATENCY
+        return latency
+
+    def __init__(self, driver: PanelDriver, side: int, framebuffer: Framebuffer,
+                 curve=None, curve_bits=8, dither=False):
+        self.curve = curve
+        self.curve_bits = curve_bits if curve is not None else 8
+        self.dither = dither
+        assert self.curve_bits >= driver.bpp
+        assert not dither or self.curve_bits > driver.bpp
+        self.latency = self.latency_for(framebuffer, curve)
 
-    def __init__(self, driver: PanelDriver, side: int, framebuffer: Framebuffer):
         self.driver = driver
         self.x = driver.o_x
         self.frame = driver.o_frame
@@ -97,9 +445,12 @@ class Painter(Elaboratable):
         else:
             raise ValueError("Driver doesn't export side {}".format(side))
 
-        self.fb_w_addr = Signal(11)
+        self.fb_w_addr = Signal.like(framebuffer.w_addr)
         self.fb_w_data = Signal(24)
         self.fb_w_enable = Signal(1)
+        self.fb_swap = Signal(1)
+        self.fb_swapped = Signal(1)
+        self.fb_swap_pending = Signal(1)
 
     def elaborate(self, platform):
         m = Module()
@@ -107,27 +458,62 @@ class Painter(Elaboratable):
         x = self.x
         y = self.y
 
+        pipeline = Pipeline(m)
+
+        # Framebuffer readback
+        rgb8 = Signal(24)
+        m.d.comb += rgb8.eq(self.framebuffer.r_data)
+        pipeline.stage(self.framebuffer.read_latency)
+
+        if self.curve is not None:
+            m.submodules.gamma = gamma = GammaLUT(self.curve, out_bits=self.curve_bits)
+            m.d.comb += gamma.i.eq(rgb8)
+            pipeline.stage(gamma.LATENCY)
+            color = gamma.o
+        else:
+            color = rgb8
+
+        pipeline.check(self.latency)
+
         # heartbeat tracer drop
         is_zero_zero = (y == 0) & (x == self.frame[0:6])
         val_zero_zero = 1 # self.frame[1]
-        is_zero_zero_ff = Signal()
-        m.d.sync += is_zero_zero_ff.eq(is_zero_zero)
+        is_zero_zero_ff = pipeline.align(is_zero_zero)
 
-        # Framebuffer readback
-        rgb8 = Signal(24)
+        # The subframe the pixel was requested for
+        subframe = pipeline.align(self.subframe)
 
-        m.submodules.pwm_r = pwm_r = PWM(rgb8[ 0: 8], self.subframe)
-        m.submodules.pwm_g = pwm_g = PWM(rgb8[ 8:16], self.subframe)
-        m.submodules.pwm_b = pwm_b = PWM(rgb8[16:24], self.subframe)
+        # Only the top bits of each channel are scanned out
+        bits = self.curve_bits
+        bpp = self.driver.bpp
+        if self.dither:
+            m.submodules.dither = dither = TemporalDither(bits, bpp)
+            m.d.comb += [
+                dither.i.eq(color),
+                dither.x.eq(pipeline.align(x[0:2])),
+                dither.y.eq(pipeline.align(y[0:2])),
+                dither.frame.eq(pipeline.align(self.frame)),
+            ]
+            channels = [dither.o.word_select(c, bpp) for c in range(3)]
+        else:
+            channels = [color.word_select(c, bits)[bits - bpp:] for c in range(3)]
 
-        m.d.comb += rgb8.eq(self.framebuffer.r_data)
-        m.d.comb += self.framebuffer.r_addr.eq(Cat(x, y))
+        modulation = self.driver.modulation
+        m.submodules.pwm_r = pwm_r = PWM(channels[0], subframe, modulation)
+        m.submodules.pwm_g = pwm_g = PWM(channels[1], subframe, modulation)
+        m.submodules.pwm_b = pwm_b = PWM(channels[2], subframe, modulation)
+        # The top bit of y selects the side, which is a separate framebuffer
+        m.d.comb += self.framebuffer.r_addr.eq(y[:-1] * self.framebuffer.width + x)
 
         # Framebuffer write binding
         m.d.comb += [
             self.framebuffer.w_addr.eq(self.fb_w_addr),
             self.framebuffer.w_data.eq(self.fb_w_data),
             self.framebuffer.w_enable.eq(self.fb_w_enable),
+            self.framebuffer.vsync.eq(self.driver.o_frame_start),
+            self.framebuffer.swap.eq(self.fb_swap),
+            self.fb_swapped.eq(self.framebuffer.swapped),
+            self.fb_swap_pending.eq(self.framebuffer.swap_pending),
         ]
 
         # output colors to the scanner
@@ -142,6 +528,252 @@ class Painter(Elaboratable):
         return m
 
 
+class BitplaneFramebuffer(Elaboratable):
+    """
+    Framebuffer for half of the panel, stored as bitplanes.
+
+    The write port is the same as :class:`Framebuffer`'s, so the two are
+    interchangeable for producers. The read port returns one bitplane of
+    :attr:`PIXELS_PER_WORD` consecutive pixels at a time, which is what a
+    :class:`ledpanel.Modulation.BCM` scanner shifts out, so pixel values never
+    need to be compared against the subframe.
+
+    Each memory holds two bitplanes of one channel, with the bits of a pixel
+    next to each other. A pixel write is then a single masked write to every
+    memory, and each memory fills exactly one UP5K EBR for a 64x32 half panel.
+
+    Parameters
+    ----------
+    width : int
+        Number of columns, must be a multiple of :attr:`PIXELS_PER_WORD`
+    height : int
+        Number of rows
+    bpp : int
+        Number of bitplanes stored. Only the top ``bpp`` bits of each
+        channel are kept.
+    double_buffered : bool
+        See :class:`Framebuffer`
+    write_domain : str
+        See :class:`Framebuffer`
+
+    Attributes
+    ----------
+    r_addr : Signal(range(width * height // PIXELS_PER_WORD)), input
+        Word to read. Word ``n`` holds pixel addresses ``n * PIXELS_PER_WORD``
+        up to ``(n + 1) * PIXELS_PER_WORD - 1``.
+    r_plane : Signal(range(bpp)), input
+        Bitplane to read
+    r_en : Signal(1), input
+        Read enable. ``r_data`` holds its value while this is low.
+    r_data : Signal(3 * PIXELS_PER_WORD), output
+        R, G and B bits of each pixel in the word, lowest address first.
+        Valid one cycle after ``r_en`` is high.
+    w_addr : Signal(range(width * height)), input
+        See :class:`Framebuffer`
+    w_data : Signal(24), input
+        See :class:`Framebuffer`
+    w_enable : Signal(1), input
+        See :class:`Framebuffer`
+    vsync : Signal(1), input
+        See :class:`Framebuffer`
+    swap : Signal(1), input
+        See :class:`Framebuffer`
+    swap_pending : Signal(1), output
+        See :class:`Framebuffer`
+    swapped : Signal(1), output
+        See :class:`Framebuffer`
+    """
+    PIXELS_PER_WORD = 8
+    PLANES_PER_WORD = 2
+
+    def __init__(self, width=64, height=32, bpp=8, double_buffered=False, write_domain="sync"):
+        assert width % self.PIXELS_PER_WORD == 0
+        assert 1 <= bpp <= 8
+
+        self.width = width
+        self.height = height
+        self.bpp = bpp
+        self.double_buffered = double_buffered
+        self.write_domain = write_domain
+
+        self.r_addr = Signal(range(width * height // self.PIXELS_PER_WORD), reset_less=True)
+        self.r_plane = Signal(range(bpp), reset_less=True)
+        self.r_en = Signal(1, reset_less=True)
+        self.r_data = Signal(3 * self.PIXELS_PER_WORD, reset_less=True)
+
+        self.w_addr = Signal(range(width * height), reset_less=True)
+        self.w_data = Signal(24, reset_less=True)
+        self.w_enable = Signal(1, reset_less=True)
+
+        self.vsync = Signal()
+        self.swap = Signal()
+        self.swap_pending = Signal()
+        self.swapped = Signal()
+
+    def elaborate(self, platform):
+        m = Module()
+
+        ppw = self.PIXELS_PER_WORD
+        planes = self.PLANES_PER_WORD
+        groups = (self.bpp + planes - 1) // planes
+
+        m.submodules.swap = swap = BufferSwap(self.write_domain)
+        m.d.comb += [
+            swap.vsync.eq(self.vsync),
+            swap.swap.eq(self.swap),
+            self.swap_pending.eq(swap.pending),
+            self.swapped.eq(swap.swapped),
+        ]
+
+        words = self.width * self.height // ppw
+        if self.double_buffered:
+            banks = 2
+            r_addr = Mux(swap.bank, words + self.r_addr, self.r_addr)
+            w_addr = Mux(swap.w_bank, self.w_addr // ppw, words + self.w_addr // ppw)
+        else:
+            banks = 1
+            r_addr = self.r_addr
+            w_addr = self.w_addr // ppw
+
+        # Plane the data on the read port belongs to
+        r_plane_ff = Signal.like(self.r_plane)
+        with m.If(self.r_en):
+            m.d.sync += r_plane_ff.eq(self.r_plane)
+
+        plane_names = ['r', 'g', 'b']
+        channels = []
+        for c in range(3):
+            value = self.w_data[(c * 8):(c + 1) * 8][8 - self.bpp:]
+            value = Cat(value, Const(0, groups * planes - self.bpp))
+
+            group_data = []
+            for g in range(groups):
+                mem = Memory(width=ppw * planes, depth=banks * words,
+                             name='bitplane_{}{}'.format(plane_names[c], g))
+
+                # Only the memory holding the requested plane is read
+                read_port = mem.read_port(transparent=False)
+                m.submodules += read_port
+                m.d.comb += read_port.addr.eq(r_addr)
+                m.d.comb += read_port.en.eq(self.r_en & (self.r_plane // planes == g))
+                group_data.append(read_port.data)
+
+                write_port = mem.write_port(domain=self.write_domain, granularity=planes)
+                m.submodules += write_port
+                m.d.comb += write_port.addr.eq(w_addr)
+                m.d.comb += write_port.data.eq(Repl(value.word_select(g, planes), ppw))
+                with m.If(self.w_enable):
+                    m.d.comb += write_port.en.eq(1 << (self.w_addr % ppw))
+
+            r_group = Array(group_data)[r_plane_ff // planes]
+            r_bit = r_plane_ff % planes
+            channels.append([r_group.bit_select(i * planes + r_bit, 1) for i in range(ppw)])
+
+        m.d.comb += self.r_data.eq(Cat(*[Cat(channels[0][i], channels[1][i], channels[2][i])
+                                         for i in range(ppw)]))
+
+        return m
+
+
+class BitplanePainter(Elaboratable):
+    """
+    Painter which scans out a :class:`BitplaneFramebuffer`.
+
+    Only works with a :class:`ledpanel.Modulation.BCM` driver, since the
+    subframe is used as the bitplane index. A framebuffer word is read every
+    :attr:`BitplaneFramebuffer.PIXELS_PER_WORD` pixels and shifted out from a
+    register, which relies on the scanner visiting the columns of a row in
+    order, one per cycle.
+
+    Attributes
+    ----------
+    latency : int
+        Cycles between the driver requesting a pixel and ``o_rgb``, always
+        :attr:`LATENCY`
+    o_rgb : Signal(3), output
+        Single-bit output for each of the R,G,B channels
+
+    fb_w_addr: Signal(range(width * height)), input
+        See documentation of :class:`Framebuffer`
+    fb_w_data: Signal(24), input
+        See documentation of :class:`Framebuffer`
+    fb_w_enable: Signal(1), input
+        See documentation of :class:`Framebuffer`
+    fb_swap: Signal(1), input
+        See documentation of :class:`Framebuffer`
+    fb_swapped: Signal(1), output
+        See documentation of :class:`Framebuffer`
+    fb_swap_pending: Signal(1), output
+        See documentation of :class:`Framebuffer`
+    """
+    LATENCY = 1
+
+    def __init__(self, driver: PanelDriver, side: int, framebuffer: BitplaneFramebuffer):
+        assert driver.modulation == Modulation.BCM
+        assert driver.bpp == framebuffer.bpp
+        self.latency = self.LATENCY
+
+        self.driver = driver
+        self.x = driver.o_x
+        self.subframe = driver.o_subframe
+        self.framebuffer = framebuffer
+        self.side = side
+        if side == 0:
+            self.y = driver.o_y0
+            self.o_rgb = driver.i_rgb0
+        elif side == 1:
+            self.y = driver.o_y1
+            self.o_rgb = driver.i_rgb1
+        else:
+            raise ValueError("Driver doesn't export side {}".format(side))
+
+        self.fb_w_addr = Signal.like(framebuffer.w_addr)
+        self.fb_w_data = Signal(24)
+        self.fb_w_enable = Signal(1)
+        self.fb_swap = Signal(1)
+        self.fb_swapped = Signal(1)
+        self.fb_swap_pending = Signal(1)
+
+    def elaborate(self, platform):
+        m = Module()
+
+        ppw = BitplaneFramebuffer.PIXELS_PER_WORD
+        x = self.x
+        y = self.y
+
+        # Read a new word at the start of every group of pixels
+        first = Signal()
+        first_ff = Signal()
+        m.d.comb += first.eq(x % ppw == 0)
+        m.d.sync += first_ff.eq(first)
+
+        m.d.comb += [
+            self.framebuffer.r_addr.eq((y[:-1] * self.framebuffer.width + x) // ppw),
+            self.framebuffer.r_plane.eq(self.subframe),
+            self.framebuffer.r_en.eq(first),
+        ]
+
+        # Framebuffer write binding
+        m.d.comb += [
+            self.framebuffer.w_addr.eq(self.fb_w_addr),
+            self.framebuffer.w_data.eq(self.fb_w_data),
+            self.framebuffer.w_enable.eq(self.fb_w_enable),
+            self.framebuffer.vsync.eq(self.driver.o_frame_start),
+            self.framebuffer.swap.eq(self.fb_swap),
+            self.fb_swapped.eq(self.framebuffer.swapped),
+            self.fb_swap_pending.eq(self.framebuffer.swap_pending),
+        ]
+
+        # The rest of the word is shifted out of a register
+        pixels = Signal.like(self.framebuffer.r_data)
+        word = Mux(first_ff, self.framebuffer.r_data, pixels)
+        m.d.sync += pixels.eq(word >> 3)
+
+        m.d.comb += self.o_rgb.eq(word[0:3])
+
+        return m
+
+
 class SimDoubleBuffer(Elaboratable):
     """
     Double buffer the simulation memory, effectively turning two single port
@@ -180,7 +812,7 @@ class SimDoubleBuffer(Elaboratable):
     def elaborate(self, platform):
         m = Module()
 
-        rams = [SinglePortMemory(), SinglePortMemory()]
+        rams = [SinglePortMemory(64 * 64), SinglePortMemory(64 * 64)]
 
         m.submodules += rams
 
@@ -206,28 +838,436 @@ class SimDoubleBuffer(Elaboratable):
         return m
 
 
+class BankHash(Enum):
+    """
+    How :class:`BankedSimMemory` spreads cells between the two memories of a
+    bank pair. Two accesses in the same cycle must go to different
+    memories.
+    """
+
+    #: Alternate rows. Rows an odd distance apart never conflict, such as
+    #: two kernels scanning the two halves of the grid with their halo rows.
+    ROW = 0
+    #: Alternate columns. Horizontally adjacent cells never conflict.
+    COLUMN = 1
+    #: Alternate both. Horizontally or vertically adjacent cells never
+    #: conflict, and neither do rows an odd distance apart.
+    CHECKERBOARD = 2
+
+class SimMemoryPort:
+    """
+    One read and one write port of :class:`BankedSimMemory`, with the same
+    signals and timing as :class:`SimDoubleBuffer`
+    """
+    def __init__(self, depth):
+        self.r_address = Signal(range(depth))
+        self.r_data = Signal(16)
+
+        self.w_address = Signal(range(depth))
+        self.w_data = Signal(16)
+        self.w_enable = Signal()
+
+class BankedSimMemory(Elaboratable):
+    """
+    Double buffer the simulation memory across all four SPRAMs, with two read
+    and two write ports.
+
+    Each buffer is a pair of memories with the cells spread between them by
+    ``bank_hash``. While one pair is read the other is written, like
+    :class:`SimDoubleBuffer`, and each port can reach every cell. Accesses
+    which land in the same memory in the same cycle conflict, and port 0
+    wins: users need an access pattern which ``bank_hash`` keeps apart.
+
+    Parameters
+    ----------
+    width : int
+        Width of the grid, a power of two
+    height : int
+        Height of the grid
+    bank_hash : BankHash
+        How cells are spread across the memories of a pair
+
+    Attributes
+    ----------
+    frame : Signal(1), input
+        Which pair is currently being read. The other pair is currently being
+        written.
+    ports : list of SimMemoryPort
+        The two ports
+    """
+    def __init__(self, width=64, height=64, bank_hash=BankHash.ROW):
+        assert width & (width - 1) == 0
+
+        self.width = width
+        self.height = height
+        self.bank_hash = bank_hash
+
+        self.frame = Signal()
+        self.ports = [SimMemoryPort(width * height) for _ in range(2)]
+
+    def bank(self, address):
+        """ Returns the memory of a pair holding ``address``, and the address in it """
+        x_bits = (self.width - 1).bit_length()
+        x = address[:x_bits]
+        y = address[x_bits:]
+        if self.bank_hash == BankHash.ROW:
+            return (y[0], Cat(x, y[1:]))
+        elif self.bank_hash == BankHash.COLUMN:
+            return (x[0], Cat(x[1:], y))
+        elif self.bank_hash == BankHash.CHECKERBOARD:
+            return (x[0] ^ y[0], Cat(x[1:], y))
+        raise ValueError("Unknown bank hash {}".format(self.bank_hash))
+
+    def elaborate(self, platform):
+        m = Module()
+
+        rams = [SinglePortMemory(self.width * self.height // 2) for _ in range(4)]
+        m.submodules += rams
+
+        reads = [self.bank(port.r_address) for port in self.ports]
+        writes = [self.bank(port.w_address) for port in self.ports]
+
+        for (i, ram) in enumerate(rams):
+            (pair, select) = (i // 2, i % 2)
+            m.d.comb += ram.rw.eq(0)
+
+            with m.If(self.frame == pair):
+                # Reversed so port 0 wins
+                for ((bank, address), port) in reversed(list(zip(reads, self.ports))):
+                    with m.If(bank == select):
+                        m.d.comb += ram.address.eq(address)
+            with m.Else():
+                for ((bank, address), port) in reversed(list(zip(writes, self.ports))):
+                    with m.If(port.w_enable & (bank == select)):
+                        m.d.comb += [
+                            ram.address.eq(address),
+                            ram.w_data.eq(port.w_data),
+                            ram.rw.eq(1),
+                        ]
+
+        # Read data comes back a cycle later, from the memory the address
+        # went to then
+        frame_ff = Signal()
+        m.d.sync += frame_ff.eq(self.frame)
+        for ((bank, address), port) in zip(reads, self.ports):
+            bank_ff = Signal()
+            m.d.sync += bank_ff.eq(bank)
+            with m.Switch(Cat(bank_ff, frame_ff)):
+                for (i, ram) in enumerate(rams):
+                    with m.Case(i):
+                        m.d.comb += port.r_data.eq(ram.r_data)
+
+        return m
+
+
+class AdvectDiffuseKernel(Elaboratable):
+    """
+    Streaming advection + diffusion kernel.
+
+    Cells are 16-bit unsigned fixed-point densities. One simulation step reads
+    the current state in raster order at one cell per clock, keeps the two
+    previous rows in a line buffer, and writes the next state at one cell per
+    clock. Each output cell is a weighted sum of its 5 point neighbourhood:
+    diffusion spreads density evenly to the neighbours, and first-order upwind
+    advection moves it along a constant velocity. Nothing flows through the
+    walls: a cell on the edge of the grid keeps the share of its density that
+    would have moved to a neighbour off the grid, so a step conserves the
+    total density up to rounding. Density that piles up against a wall
+    saturates at ``0xffff``.
+
+    A step takes ``(width + 1) * (height + 1)`` cycles plus a few cycles of
+    pipeline latency. A kernel can also compute just some of the rows, so
+    several kernels can share a step. It then reads the rows on either side
+    as well, and takes ``(width + 1)`` cycles for each row read plus one.
+
+    Parameters
+    ----------
+    width : int
+        Width of the grid
+    height : int
+        Height of the grid
+    diffusion : float
+        Fraction of a cell's density that moves to each neighbour every step
+    velocity : (float, float)
+        Velocity along x and y in cells per step, each in ``[-1, 1]``
+    coef_bits : int
+        Fractional bits of the fixed-point stencil coefficients
+    rows : range
+        Rows to compute. Defaults to all of them.
+
+    Attributes
+    ----------
+    start : Signal(), input
+        Pulse high to start a step. Ignored while ``busy``.
+    busy : Signal(), output
+        High while a step is running
+    r_address : Signal(range(width * height)), output
+        Address of the current state to read, see :class:`SimDoubleBuffer`
+    r_data : Signal(16), input
+        Data from ``r_address``, one cycle after it was set
+    w_address : Signal(range(width * height)), output
+        Address of the next state to write
+    w_data : Signal(16), output
+        Data to write
+    w_enable : Signal(), output
+        Write enable
+    """
+    def __init__(self, width=64, height=64, diffusion=1 / 16, velocity=(1 / 8, 1 / 16), coef_bits=8,
+                 rows=None):
+        if rows is None:
+            rows = range(height)
+        assert rows.step == 1 and 0 <= rows.start < rows.stop <= height
+
+        self.width = width
+        self.height = height
+        self.rows = rows
+        self.coef_bits = coef_bits
+        self.coefficients = self.stencil_coefficients(diffusion, velocity, coef_bits)
+
+        self.start = Signal()
+        self.busy = Signal()
+
+        self.r_address = Signal(range(width * height))
+        self.r_data = Signal(16)
+
+        self.w_address = Signal(range(width * height))
+        self.w_data = Signal(16)
+        self.w_enable = Signal()
+
+    @staticmethod
+    def stencil_coefficients(diffusion, velocity, coef_bits):
+        """
+        Fixed-point weights for the center, north, south, east and west
+        neighbours. The weights sum to exactly ``1 << coef_bits``, so away
+        from the walls the update conserves density and never overflows.
+        """
+        (vx, vy) = velocity
+        assert -1 <= vx <= 1 and -1 <= vy <= 1
+
+        weights = {
+            # Upwind advection pulls density in from the neighbour the flow
+            # is coming from
+            'n': diffusion + max(vy, 0),
+            's': diffusion + max(-vy, 0),
+            'e': diffusion + max(-vx, 0),
+            'w': diffusion + max(vx, 0),
+        }
+        one = 1 << coef_bits
+        coefficients = {k: int(round(v * one)) for (k, v) in weights.items()}
+        coefficients['c'] = one - sum(coefficients.values())
+
+        if min(coefficients.values()) < 0:
+            raise ValueError("Unstable stencil (diffusion={}, velocity={}), "
+                             "the center weight would be negative".format(diffusion, velocity))
+
+        return coefficients
+
+    def elaborate(self, platform):
+        m = Module()
+
+        width = self.width
+        height = self.height
+
+        # Rows read, including the neighbours of the rows computed
+        first_row = max(self.rows.start - 1, 0)
+        read_rows = min(self.rows.stop + 1, height) - first_row
+
+        # Stage 0: scan position, relative to first_row. Column ``width``
+        # and row ``read_rows`` are flush slots which don't read anything,
+        # but push the last column and row through the window.
+        sx = Signal(range(width + 1))
+        sy = Signal(range(read_rows + 1))
+        scanning = Signal()
+
+        # Each line buffer entry holds the two rows above the one being read
+        line_buffer = Memory(width=32, depth=width, name='line_buffer')
+        m.submodules.lb_r = lb_r = line_buffer.read_port()
+        m.submodules.lb_w = lb_w = line_buffer.write_port()
+
+        m.d.comb += self.r_address.eq((first_row + sy) * width + sx)
+        m.d.comb += lb_r.addr.eq(sx)
+
+        with m.If(scanning):
+            with m.If(sx == width):
+                m.d.sync += sx.eq(0)
+                with m.If(sy == read_rows):
+                    m.d.sync += scanning.eq(0)
+                with m.Else():
+                    m.d.sync += sy.eq(sy + 1)
+            with m.Else():
+                m.d.sync += sx.eq(sx + 1)
+        with m.Elif(self.start & ~self.busy):
+            m.d.sync += Cat(sx, sy).eq(0)
+            m.d.sync += scanning.eq(1)
+
+        # Stage 1: the column at s1_x arrives from the memories and is
+        # shifted into the 3x3 window
+        s1_valid = Signal()
+        s1_x = Signal.like(sx)
+        s1_y = Signal.like(sy)
+        m.d.sync += [
+            s1_valid.eq(scanning),
+            s1_x.eq(sx),
+            s1_y.eq(sy),
+        ]
+
+        (above, middle) = (lb_r.data[0:16], lb_r.data[16:32])
+        below = self.r_data
+
+        m.d.comb += [
+            lb_w.addr.eq(s1_x),
+            lb_w.data.eq(Cat(middle, below)),
+            lb_w.en.eq(s1_valid & (s1_x != width) & (s1_y != read_rows)),
+        ]
+
+        # window[column][row], column 1 is the center
+        window = [[Signal(16, name='win_{}_{}'.format(c, r)) for r in range(3)] for c in range(3)]
+        with m.If(s1_valid):
+            for c in range(2):
+                m.d.sync += [window[c][r].eq(window[c + 1][r]) for r in range(3)]
+            m.d.sync += [
+                window[2][0].eq(above),
+                window[2][1].eq(middle),
+                window[2][2].eq(below),
+            ]
+
+        # Stage 2: the window is centered on (s2_x, s2_y). Scale each
+        # neighbour. For a neighbour off the grid, the center keeps what it
+        # would have sent there, which is the weight of the opposite
+        # neighbour. Neighbouring rows read for other kernels aren't computed.
+        s1_center_y = first_row + s1_y - 1
+        s2_valid = Signal()
+        s2_x = Signal(range(width))
+        s2_y = Signal(range(height))
+        s2_right_edge = Signal()
+        s2_bottom_edge = Signal()
+        m.d.sync += [
+            s2_valid.eq(s1_valid & (s1_x != 0) & (s1_y != 0) &
+                        (s1_center_y >= self.rows.start) & (s1_center_y < self.rows.stop)),
+            s2_x.eq(s1_x - 1),
+            s2_y.eq(s1_center_y),
+            s2_right_edge.eq(s1_x == width),
+            s2_bottom_edge.eq(s1_y == read_rows),
+        ]
+
+        center = window[1][1]
+        # (neighbour, off the grid, opposite direction)
+        neighbours = {
+            'n': (window[1][0], s2_y == 0, 's'),
+            's': (window[1][2], s2_bottom_edge, 'n'),
+            'e': (window[2][1], s2_right_edge, 'w'),
+            'w': (window[0][1], s2_x == 0, 'e'),
+        }
+
+        s3_valid = Signal()
+        s3_address = Signal.like(self.w_address)
+        coefficients = self.coefficients
+        product_c = Signal(16 + self.coef_bits, name='product_c')
+        m.d.sync += product_c.eq(center * coefficients['c'])
+        products = [product_c]
+        for (k, (v, off_grid, opposite)) in neighbours.items():
+            product = Signal(16 + self.coef_bits, name='product_' + k)
+            m.d.sync += product.eq(Mux(off_grid, center * coefficients[opposite], v * coefficients[k]))
+            products.append(product)
+        m.d.sync += [
+            s3_valid.eq(s2_valid),
+            s3_address.eq(s2_y * width + s2_x),
+        ]
+
+        # Stage 3: sum and round. Away from the walls the weights sum to
+        # one, so only cells on the edge can overflow.
+        total = sum(products) + (1 << (self.coef_bits - 1))
+        m.d.sync += [
+            self.w_enable.eq(s3_valid),
+            self.w_address.eq(s3_address),
+            self.w_data.eq(Mux(total[self.coef_bits + 16:].any(), 0xffff,
+                               total[self.coef_bits:self.coef_bits + 16])),
+        ]
+
+        m.d.comb += self.busy.eq(scanning | s1_valid | s2_valid | s3_valid | self.w_enable)
+
+        return m
+
+
 class FluidSim(Elaboratable):
     """
     Performs fluid simulation in a buffer.
 
+    The simulation grid is 64x64 cells, and is drawn into the top left corner
+    of the painters' framebuffers. Every frame runs one step of
+    :class:`AdvectDiffuseKernel` from one half of :class:`SimDoubleBuffer` into
+    the other. Cells are drawn into the framebuffers as the kernel writes
+    them, so the simulation memories are free as soon as the step is done.
+    The framebuffers are then asked to swap; with double-buffered
+    framebuffers this avoids tearing.
+
+    Only the density of each cell is drawn, so an
+    :attr:`PixelFormat.INDEXED8` framebuffer with :meth:`palette` shows the
+    same image in a third of the memory.
+
+    With two ``lanes`` the grid is kept in :class:`BankedSimMemory`, and a
+    kernel for each half of the grid runs at the same time, which halves the
+    time a step takes. The kernels scan rows 31 apart, so ``bank_hash`` must
+    keep odd row distances apart.
+
+    Parameters
+    ----------
+    diffusion : float
+        See :class:`AdvectDiffuseKernel`
+    velocity : (float, float)
+        See :class:`AdvectDiffuseKernel`
+    lanes : int
+        Number of kernels, 1 or 2
+    bank_hash : BankHash
+        See :class:`BankedSimMemory`, only used with two lanes
+    seed : int
+        Seed of the randomizer filling the grid, see
+        :class:`LeapAheadRandomizer`. The same seed always starts from the
+        same grid.
+
     Attributes
     ----------
     start : Signal(1), input
         Signal which indicates the start of a new frame when pulled high
-        externally.
+        externally. Usually :attr:`ledpanel.FrameEvents.sof`, or the
+        painters' ``fb_swapped`` when the framebuffers are written from
+        another clock domain.
     """
-    def __init__(self, painter0: Painter, painter1: Painter):
+    def __init__(self, painter0: Painter, painter1: Painter, diffusion=1 / 16, velocity=(1 / 8, 1 / 16),
+                 lanes=1, bank_hash=BankHash.ROW, seed=LeapAheadRandomizer.DEFAULT_SEED):
+        for painter in (painter0, painter1):
+            assert painter.framebuffer.width >= 64
+            assert painter.framebuffer.height >= 32
+
         self.painter0 = painter0
         self.painter1 = painter1
         self.start = Signal()
-        self.buffers = SimDoubleBuffer()
+        self.seed = seed
+
+        if lanes == 1:
+            self.buffers = SimDoubleBuffer()
+            self.ports = [self.buffers]
+            self.kernels = [AdvectDiffuseKernel(64, 64, diffusion, velocity)]
+        elif lanes == 2:
+            assert bank_hash in (BankHash.ROW, BankHash.CHECKERBOARD)
+            self.buffers = BankedSimMemory(64, 64, bank_hash)
+            self.ports = self.buffers.ports
+            self.kernels = [AdvectDiffuseKernel(64, 64, diffusion, velocity, rows=rows)
+                            for rows in (range(0, 32), range(32, 64))]
+        else:
+            raise ValueError("Unsupported number of lanes {}".format(lanes))
 
     def elaborate(self, platform):
         m = Module()
 
         m.submodules.buffers = self.buffers
+        for (i, (kernel, port)) in enumerate(zip(self.kernels, self.ports)):
+            m.submodules['kernel{}'.format(i)] = kernel
+            m.d.comb += kernel.r_data.eq(port.r_data)
+        init_port = self.ports[0]
 
-        m.submodules.randomizer = randomizer = XORShiftRandomizer()
+        # Fresh bits for every cell
+        m.submodules.randomizer = randomizer = LeapAheadRandomizer(bits=2, init=self.seed)
         m.d.comb += randomizer.req.eq(1)
 
         # Local signals
@@ -242,63 +1282,78 @@ class FluidSim(Elaboratable):
                 m.d.sync += current_frame.eq(0)
                 m.next = "SIM_INIT"
             with m.State("SIM_INIT"):
-                m.d.comb += self.buffers.w_address.eq(sim_counter)
-
-                randomizer_bit_counter = Signal(range(3))
+                m.d.comb += init_port.w_address.eq(sim_counter)
 
-                with m.Switch(randomizer_bit_counter):
-                    for i in range(3):
-                        with m.Case(i):
-                            with m.If(randomizer.o[i*2:(i+1)*2] == 0):
-                                m.d.comb += self.buffers.w_data.eq(0xffff)
-                            with m.Else():
-                                m.d.comb += self.buffers.w_data.eq(0x0000)
+                # A quarter of the cells start full
+                with m.If(randomizer.o == 0):
+                    m.d.comb += init_port.w_data.eq(0xffff)
+                with m.Else():
+                    m.d.comb += init_port.w_data.eq(0x0000)
 
-                            if i == 2:
-                                m.d.sync += randomizer_bit_counter.eq(0)
-                            else:
-                                m.d.sync += randomizer_bit_counter.eq(i + 1)
-
-                m.d.comb += self.buffers.w_enable.eq(1)
+                m.d.comb += init_port.w_enable.eq(1)
                 m.d.sync += sim_counter.eq(sim_counter + 1)
                 with m.If(sim_counter == (64 * 64)):
+                    # Start simulating from the buffer we just filled
+                    m.d.sync += current_frame.eq(1)
                     m.next = "SIM_RUN_START"
             with m.State("SIM_RUN_START"):
                 m.d.sync += sim_counter.eq(0)
-                m.d.comb += self.buffers.w_enable.eq(0)
+                m.d.comb += [kernel.start.eq(1) for kernel in self.kernels]
                 m.next = "SIM_RUN_0"
             with m.State("SIM_RUN_0"):
-                m.next = "SIM_DONE"
+                for (kernel, port) in zip(self.kernels, self.ports):
+                    m.d.comb += [
+                        port.r_address.eq(kernel.r_address),
+                        port.w_address.eq(kernel.w_address),
+                        port.w_data.eq(kernel.w_data),
+                        port.w_enable.eq(kernel.w_enable),
+                    ]
+                self.write_through(m, self.kernels)
+                with m.If(~Cat(*[kernel.busy for kernel in self.kernels]).any()):
+                    m.next = "SIM_DONE"
             with m.State("SIM_DONE"):
-                m.d.sync += sim_counter.eq(0)
-                m.d.sync += current_frame.eq(1)
-                m.next = "WRITE_PAINTER0"
-            with m.State("WRITE_PAINTER0"):
-                self.painter_write_phase(m, sim_counter, self.painter0, 64 * 32, "WRITE_PAINTER1")
-                with m.If(sim_counter == 64 * 32):
-                    m.d.sync += self.painter1.fb_w_enable.eq(1)
-            with m.State("WRITE_PAINTER1"):
-                self.painter_write_phase(m, sim_counter, self.painter1, 64 * 64, "WAIT_FOR_NEXT")
+                # Compute the next state from the one we just computed
+                m.d.sync += current_frame.eq(~current_frame)
+                m.next = "SWAP"
+            with m.State("SWAP"):
+                # Show the new state at the next frame boundary
+                m.d.comb += self.painter0.fb_swap.eq(1)
+                m.d.comb += self.painter1.fb_swap.eq(1)
+                m.next = "WAIT_FOR_NEXT"
             with m.State("WAIT_FOR_NEXT"):
+                # The swap happens at the same frame boundary, so the next
+                # step never writes into the buffer being displayed
                 with m.If(self.start):
                     m.next = "SIM_RUN_START"
 
         return m
 
-    def painter_write_phase(self, m: Module, sim_counter: Signal, painter: Painter, end_count: int, next_state: str):
-        m.d.sync += sim_counter.eq(sim_counter + 1)
-        m.d.sync += painter.fb_w_enable.eq(1)
-
-        # the framebuffer address must lag the simulation data address by 1
-        # cycle, because the single port RAM registers its input
-        m.d.comb += self.buffers.r_address.eq(sim_counter)
-        m.d.comb += painter.fb_w_addr.eq(sim_counter[0:11])
-        m.d.comb += painter.fb_w_data.eq(Cat(
-            self.buffers.r_data[0:8],
-            self.buffers.r_data[8:16],
-            Const(0, shape=8),
-        ))
-
-        with m.If(sim_counter == end_count):
-            m.next = next_state
-            m.d.sync += painter.fb_w_enable.eq(0)
+    def write_through(self, m: Module, kernels):
+        """
+        Draws the cells the kernels write into the framebuffers as they are
+        computed, so the new state doesn't need to be copied out of the
+        simulation memories afterwards. Only one kernel may write to each
+        half of the grid at a time.
+        """
+        for (i, painter) in enumerate([self.painter0, self.painter1]):
+            for kernel in kernels:
+                x = kernel.w_address[0:6]
+                y = kernel.w_address[6:12]
+                # Cells are 8.8 fixed-point densities, show the integer part
+                density = kernel.w_data[8:16]
+
+                with m.If(kernel.w_enable & (y[5] == i)):
+                    m.d.comb += [
+                        painter.fb_w_addr.eq(y[0:5] * painter.framebuffer.width + x),
+                        painter.fb_w_data.eq(Cat(density, density, Const(0, shape=8))),
+                        painter.fb_w_enable.eq(1),
+                    ]
+
+    @staticmethod
+    def palette():
+        """
+        Color lookup table for :attr:`PixelFormat.INDEXED8` framebuffers,
+        which only store the density. Matches the colors drawn into direct
+        color framebuffers.
+        """
+        return [i * 0x000101 for i in range(256)]
@@ -1,4 +1,46 @@
 from amaranth import *
+from ledpanel import Modulation
+
+def delay(m: Module, value, cycles: int):
+    """
+    Returns ``value`` delayed by ``cycles`` registers in the sync domain of
+    ``m``.
+    """
+    for i in range(cycles):
+        value_ff = Signal.like(value) if isinstance(value, Signal) else Signal(len(value))
+        m.d.sync += value_ff.eq(value)
+        value = value_ff
+    return value
+
+class Pipeline:
+    """
+    Keeps track of the latency of a painter's datapath as it is built.
+
+    Each stage is added with the number of cycles it takes, and request
+    signals such as ``o_subframe`` are delayed with :meth:`align` to line up
+    with the output of the stages so far. :meth:`check` then compares the
+    total against the latency the painter declared to the driver, so a stage
+    added to a painter without updating its ``latency`` fails at elaboration
+    instead of showing pixels in the wrong place.
+    """
+    def __init__(self, m: Module):
+        self.m = m
+        self.latency = 0
+
+    def stage(self, latency: int):
+        """ Adds a stage which takes ``latency`` cycles """
+        assert latency >= 0
+        self.latency += latency
+
+    def align(self, value):
+        """ Returns ``value``, from the request cycle, delayed to the current stage """
+        return delay(self.m, value, self.latency)
+
+    def check(self, latency: int):
+        """ Raises :class:`ValueError` unless the stages add up to ``latency`` """
+        if self.latency != latency:
+            raise ValueError("Painter declares a latency of {}, but its stages take {} cycles"
+                             .format(latency, self.latency))
 
 class PWM(Elaboratable):
     """
@@ -13,19 +55,32 @@ class PWM(Elaboratable):
     v: Signal(n), input
         Signal carrying the input value.
     subframe: Signal(n), input
-        Signal carrying the current subframe.
+        Signal carrying the current subframe. In BCM mode this is the index
+        of the bitplane being scanned out.
     o_bit: Signal(1), output
-        Bit representing the 
+        Bit representing the value of the channel for the current subframe,
+        using the modulation scheme passed to the constructor.
+    o_plane_bit: Signal(1), output
+        Bit ``subframe`` of ``v``. This is what a
+        :class:`ledpanel.Modulation.BCM` scanner needs.
     """
-    def __init__(self, v: Signal, subframe: Signal):
+    def __init__(self, v: Signal, subframe: Signal, modulation=Modulation.PWM):
         self.v = v
         self.subframe = subframe
+        self.modulation = modulation
         assert v.shape().width == subframe.shape().width
         self.o_bit = Signal()
+        self.o_plane_bit = Signal()
 
     def elaborate(self, platform):
         m = Module()
 
+        m.d.comb += self.o_plane_bit.eq(self.v.bit_select(self.subframe, 1))
+
+        if self.modulation == Modulation.BCM:
+            m.d.comb += self.o_bit.eq(self.o_plane_bit)
+            return m
+
         # Reverse the subframe so the minimum flicker frequency is higher
         rev = Signal(self.v.shape())
         m.d.comb += [rev[rev.width - i - 1].eq(self.subframe[i]) for i in range(rev.width)]
@@ -35,6 +90,68 @@ class PWM(Elaboratable):
 
         return m
 
+def gamma_curve(gamma=2.2):
+    """ Returns a power law transfer curve for :class:`GammaLUT` """
+    return lambda v: v ** gamma
+
+class GammaLUT(Elaboratable):
+    """
+    Per-channel transfer curve lookup, built as a ROM at elaboration time.
+
+    Parameters
+    ----------
+    curve : callable
+        Maps a channel value in ``[0, 1]`` to an output value in ``[0, 1]``,
+        for example :func:`gamma_curve`.
+    in_bits : int
+        Bits per channel on the input
+    out_bits : int
+        Bits per channel on the output. Using more bits than the scanner
+        displays keeps precision for dithering.
+    channels : int
+        Number of channels
+
+    Attributes
+    ----------
+    i : Signal(channels * in_bits), input
+        Input channel values, channel 0 in the low bits
+    o : Signal(channels * out_bits), output
+        Mapped channel values, ``LATENCY`` cycles after ``i``
+    """
+    LATENCY = 1
+
+    def __init__(self, curve, in_bits=8, out_bits=8, channels=3):
+        self.curve = curve
+        self.in_bits = in_bits
+        self.out_bits = out_bits
+        self.channels = channels
+
+        self.i = Signal(channels * in_bits)
+        self.o = Signal(channels * out_bits)
+
+    @staticmethod
+    def table(curve, in_bits, out_bits):
+        in_max = (1 << in_bits) - 1
+        out_max = (1 << out_bits) - 1
+        return [min(max(round(curve(v / in_max) * out_max), 0), out_max)
+                for v in range(in_max + 1)]
+
+    def elaborate(self, platform):
+        m = Module()
+
+        table = self.table(self.curve, self.in_bits, self.out_bits)
+
+        for c in range(self.channels):
+            rom = Memory(width=self.out_bits, depth=len(table), init=table,
+                         name='gamma_{}'.format(c))
+            m.submodules['gamma_{}'.format(c)] = read_port = rom.read_port()
+            m.d.comb += [
+                read_port.addr.eq(self.i.word_select(c, self.in_bits)),
+                self.o.word_select(c, self.out_bits).eq(read_port.data),
+            ]
+
+        return m
+
 class LFSR(Elaboratable):
     def __init__(self, taps, width=32):
         self.taps = taps
@@ -53,6 +170,81 @@ class LFSR(Elaboratable):
 
         return m
 
+class TemporalDither(Elaboratable):
+    """
+    Frame rate control: rounds channel values to fewer bits, rounding up on a
+    fraction of frames equal to the fraction that was dropped.
+
+    The rounding threshold is a 4x4 Bayer matrix entry for the pixel plus the
+    bit-reversed frame number, so the result is deterministic for a given
+    ``(x, y, frame)``. Every threshold is used once in each 4x4 block of
+    pixels, and once per pixel every ``2 ** (in_bits - out_bits)`` frames,
+    in an order which spreads the rounded up frames out.
+
+    Parameters
+    ----------
+    in_bits : int
+        Bits per channel on the input
+    out_bits : int
+        Bits per channel on the output
+    channels : int
+        Number of channels
+
+    Attributes
+    ----------
+    i : Signal(channels * in_bits), input
+        Input channel values, channel 0 in the low bits
+    x : Signal(2), input
+        Low bits of the column of the pixel on ``i``
+    y : Signal(2), input
+        Low bits of the row of the pixel on ``i``
+    frame : Signal(), input
+        Frame number, see :attr:`ledpanel.PanelDriver.o_frame`
+    o : Signal(channels * out_bits), output
+        Rounded channel values. This is combinational.
+    """
+    BAYER = [
+        [ 0,  8,  2, 10],
+        [12,  4, 14,  6],
+        [ 3, 11,  1,  9],
+        [15,  7, 13,  5],
+    ]
+
+    def __init__(self, in_bits, out_bits, channels=3):
+        assert in_bits > out_bits
+
+        self.in_bits = in_bits
+        self.out_bits = out_bits
+        self.channels = channels
+
+        self.i = Signal(channels * in_bits)
+        self.x = Signal(2)
+        self.y = Signal(2)
+        self.frame = Signal(in_bits - out_bits)
+        self.o = Signal(channels * out_bits)
+
+    def elaborate(self, platform):
+        m = Module()
+
+        drop = self.in_bits - self.out_bits
+
+        def scale(v):
+            return v >> (4 - drop) if drop <= 4 else v << (drop - 4)
+
+        bayer = Array(Array(scale(v) for v in row) for row in self.BAYER)
+        offset = Cat(*reversed([self.frame[i] for i in range(drop)]))
+        threshold = Signal(drop)
+        m.d.comb += threshold.eq(bayer[self.y][self.x] + offset)
+
+        top = (1 << self.out_bits) - 1
+        for c in range(self.channels):
+            v = self.i.word_select(c, self.in_bits)
+            (low, high) = (v[:drop], v[drop:])
+            m.d.comb += self.o.word_select(c, self.out_bits).eq(
+                Mux((low > threshold) & (high != top), high + 1, high))
+
+        return m
+
 class XORShiftRandomizer(Elaboratable):
     """
     An xor-shift based randomizer.
@@ -111,4 +303,92 @@ class XORShiftRandomizer(Elaboratable):
         m.d.comb += self.o.eq(ostate)
 
 
+        return m
+
+def xorshift64(state, a=13, b=7, c=17):
+    """ One step of the generator :class:`XORShiftRandomizer` implements """
+    mask = (1 << 64) - 1
+    state = ((state << a) ^ state) & mask
+    state = ((state >> b) ^ state) & mask
+    state = ((state << c) ^ state) & mask
+    return state
+
+class LeapAheadRandomizer(Elaboratable):
+    """
+    Produces ``bits`` fresh random bits every cycle from the same xor-shift
+    generator as :class:`XORShiftRandomizer`.
+
+    Each step of the generator is linear over GF(2), so any number of steps
+    is a 64x64 bit matrix, which is computed by :meth:`leap_ahead` at
+    elaboration time. The randomizer keeps the last ``ceil(bits / 64)``
+    states, and computes the next ones straight from the newest with one
+    xor per bit.
+
+    Parameters
+    ----------
+    bits : int
+        Number of random bits produced every cycle
+    init : int
+        Non-zero 64-bit seed. Defaults to :attr:`DEFAULT_SEED`, so every
+        elaboration of a design is the same; pass e.g.
+        ``random.randrange(1, 1 << 64)`` for a different sequence every time.
+    a, b, c : int
+        Shifts of the generator, see :class:`XORShiftRandomizer`
+
+    Attributes
+    ----------
+    o : Signal(bits), output
+        Random bits. These are the generator's states after successive
+        steps, the first one in the low bits, cut to ``bits``.
+    req : Signal(1), input
+        Advances the randomizer when high
+    """
+    DEFAULT_SEED = 0x9e3779b97f4a7c15
+
+    def __init__(self, bits=64, init=DEFAULT_SEED, a=13, b=7, c=17):
+        assert 0 < init < (1 << 64)
+
+        self.bits = bits
+        self.init = init
+        self.a = a
+        self.b = b
+        self.c = c
+        self.words = (bits + 63) // 64
+
+        self.o = Signal(bits)
+        self.req = Signal()
+
+    @staticmethod
+    def leap_ahead(steps, a=13, b=7, c=17):
+        """
+        Matrix advancing the generator ``steps`` times, as a list of 64 row
+        masks: bit ``n`` of the new state is the parity of the old state
+        masked by row ``n``.
+        """
+        columns = []
+        for i in range(64):
+            state = 1 << i
+            for _ in range(steps):
+                state = xorshift64(state, a, b, c)
+            columns.append(state)
+        return [sum(((column >> n) & 1) << i for (i, column) in enumerate(columns)) for n in range(64)]
+
+    def elaborate(self, platform):
+        m = Module()
+
+        resets = []
+        state = self.init
+        for _ in range(self.words):
+            state = xorshift64(state, self.a, self.b, self.c)
+            resets.append(state)
+        states = [Signal(64, name='state{}'.format(i), reset=reset) for (i, reset) in enumerate(resets)]
+
+        last = states[-1]
+        with m.If(self.req):
+            for (i, state) in enumerate(states):
+                rows = self.leap_ahead(i + 1, self.a, self.b, self.c)
+                m.d.sync += state.eq(Cat(*[(last & row).xor() for row in rows]))
+
+        m.d.comb += self.o.eq(Cat(*states)[:self.bits])
+
         return m
@@ -155,9 +155,14 @@ class SinglePortMemory(Elaboratable):
         Data from the memory. Only valid when ``rw`` is low.
     rw : Signal(1), in
         When 0b1, perform a write. Otherwise read data is valid.
+
+    Without a platform, such as in simulation, this is a behavioral model
+    built from a :class:`Memory` of ``depth`` words, which keeps simulations
+    fast when only part of the memory is used.
     """
 
-    def __init__(self):
+    def __init__(self, depth=1 << 14):
+        self.depth = depth
         self.address = Signal(14)
         self.w_data = Signal(16)
         self.r_data = Signal(16)
@@ -166,6 +171,19 @@ class SinglePortMemory(Elaboratable):
     def elaborate(self, platform):
         m = Module()
 
+        if platform is None:
+            mem = Memory(width=16, depth=self.depth, name='spram')
+            m.submodules.r_port = r_port = mem.read_port(transparent=False)
+            m.submodules.w_port = w_port = mem.write_port()
+            m.d.comb += [
+                r_port.addr.eq(self.address),
+                self.r_data.eq(r_port.data),
+                w_port.addr.eq(self.address),
+                w_port.data.eq(self.w_data),
+                w_port.en.eq(self.rw),
+            ]
+            return m
+
         m.submodules += Instance("SB_SPRAM256KA",
             i_ADDRESS=self.address,
             i_DATAIN=self.w_data,
@@ -0,0 +1,252 @@
+from amaranth import *
+from enum import IntEnum
+from painters.fluid_sim import PixelFormat, expand_channel
+
+class StreamOp(IntEnum):
+    """
+    Operation in the top two bits of a :class:`StreamDecoder` command byte.
+    The low 6 bits hold a count, which is one less than the number of pixels
+    the command covers.
+    """
+
+    #: Leave the next pixels as they are
+    SKIP = 0
+    #: The next pixels follow, one after the other
+    LITERAL = 1
+    #: One pixel follows, and is written to all of the next pixels
+    REPEAT = 2
+    #: The count is a :class:`StreamControl` code instead
+    CONTROL = 3
+
+class StreamControl(IntEnum):
+    """ Codes for :attr:`StreamOp.CONTROL` commands """
+
+    #: Go back to the first pixel
+    START_OF_FRAME = 0
+    #: The frame is complete, show it at the next frame boundary
+    END_OF_FRAME = 1
+    #: Nothing useful follows, start again from the beginning if possible
+    END_OF_STREAM = 2
+
+#: Largest number of pixels a single command covers
+STREAM_MAX_COUNT = 64
+
+def stream_pixel_bytes(pixel_format):
+    """ Number of bytes per pixel on the wire """
+    return {
+        PixelFormat.RGB888: 3,
+        PixelFormat.RGB565: 2,
+    }[pixel_format]
+
+class UARTRx(Elaboratable):
+    """
+    8N1 UART receiver.
+
+    Parameters
+    ----------
+    divisor : int
+        Clock cycles per bit. 10 for 3 Mbaud from the 30MHz panel clock.
+
+    Attributes
+    ----------
+    rx : Signal(1), input
+        Serial input. This may be asynchronous to the clock.
+    o_data : Signal(8), output
+        Byte received, valid while ``o_valid`` is high
+    o_valid : Signal(1), output
+        High for one cycle when ``o_data`` holds a new byte
+    o_error : Signal(1), output
+        High for one cycle when a byte had a bad stop bit. The byte is
+        dropped.
+    """
+    def __init__(self, divisor):
+        assert divisor >= 4
+
+        self.divisor = divisor
+
+        self.rx = Signal(reset=1)
+        self.o_data = Signal(8)
+        self.o_valid = Signal()
+        self.o_error = Signal()
+
+    def elaborate(self, platform):
+        m = Module()
+
+        rx_meta = Signal(reset=1)
+        rx = Signal(reset=1)
+        m.d.sync += [
+            rx_meta.eq(self.rx),
+            rx.eq(rx_meta),
+        ]
+
+        counter = Signal(range(self.divisor))
+        bit = Signal(range(8))
+        shift = Signal(8)
+        m.d.comb += self.o_data.eq(shift)
+
+        with m.If(counter != 0):
+            m.d.sync += counter.eq(counter - 1)
+
+        with m.FSM():
+            with m.State("IDLE"):
+                with m.If(~rx):
+                    # Sample the rest of the bits in the middle
+                    m.d.sync += counter.eq(self.divisor // 2 - 1)
+                    m.next = "START"
+            with m.State("START"):
+                with m.If(counter == 0):
+                    with m.If(rx):
+                        # Glitch
+                        m.next = "IDLE"
+                    with m.Else():
+                        m.d.sync += counter.eq(self.divisor - 1)
+                        m.d.sync += bit.eq(0)
+                        m.next = "DATA"
+            with m.State("DATA"):
+                with m.If(counter == 0):
+                    m.d.sync += shift.eq(Cat(shift[1:], rx))
+                    m.d.sync += counter.eq(self.divisor - 1)
+                    m.d.sync += bit.eq(bit + 1)
+                    with m.If(bit == 7):
+                        m.next = "STOP"
+            with m.State("STOP"):
+                with m.If(counter == 0):
+                    with m.If(rx):
+                        m.d.comb += self.o_valid.eq(1)
+                    with m.Else():
+                        m.d.comb += self.o_error.eq(1)
+                    m.next = "IDLE"
+
+        return m
+
+class StreamDecoder(Elaboratable):
+    """
+    Decodes a run-length and delta encoded byte stream into the painters'
+    framebuffers.
+
+    The stream is a sequence of commands. Each starts with a command byte,
+    which holds a :class:`StreamOp` and a count, followed by pixel data for
+    :attr:`StreamOp.LITERAL` and :attr:`StreamOp.REPEAT`. Pixels are numbered
+    row-major across the whole panel, so the first ``width * height`` pixels
+    go to ``painter0``'s framebuffer and the rest to ``painter1``'s.
+    ``tools/stream_codec.py`` produces streams on the host.
+
+    Parameters
+    ----------
+    pixel_format : PixelFormat
+        Pixel encoding on the wire. :attr:`PixelFormat.RGB888` is sent as R, G,
+        B bytes and :attr:`PixelFormat.RGB565` as a little-endian 16-bit word.
+
+    Attributes
+    ----------
+    i_data : Signal(8), input
+        Next byte of the stream
+    i_valid : Signal(1), input
+        High when ``i_data`` holds a byte
+    o_ready : Signal(1), output
+        High when the byte on ``i_data`` is consumed. Pixels are written one
+        per cycle, so this is low while a command is being written out. It
+        also stays low after each frame until the framebuffers have swapped,
+        so the next frame isn't written into the buffer about to be shown;
+        senders without flow control have to leave a panel frame between
+        frames.
+    o_frame_done : Signal(1), output
+        High for one cycle when an :attr:`StreamControl.END_OF_FRAME` command
+        is decoded. A framebuffer swap is requested at the same time.
+    o_end_of_stream : Signal(1), output
+        High for one cycle when an :attr:`StreamControl.END_OF_STREAM` command
+        is decoded
+    """
+    def __init__(self, painter0, painter1, pixel_format=PixelFormat.RGB888):
+        assert painter0.framebuffer.width * painter0.framebuffer.height == \
+            painter1.framebuffer.width * painter1.framebuffer.height
+
+        self.painter0 = painter0
+        self.painter1 = painter1
+        self.pixel_format = pixel_format
+        self.pixel_bytes = stream_pixel_bytes(pixel_format)
+
+        self.i_data = Signal(8)
+        self.i_valid = Signal()
+        self.o_ready = Signal()
+        self.o_frame_done = Signal()
+        self.o_end_of_stream = Signal()
+
+    def elaborate(self, platform):
+        m = Module()
+
+        size = self.painter0.framebuffer.width * self.painter0.framebuffer.height
+
+        addr = Signal(range(2 * size + STREAM_MAX_COUNT + 1))
+        op = Signal(2)
+        remaining = Signal(range(STREAM_MAX_COUNT))
+        byte = Signal(range(self.pixel_bytes))
+        pixel = Signal(8 * self.pixel_bytes)
+
+        if self.pixel_format == PixelFormat.RGB565:
+            color = Cat(expand_channel(pixel[0:5], 5),
+                        expand_channel(pixel[5:11], 6),
+                        expand_channel(pixel[11:16], 5))
+        else:
+            color = pixel
+
+        write = Signal()
+        for (i, painter) in enumerate([self.painter0, self.painter1]):
+            m.d.comb += [
+                painter.fb_w_addr.eq(addr - i * size),
+                painter.fb_w_data.eq(color),
+                painter.fb_w_enable.eq(write & (addr >= i * size) & (addr < (i + 1) * size)),
+            ]
+
+        with m.FSM():
+            with m.State("COMMAND"):
+                m.d.comb += self.o_ready.eq(1)
+                with m.If(self.i_valid):
+                    count = self.i_data[0:6]
+                    m.d.sync += [
+                        op.eq(self.i_data[6:8]),
+                        remaining.eq(count),
+                        byte.eq(0),
+                    ]
+
+                    with m.Switch(self.i_data[6:8]):
+                        with m.Case(StreamOp.SKIP):
+                            m.d.sync += addr.eq(addr + count + 1)
+                        with m.Case(StreamOp.LITERAL, StreamOp.REPEAT):
+                            m.next = "PIXEL"
+                        with m.Case(StreamOp.CONTROL):
+                            with m.Switch(count):
+                                with m.Case(StreamControl.START_OF_FRAME):
+                                    m.d.sync += addr.eq(0)
+                                with m.Case(StreamControl.END_OF_FRAME):
+                                    m.d.comb += [
+                                        self.o_frame_done.eq(1),
+                                        self.painter0.fb_swap.eq(1),
+                                        self.painter1.fb_swap.eq(1),
+                                    ]
+                                    m.next = "SWAP"
+                                with m.Case(StreamControl.END_OF_STREAM):
+                                    m.d.comb += self.o_end_of_stream.eq(1)
+            with m.State("SWAP"):
+                # Deltas are against the buffer being written, which is only
+                # free once the frame boundary has come
+                with m.If(~self.painter0.fb_swap_pending & ~self.painter1.fb_swap_pending):
+                    m.next = "COMMAND"
+            with m.State("PIXEL"):
+                m.d.comb += self.o_ready.eq(1)
+                with m.If(self.i_valid):
+                    m.d.sync += pixel.word_select(byte, 8).eq(self.i_data)
+                    m.d.sync += byte.eq(byte + 1)
+                    with m.If(byte == self.pixel_bytes - 1):
+                        m.next = "WRITE"
+            with m.State("WRITE"):
+                m.d.comb += write.eq(1)
+                m.d.sync += addr.eq(addr + 1)
+                m.d.sync += remaining.eq(remaining - 1)
+                m.d.sync += byte.eq(0)
+                with m.If(remaining == 0):
+                    m.next = "COMMAND"
+                with m.Elif(op == StreamOp.LITERAL):
+                    m.next = "PIXEL"
+
+        return m
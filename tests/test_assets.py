@@ -0,0 +1,95 @@
+import unittest
+import random
+import os
+import tempfile
+
+from .utils import *
+from painters.fluid_sim import Framebuffer, PixelFormat
+from stream import StreamControl
+from tools import assets
+from tools.stream_codec import encode_frame, control
+from amaranth import *
+from amaranth.sim import *
+
+class AssetTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.cache_dir = os.path.join(self.dir.name, 'cache')
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def write_raw(self, frames):
+        path = os.path.join(self.dir.name, 'frames.raw')
+        with open(path, 'wb') as f:
+            for frame in frames:
+                for pixel in frame:
+                    f.write(pixel.to_bytes(3, 'little'))
+        return path
+
+    def random_frame(self, n_pixels, colors=4):
+        palette = [random.randint(0, 0xffffff) for _ in range(colors)]
+        return [random.choice(palette) for _ in range(n_pixels)]
+
+    def test_repeated_frames(self):
+        (a, b) = (self.random_frame(64), self.random_frame(64))
+        path = self.write_raw([a, b, b, a, b])
+        data = assets.compile_asset(path, 'flash', 8, 8, cache_dir=None)
+
+        # The repeated frame is just shown again
+        repeat = control(StreamControl.START_OF_FRAME) + control(StreamControl.END_OF_FRAME)
+        self.assertEqual(data, encode_frame(a) + encode_frame(b, a) + repeat + encode_frame(a, b) +
+                         encode_frame(b, a) + control(StreamControl.END_OF_STREAM))
+
+    def test_stream_format(self):
+        path = self.write_raw([self.random_frame(64)])
+        for pixel_format in (PixelFormat.RGB444, PixelFormat.INDEXED8):
+            with self.assertRaises(ValueError):
+                assets.compile_asset(path, 'flash', 8, 8, pixel_format, cache_dir=None)
+
+    def test_cache(self):
+        path = self.write_raw([self.random_frame(64)])
+        first = assets.compile_asset(path, 'stream', 8, 8, cache_dir=self.cache_dir)
+
+        def fail(*args):
+            raise AssertionError("asset was encoded again")
+
+        load_frames = assets.load_frames
+        assets.load_frames = fail
+        try:
+            self.assertEqual(assets.compile_asset(path, 'stream', 8, 8, cache_dir=self.cache_dir), first)
+            # Different options aren't served from the cache
+            with self.assertRaises(AssertionError):
+                assets.compile_asset(path, 'stream', 8, 8, PixelFormat.RGB565, cache_dir=self.cache_dir)
+        finally:
+            assets.load_frames = load_frames
+
+    def check_init(self, pixel_format):
+        (width, height) = (8, 4)
+        frame = self.random_frame(width * 2 * height)
+        path = self.write_raw([frame])
+        (init0, init1, palette) = assets.load_init(path, width, height, pixel_format, cache_dir=self.cache_dir)
+
+        fb = Framebuffer(width, height, pixel_format=pixel_format, palette=palette, init=init1)
+
+        def process():
+            for addr in range(width * height):
+                yield fb.r_addr.eq(addr)
+                for _ in range(fb.read_latency + 1):
+                    yield
+                expected = frame[width * height + addr]
+                if pixel_format == PixelFormat.RGB565:
+                    mask = 0xf8fcf8
+                    self.assertEqual((yield fb.r_data) & mask, expected & mask)
+                else:
+                    self.assertEqual((yield fb.r_data), expected)
+
+        sim = Simulator(fb)
+        sim.add_clock(1e-6)
+        sim.add_sync_process(process)
+        sim.run()
+
+    def test_init(self):
+        for pixel_format in [PixelFormat.RGB888, PixelFormat.RGB565, PixelFormat.INDEXED8]:
+            with self.subTest(pixel_format=pixel_format):
+                self.check_init(pixel_format)
@@ -0,0 +1,67 @@
+import unittest
+import random
+
+from .utils import *
+from painters.fluid_sim import BitplaneFramebuffer, BitplanePainter
+from ledpanel import Modulation
+from amaranth import *
+from amaranth.sim import *
+
+class FakeDriver:
+    """ Just the parts of PanelDriver that painters look at """
+    def __init__(self, width, scan_rows, bpp):
+        self.modulation = Modulation.BCM
+        self.bpp = bpp
+        self.addr_width = Shape.cast(range(scan_rows)).width
+        self.o_x = Signal(range(width))
+        self.o_y0 = Signal(self.addr_width + 1)
+        self.o_y1 = Signal(self.addr_width + 1)
+        self.o_subframe = Signal(bpp)
+        self.o_frame_start = Signal()
+        self.i_rgb0 = Signal(3)
+        self.i_rgb1 = Signal(3)
+
+def expected_bits(pixel, plane, bpp):
+    return sum(((pixel >> (8 * c + 8 - bpp + plane)) & 1) << c for c in range(3))
+
+class BitplaneFramebufferTest(unittest.TestCase):
+    def test_painter_scanout(self):
+        (width, height, bpp) = (16, 3, 7)
+        pixels = [random.randint(0, (1 << 24) - 1) for _ in range(width * height)]
+
+        driver = FakeDriver(width, height, bpp)
+        fb = BitplaneFramebuffer(width, height, bpp)
+        painter = BitplanePainter(driver, side=1, framebuffer=fb)
+
+        m = Module()
+        m.submodules.fb = fb
+        m.submodules.painter = painter
+
+        def process():
+            for (addr, pixel) in enumerate(pixels):
+                yield painter.fb_w_addr.eq(addr)
+                yield painter.fb_w_data.eq(pixel)
+                yield painter.fb_w_enable.eq(1)
+                yield
+            yield painter.fb_w_enable.eq(0)
+
+            for y in range(height):
+                for plane in reversed(range(bpp)):
+                    yield driver.o_y1.eq((1 << driver.addr_width) | y)
+                    yield driver.o_subframe.eq(plane)
+
+                    for x in range(width + 1):
+                        if x < width:
+                            yield driver.o_x.eq(x)
+                        yield
+
+                        if x > 0:
+                            # One cycle of latency
+                            self.assertEqual((yield driver.i_rgb1),
+                                expected_bits(pixels[y * width + x - 1], plane, bpp),
+                                "pixel ({}, {}) plane {}".format(x - 1, y, plane))
+
+        sim = Simulator(m)
+        sim.add_clock(1e-6)
+        sim.add_sync_process(process)
+        sim.run()
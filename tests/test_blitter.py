@@ -0,0 +1,159 @@
+import unittest
+import random
+
+from .utils import *
+from .test_stream import FakePainter
+from blitter import Blitter
+from painters.fluid_sim import Framebuffer
+from amaranth import *
+from amaranth.sim import *
+
+class Canvas:
+    """ What the blitter should draw """
+    def __init__(self, width, height, pixels):
+        self.width = width
+        self.pixels = list(pixels)
+
+    def fill(self, x, y, w, h, color):
+        for j in range(y, y + h):
+            for i in range(x, x + w):
+                self.pixels[j * self.width + i] = color
+
+    def copy(self, src_x, src_y, x, y, w, h):
+        source = list(self.pixels)
+        for j in range(h):
+            for i in range(w):
+                self.pixels[(y + j) * self.width + x + i] = source[(src_y + j) * self.width + src_x + i]
+
+    def line(self, x0, y0, x1, y1, color):
+        (dx, dy) = (abs(x1 - x0), -abs(y1 - y0))
+        (sx, sy) = (1 if x1 > x0 else -1, 1 if y1 > y0 else -1)
+        err = dx + dy
+        while True:
+            self.pixels[y0 * self.width + x0] = color
+            if (x0, y0) == (x1, y1):
+                break
+            e2 = 2 * err
+            if e2 >= dy:
+                err += dy
+                x0 += sx
+            if e2 <= dx:
+                err += dx
+                y0 += sy
+
+class BlitterTest(unittest.TestCase):
+    (WIDTH, HEIGHT) = (16, 8)
+
+    def run_commands(self, commands):
+        """
+        Draws ``commands``, a list of ``(method, args)`` pairs, and checks the
+        framebuffers afterwards. Returns the number of cycles taken.
+        """
+        framebuffers = [Framebuffer(self.WIDTH, self.HEIGHT, aux_read=True) for _ in range(2)]
+        painters = [FakePainter(fb) for fb in framebuffers]
+        blitter = Blitter(painters, depth=4)
+
+        m = Module()
+        m.submodules.blitter = blitter
+        for (i, (fb, painter)) in enumerate(zip(framebuffers, painters)):
+            m.submodules['fb{}'.format(i)] = fb
+            m.submodules['painter{}'.format(i)] = painter
+
+        canvas = Canvas(blitter.width, blitter.height, [0xffffff] * (blitter.width * blitter.height))
+        for (method, args) in commands:
+            getattr(canvas, method)(*args)
+
+        cycles = []
+
+        def producer():
+            for (method, args) in commands:
+                yield blitter.i_command.eq(getattr(blitter, method)(*args))
+                yield blitter.i_valid.eq(1)
+                yield Settle()
+                while not (yield blitter.o_ready):
+                    yield
+                    yield Settle()
+                yield
+            yield blitter.i_valid.eq(0)
+
+        def checker():
+            count = 0
+            while not (yield blitter.o_busy):
+                yield
+                count += 1
+            while (yield blitter.o_busy):
+                yield
+                count += 1
+            cycles.append(count)
+
+            for (i, fb) in enumerate(framebuffers):
+                for addr in range(self.WIDTH * self.HEIGHT):
+                    yield fb.r_addr.eq(addr)
+                    for _ in range(fb.read_latency + 1):
+                        yield
+                    offset = i * self.WIDTH * self.HEIGHT
+                    self.assertEqual((yield fb.r_data), canvas.pixels[offset + addr],
+                        "pixel ({}, {})".format(addr % self.WIDTH, addr // self.WIDTH + i * self.HEIGHT))
+
+        sim = Simulator(m)
+        sim.add_clock(1e-6)
+        sim.add_sync_process(producer)
+        sim.add_sync_process(checker)
+        sim.run()
+
+        return cycles[0]
+
+    def test_fill(self):
+        self.run_commands([
+            ('fill', (0, 0, 16, 16, 0x000000)),
+            ('fill', (3, 5, 7, 6, 0x123456)),
+            ('fill', (15, 15, 1, 1, 0xabcdef)),
+        ])
+
+    def test_copy(self):
+        self.run_commands([
+            ('fill', (0, 0, 8, 8, 0x0000ff)),
+            ('line', (0, 0, 7, 7, 0x00ff00)),
+            # Between framebuffers
+            ('copy', (0, 0, 8, 8, 8, 8)),
+            # Overlapping, both ways
+            ('copy', (0, 0, 2, 1, 8, 8)),
+            ('copy', (9, 9, 8, 8, 7, 6)),
+            ('copy', (4, 3, 5, 3, 3, 4)),
+        ])
+
+    def test_line(self):
+        self.run_commands([
+            ('line', (0, 0, 15, 15, 0x010203)),
+            ('line', (15, 0, 0, 3, 0x040506)),
+            ('line', (2, 14, 3, 1, 0x070809)),
+            ('line', (5, 5, 5, 5, 0x0a0b0c)),
+        ])
+
+    def test_random(self):
+        commands = []
+        for _ in range(20):
+            (w, h) = (random.randint(1, 16), random.randint(1, 16))
+            (x, y) = (random.randint(0, 16 - w), random.randint(0, 16 - h))
+            choice = random.randrange(3)
+            if choice == 0:
+                commands.append(('fill', (x, y, w, h, random.randint(0, 0xffffff))))
+            elif choice == 1:
+                (src_x, src_y) = (random.randint(0, 16 - w), random.randint(0, 16 - h))
+                commands.append(('copy', (src_x, src_y, x, y, w, h)))
+            else:
+                commands.append(('line', (x, y, random.randint(0, 15), random.randint(0, 15),
+                                           random.randint(0, 0xffffff))))
+        self.run_commands(commands)
+
+    def test_throughput(self):
+        # One pixel per cycle, with the FIFO kept full
+        commands = [
+            ('fill', (0, 0, 16, 16, 0x112233)),
+            ('copy', (0, 0, 8, 4, 8, 12)),
+            ('line', (0, 15, 15, 0, 0x445566)),
+        ]
+        pixels = 16 * 16 + 8 * 12 + 16
+        cycles = self.run_commands(commands)
+        # Plus filling the FIFO, popping the first command and the last write
+        self.assertLessEqual(cycles, pixels + 4)
@@ -0,0 +1,156 @@
+import unittest
+import random
+import os
+import tempfile
+
+from .utils import *
+from ledpanel import PanelDriver
+from painters.fluid_sim import Framebuffer, Painter, FluidSim
+from .test_stream import FakePainter
+from tools.sim_checkpoint import Checkpoint, capture, restore
+from amaranth import *
+from amaranth.sim import *
+
+class CheckpointTest(unittest.TestCase):
+    def setUp(self):
+        (width, scan_rows) = (16, 2)
+        self.pixels = [[random.randint(0, 0xffffff) for _ in range(width * scan_rows)] for _ in range(2)]
+
+    def design(self):
+        """ Returns a small panel, and the fragment to simulate """
+        driver = PanelDriver(columns=16, scan_rows=2)
+        framebuffers = [Framebuffer(16, 2, init=side) for side in self.pixels]
+        painters = [Painter(driver, side, fb) for (side, fb) in enumerate(framebuffers)]
+        for (side, painter) in enumerate(painters):
+            driver.add_painter(painter, side)
+
+        m = Module()
+        m.submodules += [driver] + framebuffers + painters
+        return (driver, painters, Fragment.get(m, None))
+
+    def run_design(self, warmup, length, checkpoint=None):
+        """
+        Runs ``warmup`` cycles, with a framebuffer write in the middle, then
+        returns a checkpoint and the panel outputs of the next ``length``
+        cycles. Starts from ``checkpoint`` instead of warming up if it's
+        given.
+        """
+        (driver, painters, fragment) = self.design()
+        if checkpoint is not None:
+            restore(fragment, checkpoint)
+
+        result = {'outputs': []}
+
+        def process():
+            if checkpoint is None:
+                for cycle in range(warmup):
+                    if cycle == warmup // 2:
+                        yield painters[1].fb_w_addr.eq(3)
+                        yield painters[1].fb_w_data.eq(0xffffff)
+                        yield painters[1].fb_w_enable.eq(1)
+                    yield
+                    yield painters[1].fb_w_enable.eq(0)
+                result['checkpoint'] = yield from capture(fragment, warmup)
+
+            for _ in range(length):
+                values = []
+                for port in driver.panel_output_ports():
+                    values.append((yield port))
+                result['outputs'].append(values)
+                yield
+
+        sim = Simulator(fragment)
+        sim.add_clock(1e-6)
+        sim.add_sync_process(process)
+        sim.run()
+
+        return result
+
+    def test_restore(self):
+        warm = self.run_design(1000, 300)
+        checkpoint = warm['checkpoint']
+        self.assertEqual(checkpoint.cycles, 1000)
+
+        restored = self.run_design(1000, 300, checkpoint)
+        self.assertEqual(restored['outputs'], warm['outputs'])
+
+        # Memories are part of the state, including the write before the
+        # checkpoint
+        words = [value for (name, value) in checkpoint.state.items() if name.endswith('.pixels(3)')]
+        self.assertEqual(sorted(words), sorted([self.pixels[0][3], 0xffffff]))
+
+    def test_save(self):
+        checkpoint = self.run_design(200, 0)['checkpoint']
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'warm.json')
+            checkpoint.save(path)
+            loaded = Checkpoint.load(path)
+        self.assertEqual(loaded.state, checkpoint.state)
+        self.assertEqual(loaded.cycles, 200)
+
+    def test_mismatch(self):
+        checkpoint = self.run_design(10, 0)['checkpoint']
+        fragment = Fragment.get(PanelDriver(columns=32, scan_rows=2, painter_latency=1), None)
+        with self.assertRaises(ValueError):
+            restore(fragment, checkpoint)
+
+class FluidSimCheckpointTest(unittest.TestCase):
+    def run_sim(self, checkpoint=None):
+        """
+        Runs FluidSim until SIM_INIT is done, then returns a checkpoint, the
+        framebuffer writes of the next two steps and the final state. Starts
+        from ``checkpoint`` instead if it's given.
+        """
+        framebuffers = [Framebuffer(64, 32) for _ in range(2)]
+        painters = [FakePainter(fb) for fb in framebuffers]
+        fluid = FluidSim(*painters, lanes=2)
+
+        m = Module()
+        m.submodules.fluid = fluid
+        m.submodules += framebuffers + painters
+        fragment = Fragment.get(m, None)
+        if checkpoint is not None:
+            restore(fragment, checkpoint)
+
+        result = {'writes': []}
+
+        def process():
+            # Start every step as soon as the last one is shown
+            yield fluid.start.eq(1)
+            if checkpoint is None:
+                cycles = 0
+                while not (yield painters[0].fb_w_enable):
+                    yield
+                    cycles += 1
+                result['checkpoint'] = yield from capture(fragment, cycles)
+
+            swaps = 0
+            while swaps < 2:
+                for (side, painter) in enumerate(painters):
+                    if (yield painter.fb_w_enable):
+                        result['writes'].append((side, (yield painter.fb_w_addr), (yield painter.fb_w_data)))
+                swaps += yield painters[0].fb_swap
+                yield
+            result['state'] = (yield from capture(fragment)).state
+
+        sim = Simulator(fragment)
+        sim.add_clock(1e-6)
+        sim.add_sync_process(process)
+        sim.run()
+
+        return result
+
+    def test_restore(self):
+        warm = self.run_sim()
+        checkpoint = warm['checkpoint']
+        self.assertGreater(checkpoint.cycles, 64 * 64)
+
+        # The grid filled in by SIM_INIT is in the SPRAM models
+        words = {name: value for (name, value) in checkpoint.state.items() if '.spram(' in name}
+        self.assertEqual(len(words), 2 * 64 * 64)
+        self.assertIn(0xffff, words.values())
+
+        restored = self.run_sim(checkpoint)
+        self.assertEqual(len(restored['writes']), 2 * 64 * 64)
+        self.assertEqual(restored['writes'], warm['writes'])
+        self.assertEqual(restored['state'], warm['state'])
@@ -0,0 +1,18 @@
+import unittest
+import hashlib
+
+from main import HighSpeedLogic
+from amaranth.back import rtlil
+
+def rtlil_hash(design, ports):
+    return hashlib.sha256(rtlil.convert(design, ports=ports).encode()).hexdigest()
+
+class CodegenTest(unittest.TestCase):
+    def test_deterministic(self):
+        # write_cxxrtl caches the generated code by a hash of the RTLIL, which
+        # only hits if elaborating the design again gives the same RTLIL
+        hashes = []
+        for _ in range(2):
+            logic = HighSpeedLogic()
+            hashes.append(rtlil_hash(logic, logic.ports()))
+        self.assertEqual(hashes[0], hashes[1])
@@ -0,0 +1,98 @@
+import unittest
+import random
+
+from .utils import *
+from painters.compositor import Compositor
+from ledpanel import Modulation
+from amaranth import *
+from amaranth.sim import *
+
+class FakeDriver:
+    """ Just the parts of PanelDriver that painters look at """
+    def __init__(self, painter_latency, width, scan_rows, bpp, modulation):
+        self.painter_latency = painter_latency
+        self.modulation = modulation
+        self.bpp = bpp
+        self.width = width
+        self.scan_rows = scan_rows
+        self.addr_width = Shape.cast(range(scan_rows)).width
+        self.o_x = Signal(range(width))
+        self.o_y0 = Signal(self.addr_width + 1)
+        self.o_y1 = Signal(self.addr_width + 1)
+        self.o_frame = Signal(12)
+        self.o_subframe = Signal(bpp)
+        self.o_frame_start = Signal()
+        self.i_rgb0 = Signal(3)
+        self.i_rgb1 = Signal(3)
+
+class CompositorTest(unittest.TestCase):
+    def test_scanout(self):
+        (width, scan_rows, tiles) = (16, 8, 4)
+        size = Compositor.TILE_SIZE
+        driver = FakeDriver(Compositor.LATENCY, width, scan_rows, 8, Modulation.BCM)
+
+        tile_map = [random.randrange(tiles) for _ in range((width // size) * (2 * scan_rows // size))]
+        tile_patterns = [random.choice([0, 0, 1, 2, 3]) for _ in range(tiles * size * size)]
+        palette = [random.randint(0, 0xffffff) for _ in range(16)]
+        sprite_patterns = [[random.choice([0, 4, 5, 6]) for _ in range(size * size)] for _ in range(3)]
+        # (x, y, enable, behind), with the last one wrapping around the edges
+        sprites = [(3, 5, 1, 0), (6, 9, 1, 1), (29, 28, 1, 0)]
+
+        compositor = Compositor(driver, tiles=tiles, sprites=4, tile_map=tile_map,
+                                tile_patterns=tile_patterns, palette=palette)
+
+        def expected(x, y, plane):
+            tile = tile_map[(y // size) * (width // size) + x // size]
+            background = tile_patterns[tile * size * size + (y % size) * size + x % size]
+            color = background
+            for ((sx, sy, enable, behind), pattern) in reversed(list(zip(sprites, sprite_patterns))):
+                (dx, dy) = ((x - sx) % (2 * width), (y - sy) % (4 * scan_rows))
+                if enable and dx < size and dy < size and pattern[dy * size + dx] != 0:
+                    if not behind or background == 0:
+                        color = pattern[dy * size + dx]
+                    else:
+                        color = background
+            return sum(((palette[color] >> (8 * c + plane)) & 1) << c for c in range(3))
+
+        def process():
+            for (i, pattern) in enumerate(sprite_patterns):
+                for (addr, index) in enumerate(pattern):
+                    yield compositor.sprite_w_addr.eq(i * size * size + addr)
+                    yield compositor.sprite_w_data.eq(index)
+                    yield compositor.sprite_w_enable.eq(1)
+                    yield
+            yield compositor.sprite_w_enable.eq(0)
+
+            for (sprite, (x, y, enable, behind)) in zip(compositor.sprites, sprites):
+                yield sprite.x.eq(x)
+                yield sprite.y.eq(y)
+                yield sprite.enable.eq(enable)
+                yield sprite.behind.eq(behind)
+            yield driver.o_frame_start.eq(1)
+            yield
+            yield driver.o_frame_start.eq(0)
+            # Not shown until the next frame
+            yield compositor.sprites[3].enable.eq(1)
+
+            latency = Compositor.LATENCY
+            requests = [(x, y, plane) for y in range(scan_rows) for plane in [0, 7] for x in range(width)]
+            for (i, request) in enumerate(requests + [None] * latency):
+                if request is not None:
+                    (x, y, plane) = request
+                    yield driver.o_x.eq(x)
+                    yield driver.o_y0.eq(y)
+                    yield driver.o_y1.eq(scan_rows + y)
+                    yield driver.o_subframe.eq(plane)
+                yield
+
+                if i >= latency:
+                    (x, y, plane) = requests[i - latency]
+                    self.assertEqual((yield driver.i_rgb0), expected(x, y, plane),
+                                     "pixel ({}, {}) plane {}".format(x, y, plane))
+                    self.assertEqual((yield driver.i_rgb1), expected(x, scan_rows + y, plane),
+                                     "pixel ({}, {}) plane {}".format(x, scan_rows + y, plane))
+
+        sim = Simulator(compositor)
+        sim.add_clock(1e-6)
+        sim.add_sync_process(process)
+        sim.run()
@@ -0,0 +1,41 @@
+import unittest
+import random
+
+from .utils import *
+from painters.util import TemporalDither
+from amaranth import *
+from amaranth.sim import *
+
+class TemporalDitherTest(unittest.TestCase):
+    def test_average(self):
+        (in_bits, out_bits, frames) = (12, 8, 32)
+        values = [0, 1, 0x7ff, 0x808, 0xffe, 0xfff] + [random.randint(0, 0xfff) for _ in range(4)]
+        dut = TemporalDither(in_bits, out_bits, channels=1)
+
+        def process():
+            totals = {v: 0 for v in values}
+            for frame in range(frames):
+                # Every threshold appears exactly once in a 4x4 block
+                for v in values:
+                    block = []
+                    for (x, y) in [(x, y) for y in range(4) for x in range(4)]:
+                        yield dut.i.eq(v)
+                        yield dut.x.eq(x)
+                        yield dut.y.eq(y)
+                        yield Settle()
+                        block.append((yield dut.o))
+
+                    self.assertTrue(all(o in (v >> 4, (v >> 4) + 1) for o in block))
+                    if (v >> 4) != 0xff:
+                        self.assertEqual(sum(block), 16 * (v >> 4) + (v & 0xf))
+                    totals[v] += block[0]
+
+                yield dut.frame.eq(frame + 1)
+
+            # A single pixel averages out over time too
+            for v in values:
+                self.assertAlmostEqual(totals[v] / frames, min(v / 16, 0xff), delta=1 / frames)
+
+        sim = Simulator(dut)
+        sim.add_process(process)
+        sim.run()
@@ -0,0 +1,79 @@
+import unittest
+import random
+
+from .utils import *
+from ledpanel import PanelDriver, Modulation
+from painters.fluid_sim import Framebuffer, Painter
+from tools.panel_emulator import PanelEmulator, np
+from amaranth import *
+from amaranth.sim import *
+
+@unittest.skipUnless(np, "needs NumPy")
+class PanelEmulatorTest(unittest.TestCase):
+    def run_panel(self, pixels, **kwargs):
+        """ Returns the second frame shown on a 16x4 panel """
+        (width, scan_rows) = (16, 2)
+        driver = PanelDriver(columns=width, scan_rows=scan_rows, **kwargs)
+        framebuffers = [Framebuffer(width, scan_rows, init=side) for side in pixels]
+        painters = [Painter(driver, side, fb) for (side, fb) in enumerate(framebuffers)]
+        for (side, painter) in enumerate(painters):
+            driver.add_painter(painter, side)
+
+        m = Module()
+        m.submodules += [driver] + framebuffers + painters
+
+        emulator = PanelEmulator(width, scan_rows)
+
+        def process():
+            while len(emulator.frames) < 2:
+                yield
+
+        sim = Simulator(m)
+        sim.add_clock(1e-6)
+        sim.add_sync_process(emulator.process(driver))
+        sim.add_sync_process(process)
+        sim.run()
+
+        return emulator.frames[1]
+
+    def check_frame(self, bpp, scale, **kwargs):
+        (width, scan_rows) = (16, 2)
+        pixels = [[random.randint(0, 0xffffff) for _ in range(width * scan_rows)] for _ in range(2)]
+        frame = self.run_panel(pixels, bpp=bpp, **kwargs)
+
+        for y in range(2 * scan_rows):
+            for x in range(width):
+                # Painter's heartbeat tracer is at column 1 in frame 1
+                if (x, y) == (1, 0):
+                    continue
+                pixel = pixels[y // scan_rows][(y % scan_rows) * width + x]
+                for c in range(3):
+                    value = (pixel >> (8 * c + 8 - bpp)) & ((1 << bpp) - 1)
+                    self.assertEqual(frame[y, x, c], value * scale,
+                                     "pixel ({}, {}) channel {}".format(x, y, c))
+
+    def test_pwm(self):
+        # Every subframe a pixel is on for lights it for a whole row, in both
+        # halves of each cycle
+        self.check_frame(8, 2 * 16)
+
+    def test_bcm(self):
+        self.check_frame(3, 2 * 2, modulation=Modulation.BCM, bcm_unit=2)
+
+    def test_overlapped_bcm(self):
+        self.check_frame(3, 2, modulation=Modulation.BCM, overlap=True)
+
+    def test_shift(self):
+        emulator = PanelEmulator(width=4, scan_rows=1)
+        for x in range(4):
+            emulator.step(1 << (x % 3), 0b111, 0, 0b11, 0b00, 0b10)
+            emulator.step(0, 0, 0, 0b11, 0b00, 0b00)
+        # Latch on the falling edge, then light the row for three half cycles
+        emulator.step(0, 0, 0, 0b11, 0b01, 0b00)
+        emulator.step(0, 0, 0, 0b10, 0b00, 0b00)
+        emulator.step(0, 0, 0, 0b00, 0b00, 0b00)
+        emulator.flush()
+
+        self.assertEqual(emulator.brightness[0].tolist(),
+                         [[3, 0, 0], [0, 3, 0], [0, 0, 3], [3, 0, 0]])
+        self.assertEqual(emulator.brightness[1].tolist(), [[3, 3, 3]] * 4)
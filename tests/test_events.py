@@ -0,0 +1,77 @@
+import unittest
+
+from .utils import *
+from ledpanel import PanelDriver, Modulation
+from amaranth import *
+from amaranth.sim import *
+
+class FrameEventsTest(unittest.TestCase):
+    def test_bcm_events(self):
+        (bpp, scan_rows) = (3, 2)
+        dut = PanelDriver(1, bpp, Modulation.BCM, bcm_unit=4, columns=16, scan_rows=scan_rows)
+        events = dut.events
+
+        def process():
+            frames = []
+            cycle = 0
+            while len(frames) < 4:
+                if (yield events.sof):
+                    frames.append({'start': cycle, 'budget': (yield events.budget), 'sosf': 0, 'window': 0})
+                if frames:
+                    frames[-1]['sosf'] += yield events.sosf
+                    frames[-1]['window'] += yield events.write_window
+
+                cycle += 1
+                yield
+
+            lengths = [b['start'] - a['start'] for (a, b) in zip(frames, frames[1:])]
+            self.assertEqual(len(set(lengths)), 1)
+
+            # Nothing is known about the first frame
+            self.assertEqual(frames[0]['budget'], 0)
+            self.assertEqual([f['budget'] for f in frames[1:]], [lengths[0]] * 3)
+
+            for frame in frames[:-1]:
+                self.assertEqual(frame['sosf'], scan_rows * bpp)
+                # Every cycle not spent shifting a pixel is free
+                self.assertEqual(frame['window'], lengths[0] - scan_rows * bpp * dut.width)
+
+        sim = Simulator(dut)
+        sim.add_clock(1e-6)
+        sim.add_sync_process(process)
+        sim.run()
+
+    def check_window(self, **kwargs):
+        dut = PanelDriver(columns=16, scan_rows=2, painter_latency=1, **kwargs)
+
+        def process():
+            while not (yield dut.o_rdy):
+                yield
+
+            # The painters read the column in o_x in the cycles outside the
+            # window, which are every column of each row in order
+            columns = []
+            for _ in range(1000):
+                if not (yield dut.events.write_window):
+                    columns.append((yield dut.o_x))
+                yield
+
+            rows = len(columns) // dut.width
+            self.assertGreater(rows, 4)
+            for row in range(rows):
+                self.assertEqual(columns[row * dut.width:(row + 1) * dut.width], list(range(dut.width)),
+                                 "row {}".format(row))
+
+        sim = Simulator(dut)
+        sim.add_clock(1e-6)
+        sim.add_sync_process(process)
+        sim.run()
+
+    def test_window_pwm(self):
+        self.check_window()
+
+    def test_window_bcm(self):
+        self.check_window(bpp=3, modulation=Modulation.BCM, bcm_unit=4)
+
+    def test_window_overlapped(self):
+        self.check_window(bpp=3, modulation=Modulation.BCM, overlap=True, blank_cycles=2)
@@ -0,0 +1,198 @@
+import unittest
+import random
+
+from .utils import *
+from .test_stream import FakePainter
+from painters.fluid_sim import Framebuffer
+from flash import SPIFlashReader, FlashPlayer
+from tools.stream_codec import encode_animation
+from amaranth import *
+from amaranth.sim import *
+
+def flash_model(flash, contents, data_width):
+    """
+    Behavioral model of a SPI NOR flash answering :class:`SPIFlashReader`.
+    Only read commands are understood.
+    """
+    def process():
+        yield Passive()
+        prev_clk = 0
+        prev_cs = 0
+        while True:
+            cs = yield flash.o_cs
+            clk = yield flash.o_clk
+
+            if cs and not prev_cs:
+                (clocks, header, address, bits) = (0, 0, 0, [])
+
+            if cs and clk and not prev_clk:
+                # Rising edge, IO0 carries the command and address
+                if clocks < 32:
+                    assert (yield flash.o_dq_oe) & 1
+                    header = (header << 1) | ((yield flash.o_dq) & 1)
+                if clocks == 31:
+                    assert header >> 24 == SPIFlashReader.COMMANDS[data_width], hex(header)
+                    address = header & 0xffffff
+                clocks += 1
+
+            if cs and not clk and prev_clk and clocks >= 32 + SPIFlashReader.DUMMY_CLOCKS:
+                # Falling edge, shift the next bits out
+                if not bits:
+                    byte = contents[address % len(contents)]
+                    address += 1
+                    bits = [(byte >> (8 - data_width - i)) & ((1 << data_width) - 1)
+                            for i in range(0, 8, data_width)]
+                assert not (yield flash.o_dq_oe) & ((1 << data_width) - 1 if data_width > 1 else 2)
+                value = bits.pop(0)
+                yield flash.i_dq.eq(value << 1 if data_width == 1 else value)
+
+            prev_cs = cs
+            prev_clk = clk
+            yield
+    return process
+
+class SPIFlashReaderTest(unittest.TestCase):
+    def test_read(self):
+        contents = bytes(random.randint(0, 255) for _ in range(256))
+
+        for data_width in [1, 2, 4]:
+            dut = SPIFlashReader(data_width)
+            received = []
+
+            def consumer():
+                yield dut.i_address.eq(0x40)
+                yield dut.i_start.eq(1)
+                yield
+                yield dut.i_start.eq(0)
+
+                while len(received) < 24:
+                    # Stall sometimes
+                    ready = random.randint(0, 3) != 0
+                    yield dut.i_ready.eq(ready)
+                    yield
+                    if ready and (yield dut.o_valid):
+                        received.append((yield dut.o_data))
+                yield dut.i_stop.eq(1)
+                yield
+                yield dut.i_stop.eq(0)
+                yield
+                self.assertEqual((yield dut.o_cs), 0)
+
+            sim = Simulator(dut)
+            sim.add_clock(1e-6)
+            sim.add_sync_process(consumer)
+            sim.add_sync_process(flash_model(dut, contents, data_width))
+            sim.run()
+
+            self.assertEqual(bytes(received), contents[0x40:0x40 + 24], "data width {}".format(data_width))
+
+class FlashPlayerTest(unittest.TestCase):
+    def test_playback_loops(self):
+        (width, height, frame_period, sof_interval) = (4, 2, 2, 300)
+        n_pixels = 2 * width * height
+        frames = [[random.randint(0, 0xffffff) for _ in range(n_pixels)] for _ in range(3)]
+        frames[1][2:8] = frames[0][2:8]
+        frames[2] = list(frames[1])
+        frames[2][5] = 0x123456
+
+        address = 0x10
+        contents = bytes(random.randint(0, 255) for _ in range(address)) + encode_animation(frames)
+
+        m = Module()
+        m.submodules.fb0 = fb0 = Framebuffer(width, height)
+        m.submodules.fb1 = fb1 = Framebuffer(width, height)
+        m.submodules.painter0 = painter0 = FakePainter(fb0)
+        m.submodules.painter1 = painter1 = FakePainter(fb1)
+        m.submodules.dut = dut = FlashPlayer(painter0, painter1, address, data_width=4,
+                                             frame_period=frame_period)
+
+        def sof():
+            yield Passive()
+            while True:
+                for _ in range(sof_interval - 1):
+                    yield
+                # The framebuffers swap at the same frame boundary
+                for signal in (dut.i_sof, fb0.vsync, fb1.vsync):
+                    yield signal.eq(1)
+                yield
+                for signal in (dut.i_sof, fb0.vsync, fb1.vsync):
+                    yield signal.eq(0)
+
+        def process():
+            cycle = 0
+            done = []
+            while len(done) < 2 * len(frames):
+                yield
+                cycle += 1
+                if not (yield dut.decoder.o_frame_done):
+                    continue
+                done.append(cycle)
+
+                # Decoding is paused until frame_period frames have passed
+                shown = frames[(len(done) - 1) % len(frames)]
+                for (addr, expected) in enumerate(shown):
+                    fb = fb0 if addr < width * height else fb1
+                    yield fb.r_addr.eq(addr % (width * height))
+                    yield
+                    yield
+                    cycle += 2
+                    self.assertEqual((yield fb.r_data), expected,
+                                     "frame {} pixel {}".format(len(done) - 1, addr))
+
+            for (a, b) in zip(done, done[1:]):
+                self.assertGreater(b - a, (frame_period - 1) * sof_interval)
+
+        sim = Simulator(m)
+        sim.add_clock(1e-6)
+        sim.add_sync_process(process)
+        sim.add_sync_process(sof)
+        sim.add_sync_process(flash_model(dut.flash, contents, 4))
+        sim.run()
+
+    def test_missed_vsync(self):
+        # The swap after the first frame misses a frame boundary, like a swap
+        # request crossing from another clock domain just too late
+        (width, height, frame_period, sof_interval) = (4, 2, 2, 300)
+        n_pixels = 2 * width * height
+        frames = [[random.randint(0, 0xffffff) for _ in range(n_pixels)] for _ in range(3)]
+        contents = encode_animation(frames)
+
+        m = Module()
+        m.submodules.fb0 = fb0 = Framebuffer(width, height)
+        m.submodules.fb1 = fb1 = Framebuffer(width, height)
+        m.submodules.painter0 = painter0 = FakePainter(fb0)
+        m.submodules.painter1 = painter1 = FakePainter(fb1)
+        m.submodules.dut = dut = FlashPlayer(painter0, painter1, 0, data_width=4,
+                                             frame_period=frame_period)
+
+        def process():
+            (sofs, frames_done, swaps) = (0, 0, [])
+            missed = False
+            while len(swaps) < 4:
+                for _ in range(sof_interval - 1):
+                    yield
+                    frames_done += yield dut.decoder.o_frame_done
+
+                sofs += 1
+                vsync = missed or frames_done == 0
+                missed = missed or frames_done > 0
+                yield dut.i_sof.eq(1)
+                yield fb0.vsync.eq(vsync)
+                yield fb1.vsync.eq(vsync)
+                yield Settle()
+                if (yield fb0.swapped):
+                    swaps.append(sofs)
+                yield
+                for signal in (dut.i_sof, fb0.vsync, fb1.vsync):
+                    yield signal.eq(0)
+
+            # Every frame is shown for frame_period frames, counted from its
+            # swap
+            for (a, b) in zip(swaps, swaps[1:]):
+                self.assertGreaterEqual(b - a, frame_period)
+
+        sim = Simulator(m)
+        sim.add_clock(1e-6)
+        sim.add_sync_process(process)
+        sim.add_sync_process(flash_model(dut.flash, contents, 4))
+        sim.run()
@@ -0,0 +1,282 @@
+import unittest
+import random
+
+from .utils import *
+from .test_stream import FakePainter
+from painters.fluid_sim import AdvectDiffuseKernel, BankHash, BankedSimMemory, FluidSim, Framebuffer, PixelFormat
+from amaranth import *
+from amaranth.sim import *
+
+def advect_diffuse_reference(grid, width, height, coefficients, coef_bits):
+    # Neighbours as (dx, dy, direction of the opposite neighbour)
+    neighbours = {'n': (0, -1, 's'), 's': (0, 1, 'n'), 'e': (1, 0, 'w'), 'w': (-1, 0, 'e')}
+
+    out = []
+    for y in range(height):
+        for x in range(width):
+            total = coefficients['c'] * grid[y * width + x]
+            for (k, (dx, dy, opposite)) in neighbours.items():
+                (nx, ny) = (x + dx, y + dy)
+                if 0 <= nx < width and 0 <= ny < height:
+                    total += coefficients[k] * grid[ny * width + nx]
+                else:
+                    # Nothing flows through the wall, the cell keeps it
+                    total += coefficients[opposite] * grid[y * width + x]
+            out.append(min((total + (1 << (coef_bits - 1))) >> coef_bits, 0xffff))
+    return out
+
+class AdvectDiffuseKernelTest(unittest.TestCase):
+    def run_step(self, width, height, grid, **kwargs):
+        m = Module()
+        m.submodules.dut = dut = AdvectDiffuseKernel(width, height, **kwargs)
+
+        current = Memory(width=16, depth=width * height, init=grid)
+        following = Memory(width=16, depth=width * height)
+
+        # Same timing as SimDoubleBuffer
+        m.submodules.r_port = r_port = current.read_port(transparent=False)
+        m.submodules.w_port = w_port = following.write_port()
+        m.d.comb += [
+            r_port.addr.eq(dut.r_address),
+            dut.r_data.eq(r_port.data),
+            w_port.addr.eq(dut.w_address),
+            w_port.data.eq(dut.w_data),
+            w_port.en.eq(dut.w_enable),
+        ]
+
+        result = {}
+
+        def process():
+            yield dut.start.eq(1)
+            yield
+            yield dut.start.eq(0)
+            yield
+
+            cycles = 1
+            writes = 0
+            while (yield dut.busy):
+                writes += yield dut.w_enable
+                cycles += 1
+                yield
+
+            result['cycles'] = cycles
+            result['writes'] = writes
+            result['grid'] = []
+            for i in range(width * height):
+                result['grid'].append((yield following[i]))
+
+        sim = Simulator(m)
+        sim.add_clock(1e-6)
+        sim.add_sync_process(process)
+        sim.run()
+
+        return (dut, result)
+
+    def test_matches_reference(self):
+        (width, height) = (7, 5)
+        grid = [random.randint(0, 0xffff) for _ in range(width * height)]
+
+        for velocity in [(0, 0), (0.25, -0.25), (-1 / 8, 1 / 16)]:
+            (dut, result) = self.run_step(width, height, grid, diffusion=0.1, velocity=velocity)
+
+            expected = advect_diffuse_reference(grid, width, height, dut.coefficients, dut.coef_bits)
+            self.assertEqual(result['grid'], expected, "velocity {}".format(velocity))
+            self.assertEqual(result['writes'], width * height)
+            self.assertLessEqual(result['cycles'], (width + 1) * (height + 1) + 5)
+
+    def test_rows(self):
+        (width, height) = (6, 7)
+        grid = [random.randint(0, 0xffff) for _ in range(width * height)]
+
+        for rows in [range(0, 3), range(3, 4), range(4, 7), range(0, 7)]:
+            (dut, result) = self.run_step(width, height, grid, rows=rows)
+
+            expected = advect_diffuse_reference(grid, width, height, dut.coefficients, dut.coef_bits)
+            cells = slice(rows.start * width, rows.stop * width)
+            self.assertEqual(result['grid'][cells], expected[cells], "rows {}".format(rows))
+            self.assertEqual(result['writes'], width * len(rows))
+
+    def test_conserves_density(self):
+        # Whole densities, so nothing is lost to rounding
+        (width, height) = (7, 5)
+        grid = [random.randint(0, 0xff) << 8 for _ in range(width * height)]
+
+        for velocity in [(0.25, -0.25), (-1 / 8, 1 / 16)]:
+            (dut, result) = self.run_step(width, height, grid, diffusion=0.1, velocity=velocity)
+            self.assertEqual(sum(result['grid']), sum(grid), "velocity {}".format(velocity))
+
+    def test_saturates(self):
+        # Flowing east into the wall piles density up in the east column
+        (width, height) = (4, 3)
+        grid = [0xffff] * (width * height)
+        (dut, result) = self.run_step(width, height, grid, velocity=(0.5, 0))
+        self.assertEqual(result['grid'], advect_diffuse_reference(grid, width, height, dut.coefficients,
+                                                                  dut.coef_bits))
+        # The west column empties by half, the east one would hold one and a
+        # half
+        self.assertEqual(result['grid'], [0x8000, 0xffff, 0xffff, 0xffff] * height)
+
+    def test_unstable(self):
+        with self.assertRaises(ValueError):
+            AdvectDiffuseKernel(diffusion=0.25, velocity=(0.5, 0))
+
+class WriteThroughTest(unittest.TestCase):
+    def test_framebuffers(self):
+        grid = [random.randint(0, 0xffff) for _ in range(64 * 64)]
+
+        framebuffers = [Framebuffer(64, 32, pixel_format=PixelFormat.INDEXED8, palette=FluidSim.palette())
+                        for _ in range(2)]
+        painters = [FakePainter(fb) for fb in framebuffers]
+        sim = FluidSim(*painters)
+        [kernel] = sim.kernels
+
+        m = Module()
+        m.submodules.kernel = kernel
+        m.submodules += framebuffers + painters
+
+        current = Memory(width=16, depth=64 * 64, init=grid)
+        m.submodules.r_port = r_port = current.read_port(transparent=False)
+        m.d.comb += [
+            r_port.addr.eq(kernel.r_address),
+            kernel.r_data.eq(r_port.data),
+        ]
+        sim.write_through(m, [kernel])
+
+        expected = advect_diffuse_reference(grid, 64, 64, kernel.coefficients, kernel.coef_bits)
+
+        def process():
+            yield kernel.start.eq(1)
+            yield
+            yield kernel.start.eq(0)
+            yield
+            while (yield kernel.busy):
+                yield
+
+            for (i, fb) in enumerate(framebuffers):
+                for addr in range(0, 64 * 32, 7):
+                    yield fb.r_addr.eq(addr)
+                    for _ in range(fb.read_latency + 1):
+                        yield
+                    density = expected[i * 64 * 32 + addr] >> 8
+                    self.assertEqual((yield fb.r_data), density * 0x000101, "cell {}".format(addr))
+
+        simulator = Simulator(m)
+        simulator.add_clock(1e-6)
+        simulator.add_sync_process(process)
+        simulator.run()
+
+class BankedSimMemoryTest(unittest.TestCase):
+    def run_step(self, bank_hash):
+        """ Runs two kernels, one for each half of the grid, like FluidSim """
+        # The kernels scan rows 3 apart, which never conflict
+        (width, height) = (8, 8)
+        grid = [random.randint(0, 0xffff) for _ in range(width * height)]
+
+        m = Module()
+        m.submodules.mem = mem = BankedSimMemory(width, height, bank_hash)
+        kernels = [AdvectDiffuseKernel(width, height, rows=rows) for rows in (range(0, 4), range(4, 8))]
+        m.submodules += kernels
+
+        loading = Signal()
+        load_address = Signal(range(width * height))
+        load_data = Signal(16)
+        for (kernel, port) in zip(kernels, mem.ports):
+            m.d.comb += [
+                port.r_address.eq(kernel.r_address),
+                kernel.r_data.eq(port.r_data),
+            ]
+            with m.If(~loading):
+                m.d.comb += [
+                    port.w_address.eq(kernel.w_address),
+                    port.w_data.eq(kernel.w_data),
+                    port.w_enable.eq(kernel.w_enable),
+                ]
+        with m.If(loading):
+            m.d.comb += [
+                mem.ports[0].w_address.eq(load_address),
+                mem.ports[0].w_data.eq(load_data),
+                mem.ports[0].w_enable.eq(1),
+            ]
+
+        written = {}
+
+        def process():
+            yield mem.frame.eq(1)
+            yield loading.eq(1)
+            for (addr, value) in enumerate(grid):
+                yield load_address.eq(addr)
+                yield load_data.eq(value)
+                yield
+            yield loading.eq(0)
+            yield mem.frame.eq(0)
+            yield
+
+            for kernel in kernels:
+                yield kernel.start.eq(1)
+            yield
+            for kernel in kernels:
+                yield kernel.start.eq(0)
+            yield
+
+            while (yield kernels[0].busy) or (yield kernels[1].busy):
+                for kernel in kernels:
+                    if (yield kernel.w_enable):
+                        written[(yield kernel.w_address)] = yield kernel.w_data
+                yield
+
+        sim = Simulator(m)
+        sim.add_clock(1e-6)
+        sim.add_sync_process(process)
+        sim.run()
+
+        coefficients = kernels[0].coefficients
+        expected = advect_diffuse_reference(grid, width, height, coefficients, kernels[0].coef_bits)
+        self.assertEqual([written[addr] for addr in range(width * height)], expected)
+
+    def test_row(self):
+        self.run_step(BankHash.ROW)
+
+    def test_checkerboard(self):
+        self.run_step(BankHash.CHECKERBOARD)
+
+class FluidSimLanesTest(unittest.TestCase):
+    def run_sim(self, **kwargs):
+        """ Runs the first step, and returns its cycle count and what it drew """
+        framebuffers = [Framebuffer(64, 32) for _ in range(2)]
+        painters = [FakePainter(fb) for fb in framebuffers]
+        sim = FluidSim(*painters, **kwargs)
+
+        m = Module()
+        m.submodules.sim = sim
+        m.submodules += framebuffers + painters
+
+        result = {'pixels': []}
+
+        def process():
+            cycles = 0
+            while not (yield painters[0].fb_w_enable):
+                yield
+            while not (yield painters[0].fb_swap):
+                yield
+                cycles += 1
+            result['cycles'] = cycles
+
+            for fb in framebuffers:
+                for addr in range(0, 64 * 32, 5):
+                    yield fb.r_addr.eq(addr)
+                    yield
+                    yield
+                    result['pixels'].append((yield fb.r_data))
+
+        simulator = Simulator(m)
+        simulator.add_clock(1e-6)
+        simulator.add_sync_process(process)
+        simulator.run()
+
+        return result
+
+    def test_lanes(self):
+        one = self.run_sim()
+        two = self.run_sim(lanes=2)
+        self.assertEqual(two['pixels'], one['pixels'])
+        self.assertLess(two['cycles'], one['cycles'] * 0.6)
@@ -0,0 +1,186 @@
+import unittest
+
+from .utils import *
+from painters.fluid_sim import Framebuffer, PixelFormat
+from amaranth import *
+from amaranth.sim import *
+
+class DoubleBufferTest(unittest.TestCase):
+    def test_swap_at_vsync(self):
+        (width, height) = (4, 2)
+        dut = Framebuffer(width, height, double_buffered=True)
+
+        def read(addr):
+            yield dut.r_addr.eq(addr)
+            yield
+            yield
+            return (yield dut.r_data)
+
+        def process():
+            # Fill the back buffer
+            for addr in range(width * height):
+                yield dut.w_addr.eq(addr)
+                yield dut.w_data.eq(addr + 1)
+                yield dut.w_enable.eq(1)
+                yield
+            yield dut.w_enable.eq(0)
+            yield
+
+            # The front buffer still shows the initial contents
+            for addr in range(width * height):
+                self.assertEqual((yield from read(addr)), 0xffffff)
+
+            yield dut.swap.eq(1)
+            yield
+            yield dut.swap.eq(0)
+            yield
+            for _ in range(3):
+                self.assertEqual((yield dut.swap_pending), 1)
+                self.assertEqual((yield dut.swapped), 0)
+                self.assertEqual((yield from read(0)), 0xffffff)
+
+            # The swap takes effect for the read issued with vsync
+            yield dut.r_addr.eq(2)
+            yield dut.vsync.eq(1)
+            yield
+            self.assertEqual((yield dut.swapped), 1)
+            yield dut.vsync.eq(0)
+            yield
+            self.assertEqual((yield dut.r_data), 3)
+            self.assertEqual((yield dut.swap_pending), 0)
+
+            for addr in range(width * height):
+                self.assertEqual((yield from read(addr)), addr + 1)
+
+            # No swap without a request
+            yield dut.vsync.eq(1)
+            yield
+            self.assertEqual((yield dut.swapped), 0)
+            yield dut.vsync.eq(0)
+            self.assertEqual((yield from read(0)), 1)
+
+        sim = Simulator(dut)
+        sim.add_clock(1e-6)
+        sim.add_sync_process(process)
+        sim.run()
+
+    def test_write_domain(self):
+        (width, height) = (4, 2)
+        dut = Framebuffer(width, height, double_buffered=True, write_domain="producer")
+        state = {'done': False}
+
+        def write(offset):
+            for addr in range(width * height):
+                yield dut.w_addr.eq(addr)
+                yield dut.w_data.eq(addr + offset)
+                yield dut.w_enable.eq(1)
+                yield
+            yield dut.w_enable.eq(0)
+
+        def producer():
+            yield from write(1)
+            yield dut.swap.eq(1)
+            yield
+            yield dut.swap.eq(0)
+            self.assertEqual((yield dut.swap_pending), 1)
+
+            cycles = 0
+            while not (yield dut.swapped):
+                yield
+                cycles += 1
+            self.assertLess(cycles, 100)
+            yield
+            self.assertEqual((yield dut.swap_pending), 0)
+
+            # Now in the old front buffer
+            yield from write(100)
+            state['done'] = True
+
+        def panel():
+            frame = 0
+            while not state['done']:
+                frame += 1
+                yield dut.vsync.eq(frame % 16 == 0)
+                yield
+            yield dut.vsync.eq(0)
+
+            for addr in range(width * height):
+                yield dut.r_addr.eq(addr)
+                yield
+                yield
+                self.assertEqual((yield dut.r_data), addr + 1)
+
+        sim = Simulator(dut)
+        sim.add_clock(1e-6)
+        sim.add_clock(0.37e-6, domain="producer")
+        sim.add_sync_process(producer, domain="producer")
+        sim.add_sync_process(panel)
+        sim.run()
+
+def expand(value, bits):
+    value >>= 8 - bits
+    out = 0
+    for shift in range(8 - bits, -bits, -bits):
+        out |= (value << shift) if shift >= 0 else (value >> -shift)
+    return out & 0xff
+
+class PixelFormatTest(unittest.TestCase):
+    def run_formats(self, dut, pixels, expected, clut=[]):
+        def process():
+            for (addr, color) in clut:
+                yield dut.clut_w_addr.eq(addr)
+                yield dut.clut_w_data.eq(color)
+                yield dut.clut_w_enable.eq(1)
+                yield
+            yield dut.clut_w_enable.eq(0)
+
+            for (addr, pixel) in enumerate(pixels):
+                yield dut.w_addr.eq(addr)
+                yield dut.w_data.eq(pixel)
+                yield dut.w_enable.eq(1)
+                yield
+            yield dut.w_enable.eq(0)
+
+            # Stream reads back to back
+            for addr in range(len(pixels) + dut.read_latency):
+                if addr < len(pixels):
+                    yield dut.r_addr.eq(addr)
+                yield
+                if addr >= dut.read_latency:
+                    self.assertEqual((yield dut.r_data), expected[addr - dut.read_latency],
+                                     "{} address {}".format(dut.pixel_format, addr - dut.read_latency))
+
+        sim = Simulator(dut)
+        sim.add_clock(1e-6)
+        sim.add_sync_process(process)
+        sim.run()
+
+    def test_direct_formats(self):
+        pixels = [0x000000, 0xffffff, 0x123456, 0x80ff01, 0xfedcba, 0x0f0f0f]
+
+        for pixel_format in [PixelFormat.RGB888, PixelFormat.RGB565, PixelFormat.RGB444]:
+            dut = Framebuffer(3, 2, pixel_format=pixel_format)
+            self.assertEqual(dut.read_latency, 1)
+
+            bits = pixel_format.channel_bits
+            expected = [sum(expand((p >> (8 * c)) & 0xff, bits[c]) << (8 * c) for c in range(3))
+                        for p in pixels]
+            self.run_formats(dut, pixels, expected)
+
+    def test_indexed(self):
+        dut = Framebuffer(3, 2, double_buffered=True, pixel_format=PixelFormat.INDEXED8)
+        self.assertEqual(dut.read_latency, 2)
+
+        # Only the low byte is stored
+        pixels = [0x000000, 0x0000ff, 0x123456, 0xabcd10, 0x000003, 0x000080]
+        clut = [(0x56, 0x00ff00), (0x03, 0x123456)]
+        palette = [i * 0x010101 for i in range(256)]
+        for (addr, color) in clut:
+            palette[addr] = color
+
+        # Writes go to the back buffer, which is the other half of the memory
+        expected = [0xffffff] * len(pixels)
+        self.run_formats(dut, pixels, expected, clut)
+
+        dut = Framebuffer(3, 2, pixel_format=PixelFormat.INDEXED8)
+        self.run_formats(dut, pixels, [palette[p & 0xff] for p in pixels], clut)
@@ -0,0 +1,86 @@
+import unittest
+
+from .utils import *
+from ledpanel import PanelDriver, Modulation
+from painters.address_test import CycleAddrTest
+from painters.util import Pipeline
+from amaranth import *
+from amaranth.sim import *
+
+class FakePainter:
+    def __init__(self, latency):
+        self.latency = latency
+
+class LatencyTest(unittest.TestCase):
+    def test_pipeline(self):
+        pipeline = Pipeline(Module())
+        pipeline.stage(1)
+        pipeline.stage(0)
+        pipeline.stage(2)
+        self.assertEqual(pipeline.latency, 3)
+        pipeline.check(3)
+        with self.assertRaises(ValueError):
+            pipeline.check(2)
+
+    def test_side_latencies(self):
+        driver = PanelDriver(columns=16, scan_rows=2)
+        with self.assertRaises(ValueError):
+            driver.side_latencies()
+
+        driver.add_painter(FakePainter(1), 0)
+        driver.add_painter(FakePainter(3), 1)
+        self.assertEqual(driver.side_latencies(), (3, [1, 3]))
+
+        # Both sides from one painter
+        driver = PanelDriver(columns=16, scan_rows=2)
+        driver.add_painter(FakePainter(2), 0, 1)
+        self.assertEqual(driver.side_latencies(), (2, [2, 2]))
+
+        # Padded up to an explicit latency, but never cut short
+        driver = PanelDriver(4, columns=16, scan_rows=2)
+        driver.add_painter(FakePainter(2), 0)
+        self.assertEqual(driver.side_latencies(), (4, [2, 4]))
+        driver.add_painter(FakePainter(5), 1)
+        with self.assertRaises(ValueError):
+            driver.side_latencies()
+
+        driver = PanelDriver(columns=16, scan_rows=2)
+        driver.add_painter(FakePainter(1), 0)
+        driver.add_painter(FakePainter(2), 0)
+        with self.assertRaises(ValueError):
+            driver.side_latencies()
+
+    def run_panel(self, cycles0, cycles1, length=600):
+        """ Returns the panel outputs for ``length`` cycles """
+        driver = PanelDriver(bpp=2, modulation=Modulation.BCM, columns=16, scan_rows=2)
+        painter0 = CycleAddrTest(cycles0, driver, side=0)
+        painter1 = CycleAddrTest(cycles1, driver, side=1)
+        driver.add_painter(painter0, 0)
+        driver.add_painter(painter1, 1)
+
+        m = Module()
+        m.submodules += [driver, painter0, painter1]
+
+        outputs = []
+
+        def process():
+            for _ in range(length):
+                values = []
+                for port in driver.panel_output_ports():
+                    values.append((yield port))
+                outputs.append(values)
+                yield
+
+        sim = Simulator(m)
+        sim.add_clock(1e-6)
+        sim.add_sync_process(process)
+        sim.run()
+
+        return outputs
+
+    def test_balanced(self):
+        # A faster painter is delayed to match the slower one
+        balanced = self.run_panel(2, 2)
+        self.assertEqual(self.run_panel(0, 2), balanced)
+        self.assertEqual(self.run_panel(2, 1), balanced)
+        self.assertNotEqual(self.run_panel(1, 1), balanced)
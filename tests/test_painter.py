@@ -0,0 +1,87 @@
+import unittest
+import random
+
+from .utils import *
+from painters.fluid_sim import Framebuffer, Painter, PixelFormat
+from painters.util import GammaLUT, gamma_curve
+from ledpanel import Modulation
+from amaranth import *
+from amaranth.sim import *
+
+class FakeDriver:
+    """ Just the parts of PanelDriver that painters look at """
+    def __init__(self, painter_latency, width, scan_rows, bpp, modulation):
+        self.painter_latency = painter_latency
+        self.modulation = modulation
+        self.bpp = bpp
+        self.addr_width = Shape.cast(range(scan_rows)).width
+        self.o_x = Signal(range(width))
+        self.o_y0 = Signal(self.addr_width + 1)
+        self.o_y1 = Signal(self.addr_width + 1)
+        self.o_frame = Signal(12)
+        self.o_subframe = Signal(bpp)
+        self.o_frame_start = Signal()
+        self.i_rgb0 = Signal(3)
+        self.i_rgb1 = Signal(3)
+
+class GammaPainterTest(unittest.TestCase):
+    def test_table(self):
+        table = GammaLUT.table(gamma_curve(2.2), 8, 12)
+        self.assertEqual(len(table), 256)
+        self.assertEqual(table[0], 0)
+        self.assertEqual(table[255], 4095)
+        self.assertEqual(table, sorted(table))
+        self.assertEqual(GammaLUT.table(lambda v: v, 8, 8), list(range(256)))
+
+    def test_bcm_scanout(self):
+        (width, height, bpp, curve_bits) = (8, 2, 4, 12)
+        curve = gamma_curve(2.2)
+        table = GammaLUT.table(curve, 8, curve_bits)
+        pixels = [random.randint(0, (1 << 24) - 1) for _ in range(width * height)]
+
+        fb = Framebuffer(width, height, pixel_format=PixelFormat.INDEXED8,
+                         palette=pixels[:width * height] + [0] * (256 - width * height))
+        latency = Painter.latency_for(fb, curve)
+        self.assertEqual(latency, 3)
+
+        driver = FakeDriver(latency, width, height, bpp, Modulation.BCM)
+        painter = Painter(driver, side=0, framebuffer=fb, curve=curve, curve_bits=curve_bits)
+
+        m = Module()
+        m.submodules.fb = fb
+        m.submodules.painter = painter
+
+        def expected(pixel, plane):
+            return sum(((table[(pixel >> (8 * c)) & 0xff] >> (curve_bits - bpp + plane)) & 1) << c
+                       for c in range(3))
+
+        def process():
+            # Keep the tracer out of the way
+            yield driver.o_frame.eq(63)
+
+            # Each pixel indexes its own palette entry
+            for addr in range(width * height):
+                yield painter.fb_w_addr.eq(addr)
+                yield painter.fb_w_data.eq(addr)
+                yield painter.fb_w_enable.eq(1)
+                yield
+            yield painter.fb_w_enable.eq(0)
+
+            requests = [(x, y, plane) for y in range(height) for plane in range(bpp) for x in range(width)]
+            for (i, request) in enumerate(requests + [None] * latency):
+                if request is not None:
+                    (x, y, plane) = request
+                    yield driver.o_x.eq(x)
+                    yield driver.o_y0.eq(y)
+                    yield driver.o_subframe.eq(plane)
+                yield
+
+                if i >= latency:
+                    (x, y, plane) = requests[i - latency]
+                    self.assertEqual((yield driver.i_rgb0), expected(pixels[y * width + x], plane),
+                                     "pixel ({}, {}) plane {}".format(x, y, plane))
+
+        sim = Simulator(m)
+        sim.add_clock(1e-6)
+        sim.add_sync_process(process)
+        sim.run()
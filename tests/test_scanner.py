@@ -0,0 +1,258 @@
+from .utils import *
+from amaranth import *
+from amaranth.sim import *
+from unittest import TestCase
+
+from ledpanel import PanelDriver, PixelScanner, Modulation
+
+class BCMScannerCase(TestCase):
+    def test_bcm_sequence(self):
+        bpp = 4
+        bcm_unit = 20
+        dut = PixelScanner(bpp, Modulation.BCM, bcm_unit)
+
+        def testbench():
+            yield dut.i_start.eq(1)
+
+            shifted = []
+            unblanked = 0
+            latched = None
+
+            # (row, plane) pairs in the order they are latched
+            latches = []
+
+            # The control outputs lag the pixel outputs by a cycle
+            (x, plane) = (None, None)
+
+            while len(latches) < 2 * bpp + 1:
+                sclk = yield dut.o_sclk
+                latch = yield dut.o_latch
+                blank = yield dut.o_blank
+
+                if sclk == 0b10:
+                    shifted.append(x)
+
+                if blank == 0b00:
+                    unblanked += 1
+
+                if latch == 0b11:
+                    self.assertEqual(blank, 0b11, "latched while unblanked")
+                    self.assertEqual(shifted, list(range(64)))
+
+                    if latched is not None:
+                        self.assertEqual(unblanked, bcm_unit << latched[1],
+                            "wrong on-time for plane {}".format(latched[1]))
+
+                    latched = ((yield dut.o_addr), plane)
+                    latches.append(latched)
+                    shifted = []
+                    unblanked = 0
+
+                (x, plane) = ((yield dut.o_x), (yield dut.o_subframe))
+                yield
+
+            self.assertEqual(latches, [(row, plane) for row in range(3) for plane in range(bpp)][:len(latches)])
+
+        simulator = Simulator(dut)
+        simulator.add_clock(1e-6)
+        simulator.add_sync_process(testbench)
+        simulator.run()
+
+class ScannerGeometryCase(TestCase):
+    def test_chained_pwm(self):
+        dut = PixelScanner(8, columns=64, scan_rows=16, chain=3)
+        self.assertEqual(dut.o_addr.width, 4)
+        self.assertEqual(dut.o_y0.width, 5)
+
+        def testbench():
+            yield dut.i_start.eq(1)
+
+            shifts = 0
+            addrs = []
+            while len(addrs) < 18:
+                if (yield dut.o_sclk) == 0b10:
+                    shifts += 1
+                    self.assertLess((yield dut.o_x), 192)
+
+                if (yield dut.o_latch) == 0b11:
+                    self.assertEqual(shifts, 192)
+                    addrs.append((yield dut.o_addr))
+                    shifts = 0
+
+                yield
+
+            self.assertEqual(addrs, [y % 16 for y in range(18)])
+
+        simulator = Simulator(dut)
+        simulator.add_clock(1e-6)
+        simulator.add_sync_process(testbench)
+        simulator.run()
+
+class OverlappedScannerCase(TestCase):
+    def run_scanner(self, dut, n_latches, check_cycle):
+        """
+        Runs ``dut`` until it has latched ``n_latches`` rows, calling
+        ``check_cycle(cycle, shifted, latch, blank)`` on every latch. Returns
+        the list of (address, subframe) pairs that were latched.
+        """
+        latches = []
+
+        def testbench():
+            yield dut.i_start.eq(1)
+
+            cycle = 0
+            shifted = []
+            prev_addr = None
+            latched_row = None
+            # The control outputs lag the pixel outputs by a cycle
+            (x, y0, subframe) = (None, None, None)
+            while len(latches) < n_latches:
+                sclk = yield dut.o_sclk
+                latch = yield dut.o_latch
+                blank = yield dut.o_blank
+                addr = yield dut.o_addr
+
+                if prev_addr is not None and addr != prev_addr and dut.precharge_cycles > 0:
+                    self.assertEqual(blank, 0b11, "address changed while unblanked")
+                prev_addr = addr
+
+                # The row address follows the latch
+                if latched_row is not None:
+                    self.assertEqual(addr, latched_row)
+                    latched_row = None
+
+                if sclk == 0b10:
+                    shifted.append(x)
+
+                check_cycle(cycle, blank)
+
+                if latch != 0:
+                    # The latch must come after the last rising edge of sclk,
+                    # and while that half of the cycle is blanked
+                    self.assertEqual(latch & blank, latch)
+                    self.assertEqual(shifted, list(range(dut.width)))
+                    latched_row = y0
+                    latches.append((latched_row, subframe, cycle))
+                    shifted = []
+
+                (x, y0, subframe) = ((yield dut.o_x), (yield dut.o_y0), (yield dut.o_subframe))
+                cycle += 1
+                yield
+
+        simulator = Simulator(dut)
+        simulator.add_clock(1e-6)
+        simulator.add_sync_process(testbench)
+        simulator.run()
+
+        return latches
+
+    def test_pwm_no_dead_cycles(self):
+        blank_cycles = 2
+        precharge_cycles = 3
+        dut = PixelScanner(8, columns=32, scan_rows=4, overlap=True,
+                           blank_cycles=blank_cycles, precharge_cycles=precharge_cycles)
+
+        blanked = []
+        def check_cycle(cycle, blank):
+            if blank == 0b11:
+                blanked.append(cycle)
+
+        latches = self.run_scanner(dut, 10, check_cycle)
+
+        cycles = [c for (_, _, c) in latches]
+        self.assertEqual([b - a for (a, b) in zip(cycles, cycles[1:])], [32] * 9)
+        self.assertEqual([(a, s) for (a, s, _) in latches],
+                         [(y % 4, y // 4) for y in range(10)])
+
+        # Dead time around each row change
+        row_blanked = [c for c in blanked if cycles[4] < c <= cycles[5]]
+        self.assertEqual(len(row_blanked), blank_cycles + precharge_cycles)
+
+    def test_bcm_plane_weights(self):
+        bpp = 4
+        bcm_unit = 8
+        blank_cycles = 1
+        precharge_cycles = 2
+        dut = PixelScanner(bpp, Modulation.BCM, bcm_unit, columns=32, scan_rows=4, overlap=True,
+                           blank_cycles=blank_cycles, precharge_cycles=precharge_cycles)
+
+        unblanked = []
+        def check_cycle(cycle, blank):
+            if blank == 0b00:
+                unblanked.append(cycle)
+
+        latches = self.run_scanner(dut, 2 * bpp + 1, check_cycle)
+
+        self.assertEqual([(a, s) for (a, s, _) in latches],
+                         [(y, p) for y in range(3) for p in range(bpp)][:len(latches)])
+
+        for ((_, plane, start), (_, _, end)) in zip(latches, latches[1:]):
+            on = [c for c in unblanked if start < c <= end]
+            self.assertEqual(len(on), bcm_unit << plane)
+
+            # Planes that fit inside the shift time don't stall the scanner
+            if (bcm_unit << plane) + blank_cycles + precharge_cycles < dut.width:
+                self.assertEqual(end - start, dut.width)
+
+class ColumnPainter(Elaboratable):
+    """ Paints every pixel with its column number, a cycle after it's requested """
+    def __init__(self, driver):
+        self.driver = driver
+        self.latency = 1
+
+    def elaborate(self, platform):
+        m = Module()
+        m.d.sync += [
+            self.driver.i_rgb0.eq(self.driver.o_x),
+            self.driver.i_rgb1.eq(~self.driver.o_x),
+        ]
+        return m
+
+class ScannerDriverCase(TestCase):
+    def check_columns(self, **kwargs):
+        """
+        Checks that every row the driver latches holds the colors the painter
+        gave for each column, in order
+        """
+        driver = PanelDriver(columns=16, scan_rows=2, **kwargs)
+        painter = ColumnPainter(driver)
+        driver.add_painter(painter, 0, 1)
+
+        m = Module()
+        m.submodules += [driver, painter]
+
+        rows = []
+
+        def testbench():
+            # Skip the FM6126 startup sequence, and the first row after it
+            while not (yield driver.o_rdy):
+                yield
+            shifted = None
+            while len(rows) < 6:
+                if shifted is not None and (yield driver.o_sclk) == 0b10:
+                    shifted.append(((yield driver.o_rgb0), (yield driver.o_rgb1)))
+                if (yield driver.o_latch) != 0:
+                    if shifted:
+                        rows.append(shifted)
+                    shifted = []
+                yield
+
+        simulator = Simulator(m)
+        simulator.add_clock(1e-6)
+        simulator.add_sync_process(testbench)
+        simulator.run()
+
+        for row in rows:
+            self.assertEqual(row, [(x & 0b111, ~x & 0b111) for x in range(16)])
+
+    def test_pwm(self):
+        self.check_columns()
+
+    def test_bcm(self):
+        self.check_columns(bpp=3, modulation=Modulation.BCM)
+
+    def test_overlapped_pwm(self):
+        self.check_columns(overlap=True, blank_cycles=2, precharge_cycles=2)
+
+    def test_overlapped_bcm(self):
+        self.check_columns(bpp=3, modulation=Modulation.BCM, overlap=True)
@@ -0,0 +1,30 @@
+import unittest
+
+from tools.sim_bench import find_regressions, run_pysim
+
+def bench_run(commit, cycles_per_second, peak_kb, cycles=1000):
+    result = {
+        'cycles': cycles,
+        'seconds': cycles / cycles_per_second,
+        'cycles_per_second': cycles_per_second,
+        'peak_kb': peak_kb,
+    }
+    return {'commit': commit, 'time': None, 'results': {'panel/pysim': result}}
+
+class SimBenchTest(unittest.TestCase):
+    def test_regressions(self):
+        history = [bench_run('a', 1000, 100), bench_run('b', 2000, 100)]
+
+        # Compared with the last other commit
+        self.assertEqual(find_regressions(history, bench_run('c', 1900, 105), 0.1), [])
+        self.assertEqual(len(find_regressions(history, bench_run('c', 1700, 100), 0.1)), 1)
+        self.assertEqual(len(find_regressions(history, bench_run('c', 1700, 200), 0.1)), 2)
+
+        # Not against earlier runs of the same commit, or other cycle counts
+        self.assertEqual(find_regressions(history, bench_run('b', 1500, 100), 0.1), [])
+        self.assertEqual(find_regressions(history, bench_run('c', 1000, 100, cycles=10), 0.1), [])
+        self.assertEqual(len(find_regressions(history + [bench_run('c', 1000, 100)],
+                                              bench_run('c', 1500, 100), 0.1)), 1)
+
+    def test_pysim(self):
+        self.assertGreater(run_pysim('panel', 100), 0)
@@ -0,0 +1,193 @@
+import unittest
+import random
+
+from .utils import *
+from painters.fluid_sim import Framebuffer, PixelFormat, expand_channel
+from stream import UARTRx, StreamDecoder
+from tools.stream_codec import encode_frame, quantize
+from amaranth import *
+from amaranth.lib.fifo import SyncFIFO
+from amaranth.sim import *
+
+class FakePainter(Elaboratable):
+    """ Just the framebuffer write binding of :class:`Painter` """
+    def __init__(self, framebuffer):
+        self.framebuffer = framebuffer
+        self.fb_w_addr = Signal.like(framebuffer.w_addr)
+        self.fb_w_data = Signal(24)
+        self.fb_w_enable = Signal()
+        self.fb_swap = Signal()
+        self.fb_swapped = Signal()
+        self.fb_swap_pending = Signal()
+
+    def elaborate(self, platform):
+        m = Module()
+        m.d.comb += [
+            self.framebuffer.w_addr.eq(self.fb_w_addr),
+            self.framebuffer.w_data.eq(self.fb_w_data),
+            self.framebuffer.w_enable.eq(self.fb_w_enable),
+            self.framebuffer.swap.eq(self.fb_swap),
+            self.fb_swapped.eq(self.framebuffer.swapped),
+            self.fb_swap_pending.eq(self.framebuffer.swap_pending),
+        ]
+        return m
+
+def expand565(value):
+    (r, g, b) = (value & 0x1f, (value >> 5) & 0x3f, value >> 11)
+    return ((r << 3) | (r >> 2)) | (((g << 2) | (g >> 4)) << 8) | (((b << 3) | (b >> 2)) << 16)
+
+class StreamLoopbackTest(unittest.TestCase):
+    DIVISOR = 10
+
+    def make_frames(self, n_pixels):
+        palette = [random.randint(0, 0xffffff) for _ in range(4)]
+        frame = [random.choice(palette) for _ in range(n_pixels)]
+        frame[3:9] = [palette[0]] * 6
+        frames = [frame]
+        for _ in range(2):
+            frame = list(frame)
+            for i in random.sample(range(n_pixels), 5):
+                frame[i] = random.randint(0, 0xffffff)
+            frames.append(frame)
+        return frames
+
+    def add_vsync(self, m, framebuffers, period=64):
+        """ Swaps the framebuffers every ``period`` cycles, like a driver """
+        counter = Signal(range(period))
+        m.d.sync += counter.eq(Mux(counter == period - 1, 0, counter + 1))
+        m.d.comb += [fb.vsync.eq(counter == 0) for fb in framebuffers]
+
+    def run_loopback(self, pixel_format):
+        (width, height) = (8, 3)
+        n_pixels = 2 * width * height
+        pixel_bytes = 3 if pixel_format == PixelFormat.RGB888 else 2
+
+        m = Module()
+        m.submodules.fb0 = fb0 = Framebuffer(width, height)
+        m.submodules.fb1 = fb1 = Framebuffer(width, height)
+        m.submodules.painter0 = painter0 = FakePainter(fb0)
+        m.submodules.painter1 = painter1 = FakePainter(fb1)
+
+        self.add_vsync(m, [fb0, fb1])
+
+        m.submodules.uart = uart = UARTRx(self.DIVISOR)
+        m.submodules.fifo = fifo = SyncFIFO(width=8, depth=16)
+        m.submodules.dut = dut = StreamDecoder(painter0, painter1, pixel_format)
+        m.d.comb += [
+            fifo.w_data.eq(uart.o_data),
+            fifo.w_en.eq(uart.o_valid),
+            dut.i_data.eq(fifo.r_data),
+            dut.i_valid.eq(fifo.r_rdy),
+            fifo.r_en.eq(dut.o_ready),
+        ]
+
+        frames = self.make_frames(n_pixels)
+        stream = b''.join(encode_frame(frame, previous, pixel_bytes)
+                          for (frame, previous) in zip(frames, [None] + frames))
+        # Deltas and runs make the stream smaller than the raw frames
+        self.assertLess(len(stream), len(frames) * n_pixels * pixel_bytes)
+
+        results = {'frames_done': 0, 'errors': 0}
+
+        def tick():
+            yield
+            results['frames_done'] += yield dut.o_frame_done
+            results['errors'] += yield uart.o_error
+
+        def sender():
+            yield uart.rx.eq(1)
+            for _ in range(self.DIVISOR):
+                yield from tick()
+            for byte in stream:
+                bits = [0] + [(byte >> i) & 1 for i in range(8)] + [1]
+                for bit in bits:
+                    yield uart.rx.eq(bit)
+                    for _ in range(self.DIVISOR):
+                        yield from tick()
+
+            # Let the decoder drain
+            for _ in range(4 * self.DIVISOR + 64):
+                yield from tick()
+
+            for (addr, expected) in enumerate(frames[-1]):
+                fb = fb0 if addr < width * height else fb1
+                yield fb.r_addr.eq(addr % (width * height))
+                yield
+                yield
+                if pixel_format == PixelFormat.RGB565:
+                    expected = expand565(quantize(expected, 2))
+                self.assertEqual((yield fb.r_data), expected, "pixel {}".format(addr))
+
+        sim = Simulator(m)
+        sim.add_clock(1e-6)
+        sim.add_sync_process(sender)
+        sim.run()
+
+        self.assertEqual(results['frames_done'], len(frames))
+        self.assertEqual(results['errors'], 0)
+
+    def test_rgb888(self):
+        self.run_loopback(PixelFormat.RGB888)
+
+    def test_rgb565(self):
+        self.run_loopback(PixelFormat.RGB565)
+
+    def test_back_to_back(self):
+        # Double-buffered, so every frame is a delta against the one before
+        # the last, which is only right if no frame is written into the
+        # buffer being shown
+        (width, height) = (8, 3)
+        n_pixels = 2 * width * height
+
+        m = Module()
+        framebuffers = [Framebuffer(width, height, double_buffered=True) for _ in range(2)]
+        painters = [FakePainter(fb) for fb in framebuffers]
+        m.submodules += framebuffers + painters
+        m.submodules.dut = dut = StreamDecoder(*painters)
+        self.add_vsync(m, framebuffers, period=300)
+
+        frames = self.make_frames(n_pixels)
+        stream = b''.join(encode_frame(frame, previous)
+                          for (frame, previous) in zip(frames, [None, None] + frames))
+
+        results = {'frames_done': 0, 'early_writes': 0}
+
+        def sender():
+            for byte in stream:
+                yield dut.i_data.eq(byte)
+                yield dut.i_valid.eq(1)
+                yield
+                while not (yield dut.o_ready):
+                    yield
+            yield dut.i_valid.eq(0)
+
+        def monitor():
+            yield Passive()
+            while True:
+                results['frames_done'] += yield dut.o_frame_done
+                for painter in painters:
+                    if (yield painter.fb_w_enable) and (yield painter.fb_swap_pending):
+                        results['early_writes'] += 1
+                yield
+
+        def checker():
+            # The last frame is shown after the next frame boundary
+            while results['frames_done'] < len(frames):
+                yield
+            for _ in range(300):
+                yield
+            for (addr, expected) in enumerate(frames[-1]):
+                fb = framebuffers[addr // (width * height)]
+                yield fb.r_addr.eq(addr % (width * height))
+                yield
+                yield
+                self.assertEqual((yield fb.r_data), expected, "pixel {}".format(addr))
+
+        sim = Simulator(m)
+        sim.add_clock(1e-6)
+        sim.add_sync_process(sender)
+        sim.add_sync_process(monitor)
+        sim.add_sync_process(checker)
+        sim.run()
+
+        self.assertEqual(results['early_writes'], 0)
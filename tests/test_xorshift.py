@@ -2,7 +2,7 @@ import unittest
 import random
 
 from .utils import *
-from painters.util import XORShiftRandomizer
+from painters.util import XORShiftRandomizer, LeapAheadRandomizer
 from amaranth import *
 from amaranth.sim import *
 
@@ -54,3 +54,50 @@ class XORShiftBasicTest(unittest.TestCase):
 
         with sim.write_vcd("test.vcd", traces=[ref_signal]):
             sim.run()
+
+class LeapAheadTest(unittest.TestCase):
+    def test_matrix(self):
+        (a, b, c) = (13, 7, 17)
+        rows = LeapAheadRandomizer.leap_ahead(3, a, b, c)
+        for _ in range(10):
+            seed = random.randint(1, (1 << 64) - 1)
+            ref = XORShiftRandomizerReference(seed, a, b, c)
+            for _ in range(3):
+                ref.advance()
+            leapt = sum((bin(seed & row).count('1') & 1) << n for (n, row) in enumerate(rows))
+            self.assertEqual(leapt, ref.state)
+
+    def test_outputs(self):
+        (a, b, c) = (13, 7, 17)
+        for bits in [2, 64, 100]:
+            seed = random.randint(1, (1 << 64) - 1)
+            dut = LeapAheadRandomizer(bits, init=seed, a=a, b=b, c=c)
+            ref = XORShiftRandomizerReference(seed, a, b, c)
+
+            def expected():
+                words = 0
+                for i in range(dut.words):
+                    ref.advance()
+                    words |= ref.state << (64 * i)
+                return words & ((1 << bits) - 1)
+
+            def process():
+                yield dut.req.eq(1)
+                # New bits every cycle
+                for _ in range(8):
+                    self.assertEqual((yield dut.o), expected(), "{} bits".format(bits))
+                    yield
+                    yield Settle()
+
+                # And none while req is low
+                yield dut.req.eq(0)
+                value = yield dut.o
+                yield
+                yield
+                yield Settle()
+                self.assertEqual((yield dut.o), value)
+
+            sim = Simulator(dut)
+            sim.add_clock(1e-6)
+            sim.add_sync_process(process)
+            sim.run()
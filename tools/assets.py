@@ -0,0 +1,220 @@
+"""
+Converts images and animations into data the gateware can use.
+
+Inputs are PNG or GIF files, which need Pillow, or raw RGB24 files holding
+back to back ``width * height`` frames. Outputs are:
+
+``init``
+    JSON with the first frame split into the two framebuffer halves, ready
+    for the ``init`` (and ``palette``) parameters of
+    :class:`painters.fluid_sim.Framebuffer`
+``flash``
+    A looping animation for :class:`flash.FlashPlayer`
+``stream``
+    A stream for :class:`stream.StreamDecoder`, for example to replay with
+    ``tools/send_frames.py``
+
+Identical frames are only encoded once, and animations are sent as deltas
+against the previous frame. Results are cached by the hash of the input and
+the options, so unchanged assets aren't encoded again.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from painters.fluid_sim import PixelFormat
+from tools.stream_codec import encode_frame, control
+from stream import StreamControl, stream_pixel_bytes
+
+#: Bump when the output of this module changes, to invalidate caches
+ASSET_VERSION = 1
+
+KINDS = ['init', 'flash', 'stream']
+
+#: Pixel formats :class:`stream.StreamDecoder` takes, for flash and stream assets
+STREAM_FORMATS = [PixelFormat.RGB888, PixelFormat.RGB565]
+
+def load_frames(path, width, height):
+    """
+    Loads every frame of ``path`` as lists of 24-bit RGB pixels, red in the
+    low byte. Images of a different size are resized.
+    """
+    if path.endswith('.raw'):
+        with open(path, 'rb') as f:
+            data = f.read()
+        frame_bytes = width * height * 3
+        if len(data) == 0 or len(data) % frame_bytes != 0:
+            raise ValueError("{} is not a sequence of {}x{} RGB24 frames".format(path, width, height))
+        return [
+            [int.from_bytes(data[i:i + 3], 'little') for i in range(start, start + frame_bytes, 3)]
+            for start in range(0, len(data), frame_bytes)
+        ]
+
+    try:
+        from PIL import Image, ImageSequence
+    except ImportError:
+        raise RuntimeError("Loading {} needs Pillow: pip install Pillow".format(path))
+
+    frames = []
+    with Image.open(path) as image:
+        for frame in ImageSequence.Iterator(image):
+            frame = frame.convert('RGB')
+            if frame.size != (width, height):
+                frame = frame.resize((width, height))
+            frames.append([r | (g << 8) | (b << 16) for (r, g, b) in frame.getdata()])
+    return frames
+
+def dedupe(frames):
+    """
+    Returns the distinct frames, and the index into them of every frame in
+    ``frames``
+    """
+    unique = []
+    index = {}
+    sequence = []
+    for frame in frames:
+        key = tuple(frame)
+        if key not in index:
+            index[key] = len(unique)
+            unique.append(frame)
+        sequence.append(index[key])
+    return (unique, sequence)
+
+def make_palette(frame):
+    """
+    Picks up to 256 colors for ``frame`` and maps every pixel to the nearest
+    one. Returns ``(indices, palette)``.
+    """
+    counts = {}
+    for pixel in frame:
+        counts[pixel] = counts.get(pixel, 0) + 1
+    colors = sorted(counts, key=lambda c: -counts[c])[:256]
+
+    def distance(a, b):
+        return sum((((a >> s) & 0xff) - ((b >> s) & 0xff)) ** 2 for s in (0, 8, 16))
+
+    nearest = {}
+    for pixel in counts:
+        nearest[pixel] = min(range(len(colors)), key=lambda i: distance(pixel, colors[i]))
+
+    palette = colors + [0] * (256 - len(colors))
+    return ([nearest[p] for p in frame], palette)
+
+def compile_init(frames, pixel_format):
+    pixels = frames[0]
+    half = len(pixels) // 2
+    if pixel_format == PixelFormat.INDEXED8:
+        (pixels, palette) = make_palette(pixels)
+    else:
+        palette = None
+    return json.dumps({
+        'init0': pixels[:half],
+        'init1': pixels[half:],
+        'palette': palette,
+    }).encode()
+
+def compile_stream(frames, pixel_format, double_buffered):
+    if pixel_format not in STREAM_FORMATS:
+        raise ValueError("Streams can't carry {} pixels, only {}".format(
+            pixel_format.name, ", ".join(f.name for f in STREAM_FORMATS)))
+    pixel_bytes = stream_pixel_bytes(pixel_format)
+    history = 2 if double_buffered else 1
+    (unique, sequence) = dedupe(frames)
+
+    # Animations often repeat, so only encode each pair of distinct frames
+    # once
+    encoded = {}
+    out = bytearray()
+    for (i, frame) in enumerate(sequence):
+        previous = sequence[i - history] if i >= history else None
+        if previous == frame:
+            # Nothing to draw, just show it again
+            out.extend(control(StreamControl.START_OF_FRAME))
+            out.extend(control(StreamControl.END_OF_FRAME))
+            continue
+        if (frame, previous) not in encoded:
+            encoded[(frame, previous)] = encode_frame(
+                unique[frame], None if previous is None else unique[previous], pixel_bytes)
+        out.extend(encoded[(frame, previous)])
+    return bytes(out)
+
+def compile_frames(frames, kind, pixel_format, double_buffered=False):
+    if kind == 'init':
+        return compile_init(frames, pixel_format)
+    elif kind == 'flash':
+        return compile_stream(frames, pixel_format, double_buffered) + \
+            control(StreamControl.END_OF_STREAM)
+    elif kind == 'stream':
+        return compile_stream(frames, pixel_format, double_buffered)
+    raise ValueError("Unknown asset kind {}".format(kind))
+
+def cache_key(path, kind, width, height, pixel_format, double_buffered):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        h.update(f.read())
+    h.update(json.dumps([ASSET_VERSION, os.path.splitext(path)[1], kind, width, height,
+                         pixel_format.name, double_buffered]).encode())
+    return h.hexdigest()
+
+def compile_asset(path, kind, width=64, height=64, pixel_format=PixelFormat.RGB888,
+                  double_buffered=False, cache_dir='build/asset-cache'):
+    """
+    Converts the asset at ``path``, or returns the cached result from a
+    previous run with the same input and options. Pass ``cache_dir=None`` to
+    skip the cache.
+    """
+    if cache_dir is not None:
+        key = cache_key(path, kind, width, height, pixel_format, double_buffered)
+        cached = os.path.join(cache_dir, key)
+        if os.path.exists(cached):
+            with open(cached, 'rb') as f:
+                return f.read()
+
+    frames = load_frames(path, width, height)
+    data = compile_frames(frames, kind, pixel_format, double_buffered)
+
+    if cache_dir is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        # Write then rename, so an interrupted run doesn't leave a bad entry
+        with open(cached + '.tmp', 'wb') as f:
+            f.write(data)
+        os.replace(cached + '.tmp', cached)
+
+    return data
+
+def load_init(path, width, height, pixel_format, **kwargs):
+    """
+    Returns ``(init0, init1, palette)`` for the framebuffers of a ``width`` by
+    ``2 * height`` panel
+    """
+    data = json.loads(compile_asset(path, 'init', width, 2 * height, pixel_format, **kwargs))
+    return (data['init0'], data['init1'], data['palette'])
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("input", help="PNG, GIF, or raw RGB24 frames")
+    parser.add_argument("output")
+    parser.add_argument("--kind", choices=KINDS, default='flash')
+    parser.add_argument("--width", type=int, default=64)
+    parser.add_argument("--height", type=int, default=64)
+    parser.add_argument("--format", choices=[f.name for f in PixelFormat], default='RGB888')
+    parser.add_argument("--double-buffered", action="store_true")
+    parser.add_argument("--cache-dir", default='build/asset-cache')
+    parser.add_argument("--no-cache", action="store_true")
+    args = parser.parse_args()
+    if args.kind != 'init' and PixelFormat[args.format] not in STREAM_FORMATS:
+        parser.error("--kind {} needs --format {}".format(
+            args.kind, " or ".join(f.name for f in STREAM_FORMATS)))
+
+    data = compile_asset(args.input, args.kind, args.width, args.height, PixelFormat[args.format],
+                         args.double_buffered, None if args.no_cache else args.cache_dir)
+    with open(args.output, 'wb') as f:
+        f.write(data)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""
+Emulates the LED panel from the outputs of :class:`ledpanel.PanelDriver`, so
+simulations can look at the image the panel would show.
+
+This follows ``blinker_tb.cpp``, without the cxxrtl build. Each half of the
+panel has a shift register per channel, which takes a bit on every rising
+edge of ``sclk`` and is copied to the output latches on the falling edge of
+``latch``. While ``blank`` is low the latched row selected by ``addr`` is lit,
+and the time each LED is lit is added up over a frame. ``sclk``, ``latch``
+and ``blank`` are DDR outputs: bit 0 is driven for the first half of the
+cycle and bit 1 for the second half, so everything is tracked in half
+cycles.
+
+Lit time is only added to the brightness when the latches or the row
+change, a whole row at a time, which keeps long simulations fast. Needs
+NumPy.
+
+Example::
+
+    emulator = PanelEmulator(driver.width, driver.scan_rows)
+    sim.add_sync_process(emulator.process(driver))
+    sim.run_until(...)
+    emulator.frames[1]
+"""
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from amaranth.sim import Passive
+
+
+class PanelEmulator:
+    """
+    Model of a panel of ``2 * scan_rows`` rows of ``width`` pixels.
+
+    Attributes
+    ----------
+    brightness : ndarray of shape (2 * scan_rows, width, 3)
+        Half cycles each LED has been lit for in the current frame, indexed
+        by row, column and channel (R, G, B)
+    frames : list of ndarray
+        ``brightness`` of each finished frame. The first one starts with the
+        simulation, so it usually holds part of a frame.
+    """
+    def __init__(self, width=64, scan_rows=32):
+        if np is None:
+            raise RuntimeError("PanelEmulator needs NumPy: pip install numpy")
+
+        self.width = width
+        self.scan_rows = scan_rows
+
+        self.brightness = np.zeros((2 * scan_rows, width, 3), dtype=np.uint32)
+        self.frames = []
+
+        # Shift registers of both halves, as a ring buffer of columns
+        self.shift = np.zeros((2, width, 3), dtype=np.uint32)
+        self.shift_pos = 0
+        self.latched = np.zeros((2, width, 3), dtype=np.uint32)
+
+        self.addr = 0
+        self.frame = None
+        self.sclk = 0
+        self.latch = 0
+        # Half cycles lit since the latches or the row last changed
+        self.lit = 0
+
+    @staticmethod
+    def bits(rgb):
+        return [(rgb >> c) & 1 for c in range(3)]
+
+    def flush(self):
+        """ Adds the time since the last change to the lit row """
+        if self.lit:
+            self.brightness[self.addr] += self.latched[0] * self.lit
+            self.brightness[self.addr + self.scan_rows] += self.latched[1] * self.lit
+            self.lit = 0
+
+    def step(self, rgb0, rgb1, addr, blank, latch, sclk, frame=None):
+        """
+        Advances by one clock cycle with the panel outputs sampled in it.
+        ``frame`` is :attr:`ledpanel.PanelDriver.o_frame`, a new frame is
+        started whenever it changes.
+        """
+        if frame != self.frame:
+            self.flush()
+            if self.frame is not None:
+                self.frames.append(self.brightness.copy())
+                self.brightness[:] = 0
+            self.frame = frame
+
+        if addr != self.addr:
+            self.flush()
+            self.addr = addr
+
+        for half in range(2):
+            sclk_half = (sclk >> half) & 1
+            latch_half = (latch >> half) & 1
+            blank_half = (blank >> half) & 1
+
+            if sclk_half and not self.sclk:
+                self.shift[0, self.shift_pos] = self.bits(rgb0)
+                self.shift[1, self.shift_pos] = self.bits(rgb1)
+                self.shift_pos = (self.shift_pos + 1) % self.width
+
+            if self.latch and not latch_half:
+                self.flush()
+                # The oldest column is the one furthest along the chain
+                self.latched = np.roll(self.shift, -self.shift_pos, axis=1)
+
+            if not blank_half:
+                self.lit += 1
+
+            self.sclk = sclk_half
+            self.latch = latch_half
+
+    def process(self, driver):
+        """
+        Returns a process for :meth:`amaranth.sim.Simulator.add_sync_process`
+        which feeds the emulator from ``driver``, anything with the panel
+        outputs of :class:`ledpanel.PanelDriver`, such as ``HighSpeedLogic``.
+        The process is passive, so it runs for as long as the simulation.
+        """
+        def process():
+            yield Passive()
+            while True:
+                self.step((yield driver.o_rgb0), (yield driver.o_rgb1), (yield driver.o_addr),
+                          (yield driver.o_blank), (yield driver.o_latch), (yield driver.o_sclk),
+                          (yield driver.o_frame))
+                yield
+        return process
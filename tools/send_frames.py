@@ -0,0 +1,67 @@
+"""
+Streams raw RGB24 frames to the panel over the iCEBreaker's UART.
+
+Needs pyserial. Frames are read from a file of back to back ``width *
+height`` RGB24 images, such as the output of
+``ffmpeg -i video.mp4 -f rawvideo -pix_fmt rgb24 -s 64x64 frames.raw``.
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from tools.stream_codec import encode_frame
+
+def read_frames(f, width, height):
+    frame_bytes = width * height * 3
+    while True:
+        data = f.read(frame_bytes)
+        if len(data) < frame_bytes:
+            return
+        yield [int.from_bytes(data[i:i + 3], 'little') for i in range(0, frame_bytes, 3)]
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("port", help="serial port, for example /dev/ttyUSB1")
+    parser.add_argument("frames", help="raw RGB24 frames")
+    parser.add_argument("--width", type=int, default=64)
+    parser.add_argument("--height", type=int, default=64)
+    parser.add_argument("--baud", type=int, default=3000000)
+    parser.add_argument("--fps", type=float, default=30)
+    parser.add_argument("--rgb565", action="store_true",
+                        help="send 16-bit pixels, must match the bitstream")
+    parser.add_argument("--double-buffered", action="store_true",
+                        help="the bitstream uses double-buffered framebuffers")
+    parser.add_argument("--loop", action="store_true")
+    args = parser.parse_args()
+
+    try:
+        import serial
+    except ImportError:
+        sys.exit("send_frames needs pyserial: pip install pyserial")
+
+    pixel_bytes = 2 if args.rgb565 else 3
+
+    # Deltas are against what the buffer being written holds
+    history = 2 if args.double_buffered else 1
+
+    with serial.Serial(args.port, args.baud) as port:
+        while True:
+            sent = [None] * history
+            with open(args.frames, 'rb') as f:
+                for frame in read_frames(f, args.width, args.height):
+                    start = time.monotonic()
+                    port.write(encode_frame(frame, sent[0], pixel_bytes))
+                    sent = sent[1:] + [frame]
+
+                    delay = 1 / args.fps - (time.monotonic() - start)
+                    if delay > 0:
+                        time.sleep(delay)
+            if not args.loop:
+                break
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,299 @@
+"""
+Measures how fast each simulator runs the design, to pick the backend for
+each kind of test and to catch simulation slowdowns.
+
+Targets are simulated for a fixed number of cycles on every backend that is
+available here:
+
+``pysim``
+    amaranth's Python simulator, which the unit tests use
+``cxxrtl``
+    The design compiled to C++ by yosys, like ``blinker_tb``. Needs yosys
+    and a C++ compiler.
+``icarus``
+    The Verilog output in Icarus Verilog, like ``top_testbench.v``. Needs
+    yosys and iverilog.
+
+Targets are ``panel``, :class:`ledpanel.PanelDriver` with address test
+painters, ``fluid``, :class:`painters.fluid_sim.FluidSim` drawing into
+framebuffers scanned out by a driver, and ``top``, the whole
+:class:`main.HighSpeedLogic` as configured in ``main.py``.
+
+Each measurement runs in its own process, and records the simulated cycles
+per second, not counting elaboration or compilation, and the peak memory
+of that process. Results are appended to a JSON history, and compared with
+the last run from a different commit. Slowdowns or memory growth beyond
+``--threshold`` are reported as regressions, and make the exit status 1.
+"""
+
+import argparse
+import datetime
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+TARGETS = ['panel', 'fluid', 'top']
+BACKENDS = ['pysim', 'cxxrtl', 'icarus']
+
+# Cycles to simulate on each backend, so every benchmark takes a few
+# seconds
+CYCLES = {
+    'pysim': 2000,
+    'cxxrtl': 1000000,
+    'icarus': 100000,
+}
+
+CXXRTL_MAIN = """
+#include <chrono>
+#include <cstdlib>
+#include <iostream>
+
+#include "design.cpp"
+
+int main(int argc, const char ** argv) {
+  uint64_t cycles = std::strtoull(argv[1], nullptr, 10);
+  cxxrtl_design::p_top top;
+  top.step();
+
+  auto start = std::chrono::steady_clock::now();
+  for (uint64_t i = 0; i < cycles; ++i) {
+    top.p_clk.set<bool>(true);
+    top.step();
+    top.p_clk.set<bool>(false);
+    top.step();
+  }
+  std::chrono::duration<double> elapsed = std::chrono::steady_clock::now() - start;
+  std::cout << elapsed.count() << std::endl;
+}
+"""
+
+ICARUS_MAIN = """
+module bench();
+  reg clk = 0;
+  reg rst = 0;
+  integer i;
+
+  top top(.clk(clk), .rst(rst));
+
+  initial begin
+    for (i = 0; i < {cycles}; i = i + 1) begin
+      #1 clk = 1;
+      #1 clk = 0;
+    end
+    $finish;
+  end
+endmodule
+"""
+
+def build_target(target):
+    """ Returns the design for ``target``, and its ports """
+    from amaranth import Module
+    from ledpanel import PanelDriver
+
+    if target == 'panel':
+        from painters.address_test import CycleAddrTest
+        driver = PanelDriver()
+        painters = [CycleAddrTest(3, driver, side=side) for side in (0, 1)]
+        for (side, painter) in enumerate(painters):
+            driver.add_painter(painter, side)
+
+        m = Module()
+        m.submodules += [driver] + painters
+        return (m, driver.panel_output_ports())
+
+    if target == 'fluid':
+        from painters.fluid_sim import Framebuffer, Painter, FluidSim
+        driver = PanelDriver()
+        framebuffers = [Framebuffer(driver.width, driver.scan_rows) for _ in range(2)]
+        painters = [Painter(driver, side, fb) for (side, fb) in enumerate(framebuffers)]
+        for (side, painter) in enumerate(painters):
+            driver.add_painter(painter, side)
+
+        m = Module()
+        m.submodules += [driver, FluidSim(*painters)] + framebuffers + painters
+        return (m, driver.panel_output_ports())
+
+    if target == 'top':
+        from main import HighSpeedLogic
+        logic = HighSpeedLogic()
+        return (logic, logic.ports())
+
+    raise ValueError("Unknown target {}".format(target))
+
+def available(backend):
+    if backend == 'pysim':
+        return True
+    if shutil.which('yosys') is None:
+        return False
+    if backend == 'cxxrtl':
+        return shutil.which('yosys-config') is not None and shutil.which('c++') is not None
+    if backend == 'icarus':
+        return shutil.which('iverilog') is not None and shutil.which('vvp') is not None
+    raise ValueError("Unknown backend {}".format(backend))
+
+def run_process(args):
+    """ Runs ``args``, and returns its output and peak memory in kB """
+    process = subprocess.Popen(args, stdout=subprocess.PIPE, text=True)
+    output = process.stdout.read()
+    (_, status, usage) = os.wait4(process.pid, 0)
+    # Let Popen know the process is gone
+    process.returncode = os.waitstatus_to_exitcode(status)
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, args)
+    return (output, usage.ru_maxrss)
+
+def run_pysim(target, cycles):
+    """ Simulates ``target`` in this process, and returns the seconds taken """
+    from amaranth.sim import Simulator
+
+    (design, _) = build_target(target)
+    sim = Simulator(design)
+    sim.add_clock(1e-6)
+
+    start = time.perf_counter()
+    sim.run_until(cycles * 1e-6, run_passive=True)
+    return time.perf_counter() - start
+
+def measure(target, backend, cycles, build_dir):
+    """ Returns the seconds ``target`` takes to run for ``cycles``, and the peak memory """
+    if backend == 'pysim':
+        (output, peak_kb) = run_process([sys.executable, __file__, '--pysim-child', target, str(cycles)])
+        return (float(output), peak_kb)
+
+    from amaranth.back import cxxrtl, verilog
+
+    (design, ports) = build_target(target)
+    os.makedirs(build_dir, exist_ok=True)
+
+    if backend == 'cxxrtl':
+        with open(os.path.join(build_dir, 'design.cpp'), 'w') as f:
+            f.write(cxxrtl.convert(design, ports=ports))
+        with open(os.path.join(build_dir, 'main.cpp'), 'w') as f:
+            f.write(CXXRTL_MAIN)
+        include = subprocess.run(['yosys-config', '--datdir/include'], check=True,
+                                 capture_output=True, text=True).stdout.strip()
+        binary = os.path.join(build_dir, 'bench')
+        subprocess.run(['c++', '-std=c++14', '-O2', '-I' + include, '-o', binary,
+                        os.path.join(build_dir, 'main.cpp')], check=True)
+        (output, peak_kb) = run_process([binary, str(cycles)])
+        return (float(output), peak_kb)
+
+    if backend == 'icarus':
+        with open(os.path.join(build_dir, 'design.v'), 'w') as f:
+            f.write(verilog.convert(design, ports=ports))
+        with open(os.path.join(build_dir, 'bench.v'), 'w') as f:
+            f.write(ICARUS_MAIN.replace('{cycles}', str(cycles)))
+        binary = os.path.join(build_dir, 'bench.vvp')
+        subprocess.run(['iverilog', '-o', binary, os.path.join(build_dir, 'design.v'),
+                        os.path.join(build_dir, 'bench.v')], check=True)
+        # vvp loads the design before simulating, which is counted here
+        start = time.perf_counter()
+        (_, peak_kb) = run_process(['vvp', '-n', binary])
+        return (time.perf_counter() - start, peak_kb)
+
+    raise ValueError("Unknown backend {}".format(backend))
+
+def current_commit():
+    """ Returns the checked out commit, with ``-dirty`` if there are changes, or None """
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], check=True,
+                                capture_output=True, text=True).stdout.strip()
+        changes = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], check=True,
+                                 capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit + '-dirty' if changes else commit
+
+def find_regressions(history, run, threshold):
+    """
+    Compares ``run`` with the last run in ``history`` from a different commit
+    that has the same benchmark for the same number of cycles. Returns a
+    list of messages, one for each benchmark which got slower or used more
+    memory by more than ``threshold``.
+    """
+    regressions = []
+    for (name, result) in run['results'].items():
+        for previous in reversed(history):
+            if previous['commit'] == run['commit']:
+                continue
+            old = previous['results'].get(name)
+            if old is None or old['cycles'] != result['cycles']:
+                continue
+
+            if result['cycles_per_second'] < old['cycles_per_second'] * (1 - threshold):
+                regressions.append("{}: {:.0f} cycles/s, was {:.0f} at {}".format(
+                    name, result['cycles_per_second'], old['cycles_per_second'], previous['commit']))
+            if result['peak_kb'] > old['peak_kb'] * (1 + threshold):
+                regressions.append("{}: {} kB peak memory, was {} at {}".format(
+                    name, result['peak_kb'], old['peak_kb'], previous['commit']))
+            break
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--targets", nargs="+", choices=TARGETS, default=TARGETS)
+    parser.add_argument("--backends", nargs="+", choices=BACKENDS, default=BACKENDS)
+    parser.add_argument("--cycles", type=int, help="cycles to simulate, instead of the backend's default")
+    parser.add_argument("--history", default="build/sim-bench.json",
+                        help="JSON file the results are added to")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="relative slowdown or memory growth to report as a regression")
+    parser.add_argument("--no-record", action="store_true",
+                        help="compare with the history, but don't add this run to it")
+    parser.add_argument("--pysim-child", nargs=2, metavar=("TARGET", "CYCLES"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.pysim_child:
+        (target, cycles) = args.pysim_child
+        print(run_pysim(target, int(cycles)))
+        return 0
+
+    run = {
+        'commit': current_commit(),
+        'time': datetime.datetime.now().isoformat(timespec='seconds'),
+        'results': {},
+    }
+
+    with tempfile.TemporaryDirectory() as build_root:
+        for backend in args.backends:
+            if not available(backend):
+                print("{}: not available, skipped".format(backend))
+                continue
+            for target in args.targets:
+                cycles = args.cycles or CYCLES[backend]
+                build_dir = os.path.join(build_root, backend, target)
+                (seconds, peak_kb) = measure(target, backend, cycles, build_dir)
+                name = '{}/{}'.format(target, backend)
+                run['results'][name] = {
+                    'cycles': cycles,
+                    'seconds': seconds,
+                    'cycles_per_second': cycles / seconds,
+                    'peak_kb': peak_kb,
+                }
+                print("{:<14} {:>9} cycles in {:7.2f}s: {:>10.0f} cycles/s, {:>8} kB peak"
+                      .format(name, cycles, seconds, cycles / seconds, peak_kb))
+
+    history = []
+    if os.path.exists(args.history):
+        with open(args.history) as f:
+            history = json.load(f)
+
+    regressions = find_regressions(history, run, args.threshold)
+    for regression in regressions:
+        print("REGRESSION " + regression)
+
+    if not args.no_record:
+        os.makedirs(os.path.dirname(args.history) or '.', exist_ok=True)
+        with open(args.history, 'w') as f:
+            json.dump(history + [run], f, indent=1)
+
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,118 @@
+"""
+Checkpoints for amaranth simulations, so a simulation can start from a
+steady state instead of replaying reset, the FM6126 startup sequence and
+FluidSim's SIM_INIT fill every time.
+
+A checkpoint holds the value of every register and memory word of a design,
+by hierarchical name. They are captured from a simulator process, and
+restored by making them the reset values of a freshly elaborated copy of the
+same design, so the simulation starts out in the checkpointed state.
+Anything a testbench drives itself isn't part of the design's state, and has
+to be set up again after restoring.
+
+Example::
+
+    fragment = Fragment.get(HighSpeedLogic(), None)
+    sim = Simulator(fragment)
+    def process():
+        while not (yield logic.driver.o_rdy):
+            yield
+        checkpoint = yield from capture(fragment)
+        checkpoint.save('warm.json')
+    ...
+
+    fragment = Fragment.get(HighSpeedLogic(), None)
+    restore(fragment, Checkpoint.load('warm.json'))
+    sim = Simulator(fragment)
+
+The design has to be handed to the simulator as the elaborated fragment,
+since elaborating it again creates new signals.
+"""
+
+import json
+
+
+def state_signals(fragment, hierarchy=("top",)):
+    """
+    Returns the signals holding the state of ``fragment``, the ones driven
+    from a clock domain, including memory words, by hierarchical name
+    """
+    # Only the fragments' drivers and subfragments are used, rather than the
+    # names amaranth gives signals when preparing a design, which aren't
+    # public API. Names are only unique within a checkpoint, since they're
+    # given in the same order every time the design is elaborated.
+    signals = {}
+    names = set()
+    for (domain, driven) in fragment.drivers.items():
+        if domain is None:
+            continue
+        for signal in driven:
+            name = signal.name
+            if name in names:
+                name = "{}${}".format(name, len(names))
+            names.add(name)
+            signals[".".join(hierarchy + (name,))] = signal
+
+    for (index, (subfragment, name)) in enumerate(fragment.subfragments):
+        if name is None:
+            name = "U${}".format(index)
+        signals.update(state_signals(subfragment, hierarchy + (name,)))
+    return signals
+
+
+class Checkpoint:
+    """
+    Snapshot of the state of a design.
+
+    Attributes
+    ----------
+    state : dict of str to int
+        Values of the signals returned by :func:`state_signals`
+    cycles : int
+        Number of cycles simulated before the snapshot, for the testbench's
+        bookkeeping
+    """
+    def __init__(self, state, cycles=0):
+        self.state = state
+        self.cycles = cycles
+
+    def save(self, path):
+        with open(path, 'w') as outf:
+            json.dump({'cycles': self.cycles, 'state': self.state}, outf)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as inf:
+            saved = json.load(inf)
+        return cls(saved['state'], saved['cycles'])
+
+
+def capture(fragment, cycles=0):
+    """
+    Snapshots the state of ``fragment``, which must be the fragment being
+    simulated. This is a generator for simulator processes, use it as
+    ``checkpoint = yield from capture(fragment)``.
+    """
+    state = {}
+    for (name, signal) in state_signals(fragment).items():
+        state[name] = yield signal
+    return Checkpoint(state, cycles)
+
+
+def restore(fragment, checkpoint):
+    """
+    Makes ``checkpoint`` the initial state of ``fragment``. This has to be
+    done before the simulator is created. Asserting the design's reset puts
+    it back in the checkpointed state, rather than its usual reset state.
+
+    Raises :class:`ValueError` if the checkpoint doesn't match the design.
+    """
+    signals = state_signals(fragment)
+    if signals.keys() != checkpoint.state.keys():
+        missing = sorted(signals.keys() - checkpoint.state.keys())
+        extra = sorted(checkpoint.state.keys() - signals.keys())
+        raise ValueError("Checkpoint doesn't match the design: {} missing, {} unknown (e.g. {})"
+                         .format(len(missing), len(extra), (missing + extra)[0]))
+
+    for (name, signal) in signals.items():
+        signal.reset = checkpoint.state[name]
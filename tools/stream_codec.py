@@ -0,0 +1,94 @@
+"""
+Host side encoder for the :class:`stream.StreamDecoder` byte stream.
+
+Frames are lists of 24-bit RGB pixel values, red in the low byte, numbered
+row-major across the whole panel.
+"""
+
+from stream import StreamOp, StreamControl, STREAM_MAX_COUNT
+
+#: Repeated pixels shorter than this are cheaper to send as literals
+MIN_REPEAT = 3
+
+def command(op, count):
+    assert 1 <= count <= STREAM_MAX_COUNT
+    return bytes([(op << 6) | (count - 1)])
+
+def control(code):
+    return bytes([(StreamOp.CONTROL << 6) | code])
+
+def quantize(pixel, pixel_bytes):
+    """ Drops the bits a ``pixel_bytes`` wide wire format can't carry """
+    if pixel_bytes == 3:
+        return pixel
+    (r, g, b) = (pixel & 0xff, (pixel >> 8) & 0xff, (pixel >> 16) & 0xff)
+    return (r >> 3) | ((g >> 2) << 5) | ((b >> 3) << 11)
+
+def run_length(values, start, match):
+    end = start
+    while end < len(values) and end - start < STREAM_MAX_COUNT and match(end):
+        end += 1
+    return end - start
+
+def encode_frame(frame, previous=None, pixel_bytes=3):
+    """
+    Encodes ``frame`` as a delta against ``previous``, which must be what the
+    framebuffer being written holds: the last frame sent, or the one before
+    that with double-buffered framebuffers. Pass ``previous=None`` to send
+    every pixel.
+    """
+    frame = [quantize(p, pixel_bytes) for p in frame]
+    if previous is not None:
+        assert len(previous) == len(frame)
+        previous = [quantize(p, pixel_bytes) for p in previous]
+
+    def unchanged(i):
+        return previous is not None and frame[i] == previous[i]
+
+    out = bytearray(control(StreamControl.START_OF_FRAME))
+
+    i = 0
+    literal = []
+    def flush_literal():
+        for start in range(0, len(literal), STREAM_MAX_COUNT):
+            chunk = literal[start:start + STREAM_MAX_COUNT]
+            out.extend(command(StreamOp.LITERAL, len(chunk)))
+            for p in chunk:
+                out.extend(p.to_bytes(pixel_bytes, 'little'))
+        literal.clear()
+
+    while i < len(frame):
+        skip = run_length(frame, i, unchanged)
+        repeat = run_length(frame, i, lambda j: frame[j] == frame[i])
+
+        if skip > 0 and skip >= repeat:
+            flush_literal()
+            out.extend(command(StreamOp.SKIP, skip))
+            i += skip
+        elif repeat >= MIN_REPEAT:
+            flush_literal()
+            out.extend(command(StreamOp.REPEAT, repeat))
+            out.extend(frame[i].to_bytes(pixel_bytes, 'little'))
+            i += repeat
+        else:
+            literal.append(frame[i])
+            i += 1
+    flush_literal()
+
+    out.extend(control(StreamControl.END_OF_FRAME))
+    return bytes(out)
+
+def encode_animation(frames, pixel_bytes=3, double_buffered=False):
+    """
+    Encodes a sequence of frames for playback from flash, ending with
+    :attr:`stream.StreamControl.END_OF_STREAM` so the player loops back to
+    the start. The first frames are sent in full, so the loop doesn't depend
+    on what was shown before it.
+    """
+    history = 2 if double_buffered else 1
+    out = bytearray()
+    for (i, frame) in enumerate(frames):
+        previous = frames[i - history] if i >= history else None
+        out.extend(encode_frame(frame, previous, pixel_bytes))
+    out.extend(control(StreamControl.END_OF_STREAM))
+    return bytes(out)